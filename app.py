@@ -15,7 +15,8 @@ from python_scripts.handlers.ipfs_handler import IPFSHandler
 from python_scripts.dht.group_dht import GroupDHT
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from python_scripts.public_chat.bucket_manager import BucketManager
-from python_scripts.public_chat.chat_node import ChatNode
+from python_scripts.public_chat.node_registry import ChatNodeRegistry
+from python_scripts.public_chat.socketio_bridge import SocketIOBridge
 import smtplib
 import random
 import mimetypes
@@ -46,9 +47,22 @@ upload_executor = ThreadPoolExecutor(max_workers=5)
 upload_status = {}
 active_group_dhts = {}
 active_users = {}
-chat_nodes = {}
+chat_nodes = ChatNodeRegistry()
 bucket_manager = BucketManager()
 
+def reload_external_buckets(user_ids):
+    """Reload local chat nodes whose bucket was updated by another worker process"""
+    for user_id in user_ids:
+        node = chat_nodes.get(user_id)
+        if node:
+            node.reload_bucket(
+                bucket_manager.get_bucket_hash(user_id),
+                bucket_manager.get_sent_requests_hash(user_id),
+                bucket_manager.get_received_requests_hash(user_id)
+            )
+
+bucket_manager.subscribe(reload_external_buckets)
+
 load_dotenv()
 
 # Flask Application Setup
@@ -1228,17 +1242,17 @@ def handle_community_file_upload():
         if not file or not community_id:
             return jsonify({'error': 'Invalid request parameters'}), 400
             
-        # Read file content
-        file_content = file.read()
         filename = secure_filename(file.filename)
         
-        # Register file with CommunityFileHandler
+        # Register file with CommunityFileHandler, which streams it to disk
         file_metadata = CommunityFileHandler.register_file(
-            file_content=file_content,
+            file_content=file,
             filename=filename,
             user_id=current_user.id,
             community_id=community_id
         )
+        if not file_metadata:
+            return jsonify({'error': 'Failed to store file'}), 500
         
         # Create a message to notify about the shared file
         message = Message(
@@ -1248,7 +1262,7 @@ def handle_community_file_upload():
             content=f"Shared file: {filename}",
             file_info={
                 'name': filename,
-                'size': len(file_content),
+                'size': file_metadata['size'],
                 'type': file.content_type,
                 'hash': file_metadata['hash']
             }
@@ -1283,36 +1297,17 @@ def download_community_file(file_hash, filename):
         if not community_id:
             return jsonify({'error': 'Community ID not provided'}), 400
             
-        # Get the file content
-        file_content = CommunityFileHandler.get_shared_file(file_hash)
-        if not file_content:
+        # Get the file on disk
+        file_path = CommunityFileHandler.get_shared_path(file_hash)
+        if not file_path:
             return jsonify({'error': 'File not found'}), 404
 
-        # Create a temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False)
-        temp_path = temp_file.name
-        
-        # Write the content to the temp file
-        with open(temp_path, 'wb') as f:
-            if isinstance(file_content, str):
-                f.write(file_content.encode())
-            else:
-                f.write(file_content)
-
         # Get MIME type
         mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
 
-        # Clean up the temp file after sending
-        @after_this_request
-        def cleanup(response):
-            try:
-                os.unlink(temp_path)
-            except Exception as e:
-                app.logger.error(f"Error cleaning up temp file: {e}")
-            return response
-
+        # Served from disk by the WSGI server's file wrapper, or by the front end with USE_X_SENDFILE
         return send_file(
-            temp_path,
+            file_path,
             mimetype=mime_type,
             as_attachment=True,
             download_name=filename,
@@ -1321,8 +1316,6 @@ def download_community_file(file_hash, filename):
 
     except Exception as e:
         app.logger.error(f"Download error: {str(e)}")
-        if os.path.exists(temp_path):
-            os.unlink(temp_path)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/community/share_file', methods=['POST'])
@@ -1338,22 +1331,18 @@ def share_community_file():
         if not file or not community_id:
             return jsonify({'success': False, 'error': 'Invalid request'}), 400
             
-        # Calculate file hash and info
-        file_content = file.read()
-        file_hash = hashlib.sha256(file_content).hexdigest()
-        file_size = len(file_content)
-        file_type = mimetypes.guess_type(file.filename)[0] or 'application/octet-stream'
-        
-        # Reset file pointer
-        file.seek(0)
-        
-        # Store file in memory/cache
-        CommunityFileHandler.shared_files[file_hash] = {
-            'data': file_content,
-            'name': file.filename,
-            'type': file_type,
-            'size': file_size
-        }
+        # Store the file on disk, hashing it on the way
+        file_metadata = CommunityFileHandler.register_file(
+            file_content=file,
+            filename=file.filename,
+            user_id=current_user.id,
+            community_id=community_id
+        )
+        if not file_metadata:
+            return jsonify({'success': False, 'error': 'Failed to store file'}), 500
+        file_hash = file_metadata['hash']
+        file_size = file_metadata['size']
+        file_type = file_metadata['mime_type']
         
         # Create message in database
         message = Message(
@@ -1488,7 +1477,7 @@ def handle_join_chat():
             
         # Create chat node if doesn't exist
         if user_id not in chat_nodes:
-            chat_nodes[user_id] = ChatNode(user_id, current_user.username)
+            chat_nodes.get_or_create(user_id, current_user.username)
             
             # Get existing bucket hash and sync
             existing_hash = bucket_manager.get_bucket_hash(user_id)
@@ -1535,7 +1524,11 @@ def handle_message(data):
         result = node.broadcast_message(content)
         
         # Update bucket hash in manager
-        bucket_manager.update_bucket_hash(user_id, result['bucket_hash'])
+        bucket_manager.update_bucket_hash(
+            user_id,
+            result['bucket_hash'],
+            node.secure_bucket.mutation_summary(result['bucket_hash'])
+        )
         
         # Send to all peers
         emit('new_message', {
@@ -1561,7 +1554,7 @@ def handle_check_bucket():
         
         # Create chat node if bucket exists but node doesn't
         if has_bucket and user_id not in chat_nodes:
-            chat_nodes[user_id] = ChatNode(user_id, current_user.username)
+            chat_nodes.get_or_create(user_id, current_user.username)
             chat_nodes[user_id].sync_with_peer(bucket_hash)
         
         emit('bucket_status', {
@@ -1580,7 +1573,7 @@ def handle_create_bucket():
         
         # Create new chat node if it doesn't exist
         if user_id not in chat_nodes:
-            chat_nodes[user_id] = ChatNode(user_id, current_user.username)
+            chat_nodes.get_or_create(user_id, current_user.username)
         
         # Get bucket hash
         bucket_hash = chat_nodes[user_id].get_bucket_hash()
@@ -1616,7 +1609,7 @@ def handle_sync_request(data):
         new_hash = node.sync_with_peer(peer_bucket_hash)
         
         # Update bucket hash in manager
-        bucket_manager.update_bucket_hash(user_id, new_hash)
+        bucket_manager.update_bucket_hash(user_id, new_hash, node.secure_bucket.mutation_summary(new_hash))
         
         # Broadcast new bucket hash
         emit('bucket_updated', {
@@ -1627,6 +1620,39 @@ def handle_sync_request(data):
     except Exception as e:
         emit('error', {'message': str(e)})
 
+def shares_group(user_id, other_id):
+    """Whether two users are members of at least one common group"""
+    own_groups = db.session.query(GroupMember.group_id).filter_by(user_id=user_id)
+    return GroupMember.query.filter(GroupMember.user_id == other_id,
+                                    GroupMember.group_id.in_(own_groups)).first() is not None
+
+@socketio.on('get_bucket_changes')
+@authenticated_only
+def handle_get_bucket_changes(data):
+    try:
+        user_id = str(data.get('user_id') or current_user.id)
+        # A bucket's history is readable by its owner and by members of a group the owner is in
+        if user_id != str(current_user.id) and not (user_id.isdigit() and shares_group(current_user.id, int(user_id))):
+            emit('error', {'message': 'Not allowed to read this bucket'})
+            return
+        since_hash = data.get('since')
+        if not since_hash:
+            emit('error', {'message': 'Missing base bucket hash'})
+            return
+            
+        # Deltas between the peer's known CID and the current one, if still in the chain
+        changes = bucket_manager.get_changes_since(user_id, since_hash)
+        emit('bucket_changes', {
+            'user_id': user_id,
+            'since': since_hash,
+            'bucket_hash': bucket_manager.get_bucket_hash(user_id),
+            'full_sync_required': changes is None,
+            'changes': changes or []
+        })
+        
+    except Exception as e:
+        emit('error', {'message': str(e)})
+
 @socketio.on('typing')
 def handle_typing(data):
     room = data.get('room')
@@ -1799,7 +1825,7 @@ def handle_get_my_files():
         if user_id not in chat_nodes:
             bucket_hash = bucket_manager.get_bucket_hash(user_id)
             if bucket_hash:
-                chat_nodes[user_id] = ChatNode(user_id, current_user.username)
+                chat_nodes.get_or_create(user_id, current_user.username)
                 chat_nodes[user_id].secure_bucket.sync_with_peer(bucket_hash)
         
         node = chat_nodes.get(user_id)
@@ -1844,7 +1870,7 @@ def download_shared_file(file_id, filename):
         # Get user's chat node
         user_id = str(current_user.id)
         if user_id not in chat_nodes:
-            chat_nodes[user_id] = ChatNode(user_id, current_user.username)
+            chat_nodes.get_or_create(user_id, current_user.username)
             
         # Get file content from secure bucket
         file_content = chat_nodes[user_id].secure_bucket.get_file_content(file_id)
@@ -1893,7 +1919,7 @@ def handle_store_message(data):
         
         # Get or create chat node
         if user_id not in chat_nodes:
-            chat_nodes[user_id] = ChatNode(user_id, current_user.username)
+            chat_nodes.get_or_create(user_id, current_user.username)
         
         # Create message structure
         message = {
@@ -1906,7 +1932,11 @@ def handle_store_message(data):
         
         # Store message and get updated bucket hash
         result = chat_nodes[user_id].broadcast_message(content)
-        bucket_manager.update_bucket_hash(user_id, result['bucket_hash'])
+        bucket_manager.update_bucket_hash(
+            user_id,
+            result['bucket_hash'],
+            chat_nodes[user_id].secure_bucket.mutation_summary(result['bucket_hash'])
+        )
         
         # Emit new message to all clients in p2p_chat room
         emit('new_message', message, broadcast=True, room='p2p_chat')
@@ -1924,8 +1954,7 @@ def handle_clear_chat():
         # Get user's chat node
         node = chat_nodes.get(user_id)
         if not node:
-            node = ChatNode(user_id, current_user.username)
-            chat_nodes[user_id] = node
+            node = chat_nodes.get_or_create(user_id, current_user.username)
             
         # Check if there's any history to clear
         current_history = node.get_chat_history()
@@ -2040,8 +2069,7 @@ def handle_get_chat_history():
         user_id = str(current_user.id)
         node = chat_nodes.get(user_id)
         if not node:
-            node = ChatNode(user_id, current_user.username)
-            chat_nodes[user_id] = node
+            node = chat_nodes.get_or_create(user_id, current_user.username)
             
         chat_history = node.get_chat_history()
         emit('chat_history', {'messages': chat_history})
@@ -2055,6 +2083,29 @@ def handle_get_chat_history():
 def peer_files():
     return render_template('peer_files.html')
 
+@app.route('/api/chat_nodes/stats', methods=['GET'])
+@login_required
+def get_chat_node_stats():
+    return jsonify({
+        'success': True,
+        'stats': chat_nodes.stats()
+    })
+
+@app.route('/api/p2p/search_stats', methods=['GET'])
+@login_required
+def get_p2p_search_stats():
+    node = chat_nodes.get(str(current_user.id))
+    if not node or not node.p2p_started:
+        return jsonify({'success': False, 'error': 'Node not found'}), 404
+    return jsonify({
+        'success': True,
+        'stats': {
+            **node.p2p_network.router.stats(),
+            'summaries': node.p2p_network.summaries.stats(),
+            'dedupe': node.p2p_network.processed_messages.stats()
+        }
+    })
+
 @app.route('/api/peer_files', methods=['GET'])
 @login_required
 def get_peer_files():
@@ -2163,6 +2214,11 @@ def handle_p2p_file_request(data):
         filename = data.get('filename')
         source = data.get('source')
         
+        # A source is the [host, port, file_id, node_id] of a search result
+        if not isinstance(source, (list, tuple)) or len(source) != 4 or not str(source[1]).isdigit():
+            emit('error', {'message': 'Invalid file source'})
+            return
+        
         # Request file from peer
         if hasattr(chat_nodes[str(current_user.id)], 'p2p_network'):
             chat_nodes[str(current_user.id)].p2p_network.request_file(
@@ -2237,30 +2293,41 @@ def handle_file_search(data):
         # Use P2P flooding for search
         user_id = str(current_user.id)
         if user_id in chat_nodes and hasattr(chat_nodes[user_id], 'p2p_network'):
-            # Initiate flood search
-            chat_nodes[user_id].p2p_network.flood_search(query)
-            
-            # Wait briefly for responses to come in
-            time.sleep(2)  # Adjust timeout as needed
-            
-            # Get collected results from the P2P network
-            results = []
-            for filename, sources in chat_nodes[user_id].p2p_network.file_sources.items():
-                for host, port, file_id in sources:
-                    results.append({
-                        'name': filename,
-                        'username': f'Peer at {host}:{port}',
+            bridge = SocketIOBridge.get_instance()
+            sid = request.sid
+
+            def stream_results(query_id, hits):
+                bridge.emit('search_results', {
+                    'success': True,
+                    'query_id': query_id,
+                    'results': [{
+                        'name': hit['filename'],
+                        'size': hit.get('size'),
+                        'username': hit.get('username') or f"Peer at {hit['host']}:{hit['port']}",
                         'source': {
-                            'host': host,
-                            'port': port,
-                            'file_id': file_id
+                            'host': hit['host'],
+                            'port': hit['port'],
+                            'file_id': hit['file_id'],
+                            'node_id': hit['node_id']
                         }
-                    })
-            
-            emit('search_results', {
-                'success': True,
-                'results': results
-            })
+                    } for hit in hits],
+                    'done': False
+                }, room=sid)
+
+            def complete_search(query_id, count, reason):
+                bridge.emit('search_complete', {
+                    'success': True,
+                    'query_id': query_id,
+                    'count': count,
+                    'reason': reason
+                }, room=sid)
+
+            # Hits stream to this client as search_results events; search_complete follows
+            # after the deadline or once enough hits arrive. The client may pick a routing strategy.
+            query_id = chat_nodes[user_id].p2p_network.flood_search(
+                query, data.get('strategy'), on_results=stream_results, on_complete=complete_search
+            )
+            emit('search_started', {'success': True, 'query_id': query_id})
         
     except Exception as e:
         print(f"Error in P2P search: {e}")
@@ -2290,7 +2357,7 @@ def download_peer_file_alternate(user_id, file_id, filename):
     try:
         # Get the peer's chat node
         if user_id not in chat_nodes:
-            chat_nodes[user_id] = ChatNode(user_id, current_user.username)
+            chat_nodes.get_or_create(user_id, current_user.username)
             
         node = chat_nodes[user_id]
         
@@ -2337,9 +2404,10 @@ def handle_file_download(data):
         # Request file from peer using P2P network
         user_id = str(current_user.id)
         if user_id in chat_nodes and hasattr(chat_nodes[user_id], 'p2p_network'):
-            chat_nodes[user_id].p2p_network.request_file(
+            # Fetches from every known source holding the file, starting with the chosen one
+            chat_nodes[user_id].p2p_network.download_file(
                 filename,
-                (source['host'], source['port'], source['file_id'])
+                (source['host'], source['port'], source['file_id'], source.get('node_id'))
             )
             
             # The P2P network will handle receiving the file and emitting the download_ready event
@@ -2353,11 +2421,22 @@ def handle_file_download(data):
 def download_temp_file(filename):
     try:
         user_id = str(current_user.id)
-        if user_id not in chat_nodes:
+        node = chat_nodes.get(user_id)
+        # Downloads outlive idle stops of the flood network, so serve them without restarting it
+        temp_files = node.downloads if node else None
+        if temp_files is None:
             return jsonify({'error': 'Node not found'}), 404
             
-        temp_dir = chat_nodes[user_id].p2p_network.temp_directory
-        return send_from_directory(temp_dir, filename, as_attachment=True)
+        # Pin the file so quota eviction leaves it alone until the response is sent
+        if not temp_files.acquire(filename):
+            return jsonify({'error': 'File not found'}), 404
+        try:
+            response = send_from_directory(temp_files.directory, filename, as_attachment=True)
+        except Exception:
+            temp_files.release(filename)
+            raise
+        response.call_on_close(lambda: temp_files.release(filename))
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -2369,13 +2448,8 @@ def handle_flood_share(data):
         # Create a unique file ID
         file_id = f"{current_user.id}_{time.time()}"
         
-        # Store file info in memory
-        shared_files[file_id] = {
-            'name': data['name'],
-            'size': data['size'],
-            'data': data['data'],
-            'owner': current_user.id
-        }
+        # Store the file on disk so downloads are served from there
+        save_flood_file(file_id, data['name'], data['data'], current_user.id)
         
         # Broadcast to connected peers - Fix the emit syntax
         socketio.emit('flood_new_file', {
@@ -2396,7 +2470,27 @@ def handle_flood_share(data):
     except Exception as e:
         emit('error', {'message': str(e)})
 
-shared_files = {}
+shared_files = {}  # file_id -> name, size, path on disk and owner
+
+def save_flood_file(file_id, name, content, owner):
+    """Write a flood upload to disk and record it in shared_files"""
+    os.makedirs(Config.SHARED_FILES_FOLDER, exist_ok=True)
+    CommunityFileHandler.prune_shared_files()
+    for stale_id in [fid for fid, info in shared_files.items() if not os.path.isfile(info['path'])]:
+        shared_files.pop(stale_id, None)
+    path = os.path.join(Config.SHARED_FILES_FOLDER, secure_filename(f"flood_{file_id}"))
+    if hasattr(content, 'save'):
+        content.save(path)
+    else:
+        with open(path, 'wb') as f:
+            f.write(content.encode() if isinstance(content, str) else content)
+    shared_files[file_id] = {
+        'name': name,
+        'size': os.path.getsize(path),
+        'path': path,
+        'owner': owner
+    }
+    return shared_files[file_id]
 
 @socketio.on('flood_search')
 @authenticated_only
@@ -2438,16 +2532,8 @@ def handle_flood_upload():
             filename = secure_filename(file.filename)
             file_id = f"{current_user.id}_{time.time()}_{filename}"
             
-            # Read file content directly from request
-            file_content = file.read()
-                
-            # Store in shared_files dictionary
-            shared_files[file_id] = {
-                'name': filename,
-                'size': len(file_content),
-                'data': file_content,
-                'owner': current_user.id
-            }
+            # Stream the upload to disk instead of holding it in memory
+            save_flood_file(file_id, filename, file, current_user.id)
             
             # Broadcast to peers
             socketio.emit('flood_new_file', {
@@ -2477,21 +2563,9 @@ def handle_flood_download(file_id):
             
         file_info = shared_files[file_id]
         
-        # Create a temporary file
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            temp_file.write(file_info['data'])
-            temp_path = temp_file.name
-            
-        @after_this_request
-        def cleanup(response):
-            try:
-                os.unlink(temp_path)
-            except Exception as e:
-                app.logger.error(f"Error cleaning up temp file: {e}")
-            return response
-            
+        # Served from disk by the WSGI server's file wrapper, or by the front end with USE_X_SENDFILE
         return send_file(
-            temp_path,
+            file_info['path'],
             as_attachment=True,
             download_name=file_info['name'],
             max_age=0
@@ -2554,14 +2628,17 @@ def handle_public_chat_message(data):
         # Get user's chat node
         node = chat_nodes.get(user_id)
         if not node:
-            node = ChatNode(user_id, current_user.username)
-            chat_nodes[user_id] = node
+            node = chat_nodes.get_or_create(user_id, current_user.username)
             
         # Create and broadcast message
         result = node.broadcast_message(content)
         
         # Update bucket hash in manager
-        bucket_manager.update_bucket_hash(user_id, result['bucket_hash'])
+        bucket_manager.update_bucket_hash(
+            user_id,
+            result['bucket_hash'],
+            node.secure_bucket.mutation_summary(result['bucket_hash'])
+        )
         
         # Send to all peers
         emit('new_message', {
@@ -0,0 +1,45 @@
+import sys
+import time
+from python_scripts.public_chat.bucket_manager import BucketManager
+
+class BucketRollback:
+    def __init__(self):
+        self.bucket_manager = BucketManager()
+
+    def show_history(self, user_id):
+        history = self.bucket_manager.get_bucket_history(user_id)
+        current_hash = self.bucket_manager.get_bucket_hash(user_id)
+        if not history:
+            print(f"No bucket history for user {user_id}")
+            return
+        for entry in history:
+            marker = '*' if entry['hash'] == current_hash else ' '
+            summary = entry['summary'] or {}
+            timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['timestamp']))
+            print(f"{marker} {entry['hash']}  {timestamp}  {summary.get('op', '-')}")
+
+    def rollback(self, user_id, bucket_hash):
+        if self.bucket_manager.rollback_bucket(user_id, bucket_hash):
+            self.bucket_manager.flush()
+            print(f"Bucket for user {user_id} now points at {bucket_hash}")
+        else:
+            print(f"{bucket_hash} is not in the version chain for user {user_id}")
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python bucket_rollback.py <user_id> [bucket_hash]")
+        return
+
+    tool = BucketRollback()
+    try:
+        if len(sys.argv) == 2:
+            tool.show_history(sys.argv[1])
+        else:
+            tool.rollback(sys.argv[1], sys.argv[2])
+    except Exception as e:
+        print(f"An error occurred: {str(e)}")
+    finally:
+        tool.bucket_manager.close()
+
+if __name__ == "__main__":
+    main()
@@ -46,6 +46,12 @@ class Config:
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
     MAX_CONTENT_LENGTH = 100 * 1024 * 1024
+
+    # Shared file serving
+    SHARED_FILES_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp_uploads', 'shared')  # Flood and community uploads, served straight from disk
+    SHARED_FILES_MAX_AGE = 7 * 24 * 3600  # Seconds an upload stays on disk; the registries are in memory only
+    SHARED_FILES_QUOTA = 5 * 1024 ** 3  # Bytes kept in SHARED_FILES_FOLDER, oldest uploads pruned first
+    USE_X_SENDFILE = False  # Let a fronting web server send files named in an X-Sendfile header
     
     #FERNET KEY CONFIGURATION
     ENCRYPTION_KEY = b'klMnjhfScy3lsuzmSu5yaxhzeortgmCOBI2XOdaullo='
@@ -55,3 +61,72 @@ class Config:
     IPFS_API_PORT = 5001
     IPFS_GATEWAY_PORT = 8080
     IPFS_TIMEOUT = 30  # Increased timeout for network operations
+
+    # Group chat DHT
+    DHT_RING_BITS = 32  # Ring of 2**bits positions, with one finger per bit; wide enough that thousands of members don't collide
+    DHT_REQUEST_TIMEOUT = 0.5  # Seconds to wait for a UDP reply before resending
+    DHT_REQUEST_RETRIES = 2  # Resends of an unanswered request before the peer is given up on
+    DHT_MAX_DATAGRAM = 60000  # Largest encoded DHT message; bigger values are refused rather than lost
+    DHT_MAX_HOPS = 32  # Nodes a lookup may visit before it fails
+    DHT_STABILIZE_INTERVAL = 2  # Seconds between successor checks, each also refreshing one finger
+
+    # Public chat bucket store
+    BUCKET_COMMIT_INTERVAL = 0.05  # Seconds to collect updates into one group commit
+    BUCKET_MAX_BATCH_SIZE = 500  # Commit immediately once this many users are pending
+    BUCKET_WATCH_INTERVAL = 0.5  # Seconds between checks for other worker processes' commits
+    BUCKET_HISTORY_LENGTH = 50  # Prior CIDs kept per bucket for rollback and differential sync
+
+    # Public chat node registry
+    CHAT_NODE_LIMIT = 200  # Live ChatNodes kept before least recently used ones are evicted
+    CHAT_NODE_IDLE_TIMEOUT = 15 * 60  # Seconds without use before a ChatNode is evicted
+    CHAT_NODE_REAP_INTERVAL = 60  # Seconds between idle eviction sweeps
+    P2P_IDLE_TIMEOUT = 5 * 60  # Seconds without peer traffic before a node's flood network is stopped
+
+    # Public chat P2P flood network
+    P2P_HOST = '0.0.0.0'  # Interface the shared P2P listener binds to
+    P2P_PORT = 0  # Port of the shared P2P listener, 0 picks a free port
+    P2P_ADVERTISE_HOST = None  # Address given to remote peers, detected when None
+    P2P_CONNECT_TIMEOUT = 5  # Seconds to wait when connecting to another server's endpoint
+    P2P_LOCAL_PEERS = 4  # Co-located nodes each new flood network links to
+    P2P_DEDUPE_WINDOW = 120  # Seconds a flooded message ID is remembered
+    P2P_DEDUPE_GENERATIONS = 4  # Bloom filter generations the window is split into
+    P2P_DEDUPE_INITIAL_CAPACITY = 1024  # IDs per generation for a quiet node
+    P2P_DEDUPE_MAX_CAPACITY = 200000  # Upper bound on IDs per generation
+    P2P_DEDUPE_ERROR_RATE = 0.0001  # Target false-positive rate per generation
+    P2P_HANDLER_THREADS = 4  # Pool that runs message handlers for the P2P event loop
+    P2P_EMIT_INTERVAL = 0.05  # Seconds between drains of P2P events into Socket.IO
+    P2P_CHUNK_SIZE = 256 * 1024  # Bytes per file transfer chunk
+    P2P_TRANSFER_WINDOW = 16  # Unacknowledged chunks a sender may have in flight
+    P2P_TRANSFER_TIMEOUT = 60  # Seconds before an idle transfer is abandoned
+    P2P_PIECE_SIZE = 1024 * 1024  # Bytes per verified piece in a multi-source download
+    P2P_SWARM_PIPELINE = 2  # Pieces requested from one source at a time
+    P2P_SWARM_MAX_FAILURES = 3  # Failed pieces before a source is dropped from a download
+    P2P_SWARM_STALL_TIMEOUT = 10  # Seconds without data before a piece is reassigned
+    P2P_PARTIAL_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp_uploads', 'p2p_partial')  # Unfinished downloads kept for resuming, by content root
+    P2P_PARTIAL_MAX_AGE = 7 * 24 * 3600  # Seconds an unfinished download is kept without progress
+    P2P_NODE_DISK_QUOTA = 1024 * 1024 * 1024  # Downloaded bytes one node keeps before evicting least recently used files
+    P2P_DISK_QUOTA = 10 * 1024 * 1024 * 1024  # Downloaded bytes all nodes in this process keep together
+    P2P_SERVE_CACHE_BYTES = 256 * 1024 * 1024  # Decrypted shared files spooled to disk while being served
+    P2P_SEARCH_STRATEGY = 'flood'  # Default routing: 'flood', 'expanding_ring' or 'random_walk'; only flood keeps full recall
+    P2P_SEARCH_TTL = 7  # Hops a flooded search may travel
+    P2P_RING_DELAY = 0.3  # Seconds per hop to wait before widening an expanding-ring search
+    P2P_RING_TARGET_HITS = 3  # Hits that stop an expanding-ring search from widening
+    P2P_WALKERS = 4  # Random walkers sent per query
+    P2P_WALK_TTL = 32  # Hops a random walker may take
+    P2P_HIT_CACHE_TTL = 60  # Seconds a query's hits are reused to answer the same non-flood query
+    P2P_HIT_CACHE_SIZE = 256  # Queries kept in the hit cache
+    P2P_ROUTING_TOKENS = 1024  # Query tokens for which neighbour answer counts are kept
+    P2P_TRACKED_QUERIES = 64  # Recent searches whose hits are counted
+    P2P_SEARCH_DEADLINE = 5  # Seconds before a search is reported complete
+    P2P_SEARCH_QUORUM = 50  # Hits after which a search is reported complete early
+    P2P_KNOWN_FILES = 1000  # File names whose search sources are remembered for downloads
+    P2P_OUTBOUND_LIMIT = 4 * 1024 * 1024  # Buffered bytes per connection beyond which flooded searches are dropped
+    P2P_MIN_DEGREE = 3  # Neighbours a flood network tries to keep
+    P2P_MAX_DEGREE = 8  # Neighbours beyond which new links are refused
+    P2P_KEEPALIVE_INTERVAL = 15  # Seconds between pings to each remote neighbour
+    P2P_PEER_TIMEOUT = 45  # Seconds of silence after which a neighbour is pruned
+    P2P_SUMMARY_DEPTH = 3  # Hop levels in the attenuated Bloom filter of file names exchanged with neighbours
+    P2P_SUMMARY_BITS = 64 * 1024  # Bits per summary level
+    P2P_SUMMARY_HASHES = 3  # Hash functions per summary level
+    P2P_SUMMARY_INTERVAL = 5  # Seconds between summary refreshes; only changed levels are sent
+    P2P_SUMMARY_FANOUT = 2  # Neighbours still probed when no summary matches within the horizon
@@ -0,0 +1,66 @@
+import argparse
+import json
+from python_scripts.public_chat.flood_simulator import TOPOLOGIES, FloodSimulator
+from python_scripts.public_chat.query_routing import SEARCH_STRATEGIES
+
+def compare(report, baseline, path=''):
+    """Print every numeric metric that differs from the baseline run"""
+    for key, value in report.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        name = f"{path}.{key}" if path else key
+        if isinstance(value, dict):
+            compare(value, old or {}, name)
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and value != old:
+            change = f" ({(value - old) / old * 100:+.1f}%)" if old else ''
+            print(f"  {name}: {old} -> {value}{change}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the P2P flood overlay with in-process nodes on loopback")
+    parser.add_argument('--nodes', type=int, default=100)
+    parser.add_argument('--servers', type=int, default=None, help="endpoints the nodes are spread over (default: one per node)")
+    parser.add_argument('--handler-threads', type=int, default=1, help="handler pool size per endpoint")
+    parser.add_argument('--topology', choices=TOPOLOGIES, default='random')
+    parser.add_argument('--degree', type=int, default=4, help="average links per node")
+    parser.add_argument('--titles', type=int, default=200, help="distinct file names, replicated by Zipf popularity")
+    parser.add_argument('--files-per-node', type=int, default=3)
+    parser.add_argument('--file-size', type=int, default=64 * 1024)
+    parser.add_argument('--strategy', choices=SEARCH_STRATEGIES, default=None)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=20, help="searches started per second")
+    parser.add_argument('--downloads', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help="write the report to this JSON file")
+    parser.add_argument('--baseline', help="compare against a report saved earlier with --save")
+    args = parser.parse_args()
+
+    simulator = FloodSimulator(
+        nodes=args.nodes, servers=args.servers, topology=args.topology, degree=args.degree,
+        titles=args.titles, files_per_node=args.files_per_node, file_size=args.file_size,
+        seed=args.seed, handler_threads=args.handler_threads
+    )
+    try:
+        simulator.start()
+        if not simulator.wait_for_overlay():
+            print("Warning: not every link completed its handshake")
+        report = {
+            'overlay': simulator.describe(),
+            'search': simulator.run_searches(args.queries, args.rate, args.strategy),
+            'download': simulator.run_downloads(args.downloads) if args.downloads else {}
+        }
+        print(json.dumps(report, indent=2))
+
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump(report, f, indent=2)
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            print(f"Changes against {args.baseline}:")
+            compare(report, baseline)
+    except Exception as e:
+        print(f"An error occurred: {str(e)}")
+    finally:
+        simulator.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,118 @@
 from hashlib import sha256
+import os
 import socket
 import json
 import threading
 import time
+import uuid
+from config import Config
+
+class DHTError(Exception):
+    """Raised when a value can't be stored or sent through the DHT"""
+    pass
+
+class DHTContact:
+    """Address and ring position of a DHT node, as carried in messages"""
+
+    def __init__(self, ip_address, port, position):
+        self.ip = ip_address
+        self.port = int(port)
+        self.position = int(position)
+
+    @property
+    def address(self):
+        return (self.ip, self.port)
+
+    def to_list(self):
+        return [self.ip, self.port, self.position]
+
+    @classmethod
+    def from_list(cls, data):
+        return cls(*data) if data else None
+
+    def __eq__(self, other):
+        return isinstance(other, DHTContact) and self.address == other.address
+
+    def __hash__(self):
+        return hash(self.address)
+
+    def __repr__(self):
+        return f"{self.ip}:{self.port}@{self.position}"
 
 class DHTNode:
     def __init__(self, ip_address, port, user_id):
+        # Setup socket
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((ip_address, port))
+        self.running = False
+
         self.ip = ip_address
-        self.port = port
+        self.port = self.socket.getsockname()[1]
         self.user_id = user_id
-        self.position = self._hash(f"{ip_address}:{port}") % 1024  # 10-bit ring
+        self.ring_size = 2 ** Config.DHT_RING_BITS
+        self.position = self._hash(f"{ip_address}:{self.port}") % self.ring_size
+        self.contact = DHTContact(self.ip, self.port, self.position)
         self.data_store = {}
-        self.finger_table = {}
-        self.successor = None
+        self.finger_table = {}  # {2**i: DHTContact} successor of position + 2**i
+        self.successor = self.contact  # A lone node is its own successor
         self.predecessor = None
+        self.pending = {}  # {request_id: [threading.Event, reply]} requests awaiting a response
+        self._next_finger = 0
+        self._lock = threading.Lock()
+        self._data_lock = threading.RLock()  # Guards data_store and its file; the listener and maintenance threads both write
         self.storage_file = f"dht_storage_{user_id}.json"
         self._load_stored_data()
-        
-        # Setup socket
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.bind((ip_address, port))
-        self.running = False
+
+        # Lookup and transport counters
+        self.lookups = 0
+        self.lookup_failures = 0
+        self.hops_total = 0
+        self.hops_max = 0
+        self.latency_total = 0.0
+        self.requests_sent = 0
+        self.retries = 0
+        self.timeouts = 0
 
     def _hash(self, key):
         """Hash function for both node positions and data"""
         return int(sha256(str(key).encode()).hexdigest(), 16)
 
+    def key_position(self, key):
+        """Ring position a key is stored at"""
+        return self._hash(key) % self.ring_size
+
     def start(self):
         """Start the DHT node"""
         self.running = True
         self.listener_thread = threading.Thread(target=self._listen)
         self.listener_thread.daemon = True
         self.listener_thread.start()
+        self.maintenance_thread = threading.Thread(target=self._maintain)
+        self.maintenance_thread.daemon = True
+        self.maintenance_thread.start()
+
+    def stop(self):
+        """Stop the DHT node and release its socket"""
+        self.running = False
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)  # Wakes the listener, whose blocked recvfrom holds the port
+        except OSError:
+            pass  # Unconnected UDP sockets report ENOTCONN but are still shut down
+        self.socket.close()
+        listener = getattr(self, 'listener_thread', None)
+        if listener is not None and listener is not threading.current_thread():
+            listener.join(timeout=1)
 
     def _listen(self):
         """Listen for incoming DHT messages"""
         while self.running:
             try:
-                data, addr = self.socket.recvfrom(4096)
+                data, addr = self.socket.recvfrom(65535)
+            except OSError:
+                break  # Socket closed by stop()
+            if not self.running:
+                break
+            try:
                 message = json.loads(data.decode())
                 self._handle_message(message, addr)
             except Exception as e:
@@ -45,13 +120,247 @@ class DHTNode:
 
     def _handle_message(self, message, addr):
         """Handle incoming DHT messages"""
+        if message.get('type') == 'response':
+            self._handle_response(message)
+            return
+        reply = self._answer(message)
+        if reply is not None and message.get('request_id'):
+            self._send(addr, {**reply, 'type': 'response', 'request_id': message['request_id']})
+
+    def _answer(self, message):
+        """Reply fields for a request; handlers only read and update local state, so the listener never blocks"""
         msg_type = message.get('type')
         if msg_type == 'store':
-            self._handle_store(message)
+            return self._handle_store(message)
         elif msg_type == 'retrieve':
-            self._handle_retrieve(message, addr)
+            return self._handle_retrieve(message)
         elif msg_type == 'find_successor':
-            self._handle_find_successor(message, addr)
+            return self._handle_find_successor(message)
+        elif msg_type == 'get_predecessor':
+            return self._handle_get_predecessor(message)
+        elif msg_type == 'notify':
+            return self._handle_notify(message)
+        elif msg_type == 'ping':
+            return {}
+        return None
+
+    def _handle_response(self, message):
+        with self._lock:
+            waiter = self.pending.get(message.get('request_id'))
+        if waiter is not None:
+            waiter[1] = message
+            waiter[0].set()
+
+    def _handle_store(self, message):
+        return {'stored': self.store_data(message['key'], message['value'])}
+
+    def _handle_retrieve(self, message):
+        with self._data_lock:
+            data = self.data_store.get(message['key'])
+        return {'found': data is not None, 'value': data['value'] if data else None}
+
+    def _handle_find_successor(self, message):
+        """One step of an iterative lookup: the owner of the target if we know it, else a node closer to it"""
+        target = int(message['target']) % self.ring_size
+        successor = self.successor
+        if self._in_range(target, self.position, successor.position, inclusive=True):
+            return {'done': True, 'node': successor.to_list()}
+        closer = self._closest_preceding_node(target)
+        if closer == self.contact:
+            return {'done': True, 'node': successor.to_list()}
+        return {'done': False, 'node': closer.to_list()}
+
+    def _handle_get_predecessor(self, message):
+        return {'node': self.predecessor.to_list() if self.predecessor else None}
+
+    def _handle_notify(self, message):
+        """A node thinks it is our predecessor"""
+        candidate = DHTContact.from_list(message.get('sender'))
+        if candidate is not None and candidate != self.contact and (
+                self.predecessor is None
+                or self._in_range(candidate.position, self.predecessor.position, self.position)):
+            self.predecessor = candidate
+        return {}
+
+    def _send(self, address, message):
+        payload = json.dumps(message).encode()
+        if len(payload) > Config.DHT_MAX_DATAGRAM:
+            # Too big to answer in one datagram; the requester times out and reports the failure
+            print(f"Error sending DHT message to {address}: {len(payload)} bytes exceeds the datagram limit")
+            return
+        try:
+            self.socket.sendto(payload, tuple(address))
+        except OSError as e:
+            if self.running:
+                print(f"Error sending DHT message to {address}: {e}")
+
+    def _request(self, contact, message):
+        """Send a request and wait for its response, resending on timeout; returns None if it never came"""
+        message = {**message, 'sender': self.contact.to_list()}
+        if contact == self.contact:
+            return self._answer(message)
+
+        request_id = uuid.uuid4().hex
+        waiter = [threading.Event(), None]
+        with self._lock:
+            self.pending[request_id] = waiter
+        # Resends keep the request id, so a late answer to an earlier attempt still counts
+        payload = json.dumps({**message, 'request_id': request_id}).encode()
+        if len(payload) > Config.DHT_MAX_DATAGRAM:
+            with self._lock:
+                self.pending.pop(request_id, None)
+            raise DHTError(f"DHT {message['type']} of {len(payload)} bytes exceeds the "
+                           f"{Config.DHT_MAX_DATAGRAM} byte datagram limit")
+        try:
+            for attempt in range(Config.DHT_REQUEST_RETRIES + 1):
+                if attempt:
+                    self.retries += 1
+                self.requests_sent += 1
+                try:
+                    self.socket.sendto(payload, contact.address)
+                except OSError as e:
+                    print(f"Error sending DHT {message['type']} to {contact}: {e}")
+                    return None
+                if waiter[0].wait(Config.DHT_REQUEST_TIMEOUT):
+                    return waiter[1]
+                self.timeouts += 1
+            return None
+        finally:
+            with self._lock:
+                self.pending.pop(request_id, None)
+
+    def _in_range(self, position, start, end, inclusive=False):
+        """Whether position lies clockwise in (start, end), or (start, end] if inclusive; start == end spans the ring"""
+        offset = (position - start) % self.ring_size
+        span = (end - start) % self.ring_size or self.ring_size
+        return 0 < offset < span or (inclusive and offset == span % self.ring_size)
+
+    def _closest_preceding_node(self, target):
+        """The known node furthest along the ring that still precedes target"""
+        candidates = [contact for contact in list(self.finger_table.values()) + [self.successor]
+                      if self._in_range(contact.position, self.position, target)]
+        return max(candidates, key=lambda contact: (contact.position - self.position) % self.ring_size,
+                   default=self.contact)
+
+    def find_successor(self, position, start=None):
+        """Iteratively find the node responsible for a ring position; returns (DHTContact or None, hops)"""
+        started = time.time()
+        node = start or self.contact
+        hops = 0
+        while hops <= Config.DHT_MAX_HOPS:
+            reply = self._request(node, {'type': 'find_successor', 'target': position})
+            if node != self.contact:
+                hops += 1
+            if reply is None:
+                break
+            found = DHTContact.from_list(reply['node'])
+            if reply.get('done'):
+                self._record_lookup(hops, time.time() - started)
+                return found, hops
+            node = found
+        with self._lock:
+            self.lookup_failures += 1
+        return None, hops
+
+    def _record_lookup(self, hops, latency):
+        with self._lock:
+            self.lookups += 1
+            self.hops_total += hops
+            self.hops_max = max(self.hops_max, hops)
+            self.latency_total += latency
+
+    def store(self, key, value, owner=None):
+        """Store a value on whichever node is responsible for its key, looked up unless the caller knows it"""
+        if owner is None:
+            owner, _ = self.find_successor(self.key_position(key))
+        if owner is None:
+            return False
+        reply = self._request(owner, {'type': 'store', 'key': key, 'value': value})
+        return bool(reply and reply.get('stored'))
+
+    def retrieve(self, key, owner=None):
+        """Fetch a value from whichever node is responsible for its key, looked up unless the caller knows it"""
+        if owner is None:
+            owner, _ = self.find_successor(self.key_position(key))
+        if owner is None:
+            return None
+        reply = self._request(owner, {'type': 'retrieve', 'key': key})
+        return reply.get('value') if reply and reply.get('found') else None
+
+    def join(self, contact):
+        """Enter the ring a known node belongs to; stabilization then settles our neighbours"""
+        successor, _ = self.find_successor(self.position, start=contact)
+        if successor is None:
+            return False
+        self.predecessor = None
+        self.successor = successor
+        self._request(successor, {'type': 'notify'})
+        for _ in range(Config.DHT_RING_BITS):
+            self.fix_next_finger()
+        return True
+
+    def _maintain(self):
+        """Periodically repair successor, predecessor and one finger, as Chord nodes do"""
+        while self.running:
+            time.sleep(Config.DHT_STABILIZE_INTERVAL)
+            if not self.running:
+                break
+            try:
+                self.stabilize()
+                self.fix_next_finger()
+                self._hand_off()
+            except Exception as e:
+                print(f"DHT maintenance error: {e}")
+
+    def stabilize(self):
+        """Adopt a node that joined between us and our successor, and tell the successor about us"""
+        if self.predecessor is not None and self._request(self.predecessor, {'type': 'ping'}) is None:
+            self.predecessor = None
+        reply = self._request(self.successor, {'type': 'get_predecessor'})
+        if reply is None:
+            self._drop_successor()
+            return
+        candidate = DHTContact.from_list(reply.get('node'))
+        if candidate is not None and self._in_range(candidate.position, self.position, self.successor.position):
+            self.successor = candidate
+        self._request(self.successor, {'type': 'notify'})
+
+    def _drop_successor(self):
+        """Replace an unreachable successor with the nearest other node we know"""
+        dead = self.successor
+        self.finger_table = {step: contact for step, contact in self.finger_table.items() if contact != dead}
+        others = [contact for contact in self.finger_table.values() if contact != self.contact]
+        if self.predecessor is not None and self.predecessor != dead:
+            others.append(self.predecessor)
+        self.successor = min(others, key=lambda contact: (contact.position - self.position) % self.ring_size,
+                             default=self.contact)
+
+    def fix_next_finger(self):
+        """Refresh one finger table entry per call, cycling through them"""
+        step = 2 ** self._next_finger
+        self._next_finger = (self._next_finger + 1) % Config.DHT_RING_BITS
+        owner, _ = self.find_successor((self.position + step) % self.ring_size)
+        if owner is not None:
+            self.finger_table[step] = owner
+
+    def _hand_off(self):
+        """Move keys that now belong to a new predecessor over to it"""
+        moved = False
+        with self._data_lock:
+            items = list(self.data_store.items())
+        for key, data in items:
+            if self._is_responsible_for(self.key_position(key)):
+                continue
+            owner, _ = self.find_successor(self.key_position(key))
+            if owner is None or owner == self.contact:
+                continue
+            reply = self._request(owner, {'type': 'store', 'key': key, 'value': data['value']})
+            if reply and reply.get('stored'):
+                with self._data_lock:
+                    self.data_store.pop(key, None)
+                moved = True
+        if moved:
+            self._save_data()
 
     def _load_stored_data(self):
         """Load persisted data from file"""
@@ -62,30 +371,51 @@ class DHTNode:
             self.data_store = {}
 
     def _save_data(self):
-        """Persist data to file"""
-        with open(self.storage_file, 'w') as f:
-            json.dump(self.data_store, f)
+        """Persist data to file, replacing it in one step so a crash never leaves it half written"""
+        with self._data_lock:
+            temp_path = f"{self.storage_file}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(self.data_store, f)
+            os.replace(temp_path, self.storage_file)
 
     def store_data(self, key, value):
         """Store data with timestamp"""
-        if self._is_responsible_for(self._hash(key)):
-            self.data_store[key] = {
-                'value': value,
-                'timestamp': time.time()
-            }
-            self._save_data()
+        if self._is_responsible_for(self.key_position(key)):
+            with self._data_lock:
+                self.data_store[key] = {
+                    'value': value,
+                    'timestamp': time.time()
+                }
+                self._save_data()
             return True
         return False
 
     def get_data(self, key):
         """Retrieve data if available"""
-        data = self.data_store.get(key)
+        with self._data_lock:
+            data = self.data_store.get(key)
         return data['value'] if data else None
 
     def _is_responsible_for(self, key_hash):
-        """Check if this node is responsible for a key"""
-        if self.successor is None:
+        """Check if this node is responsible for a key: it lies in (predecessor, self]"""
+        if self.predecessor is None:
             return True
-        if self.position < self.successor.position:
-            return self.position <= key_hash < self.successor.position
-        return (self.position <= key_hash) or (key_hash < self.successor.position)
\ No newline at end of file
+        return self._in_range(key_hash, self.predecessor.position, self.position, inclusive=True)
+
+    def stats(self):
+        """Lookup hop counts and latency, plus request traffic"""
+        lookups = self.lookups
+        return {
+            'position': self.position,
+            'successor': repr(self.successor),
+            'predecessor': repr(self.predecessor) if self.predecessor else None,
+            'keys': len(self.data_store),
+            'lookups': lookups,
+            'lookup_failures': self.lookup_failures,
+            'avg_hops': round(self.hops_total / lookups, 2) if lookups else 0,
+            'max_hops': self.hops_max,
+            'avg_latency_ms': round(self.latency_total / lookups * 1000, 3) if lookups else 0,
+            'requests_sent': self.requests_sent,
+            'retries': self.retries,
+            'timeouts': self.timeouts
+        }
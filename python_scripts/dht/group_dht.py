@@ -1,4 +1,6 @@
-from python_scripts.dht.dht_node import DHTNode
+from python_scripts.dht.dht_node import DHTError, DHTNode
+from config import Config
+import bisect
 import time
 
 class GroupDHT:
@@ -6,71 +8,118 @@ class GroupDHT:
         self.group_id = group_id
         self.nodes = {}  # user_id -> DHTNode
         self.node_list = []  # Sorted list of nodes
+        self.positions = []  # Ring positions of node_list, for binary search
         self.message_keys = set()  # Track message keys for retrieval
 
     def add_member(self, user_id, ip_address, port):
         """Add a new member to the DHT ring"""
+        # The old node releases its port before a replacement binds it
+        self.remove_member(user_id)
         node = DHTNode(ip_address, port, user_id)
         self.nodes[user_id] = node
-        
+
         # Update node list and finger tables
-        self._update_node_list()
+        self._update_node_list(node)
         self._update_finger_tables()
-        
+
         # Start the node
         node.start()
         return node
 
-    def _update_node_list(self):
-        """Update the sorted list of nodes"""
-        self.node_list = sorted(
-            self.nodes.values(),
-            key=lambda x: x.position
-        )
-        
-        # Update successors and predecessors
-        for i, node in enumerate(self.node_list):
-            node.successor = self.node_list[(i + 1) % len(self.node_list)]
-            node.predecessor = self.node_list[i - 1]
+    def _update_node_list(self, node):
+        """Insert a node into the sorted list of nodes"""
+        index = bisect.bisect_right(self.positions, node.position)
+        self.positions.insert(index, node.position)
+        self.node_list.insert(index, node)
+
+        # Only the new node and its two neighbours change successor or predecessor
+        count = len(self.node_list)
+        for i in (index - 1, index, index + 1):
+            neighbour = self.node_list[i % count]
+            neighbour.successor = self.node_list[(i + 1) % count].contact
+            neighbour.predecessor = self.node_list[(i - 1) % count].contact
+
+    def remove_member(self, user_id):
+        """Stop a member's node and close the ring around it"""
+        node = self.nodes.pop(user_id, None)
+        if node is None:
+            return None
+        node.stop()
+        self._remove_from_list(node)
+        if self.node_list:
+            self._update_finger_tables()
+        return node
+
+    def _remove_from_list(self, node):
+        """Remove a node from the sorted list and point its neighbours at each other"""
+        index = self.node_list.index(node)
+        del self.node_list[index], self.positions[index]
+        count = len(self.node_list)
+        if not count:
+            return
+        # The nodes before and after the gap are now each other's successor and predecessor
+        for i in (index - 1, index):
+            neighbour = self.node_list[i % count]
+            neighbour.successor = self.node_list[(i + 1) % count].contact
+            neighbour.predecessor = self.node_list[(i - 1) % count].contact
 
     def _update_finger_tables(self):
-        """Update finger tables for all nodes"""
-        for node in self.nodes.values():
-            finger_table = {}
-            for i in range(10):  # 10-bit ring = 1024 positions
-                ideal_position = (node.position + 2**i) % 1024
-                successor = self._find_successor(ideal_position)
-                finger_table[2**i] = successor
+        """Update finger tables for all nodes, one merged pass over the ring per finger"""
+        count = len(self.node_list)
+        ring_size = 2 ** Config.DHT_RING_BITS
+        tables = [{} for _ in range(count)]
+        for bit in range(Config.DHT_RING_BITS):
+            step = 2 ** bit
+            # position + step, taken from the first node whose target wraps past zero, rises around the
+            # ring, so one pointer walking the sorted positions finds every node's successor
+            first = bisect.bisect_left(self.positions, ring_size - step)
+            successor = 0
+            for offset in range(count):
+                i = (first + offset) % count
+                target = (self.positions[i] + step) % ring_size
+                while successor < count and self.positions[successor] < target:
+                    successor += 1
+                tables[i][step] = self.node_list[successor % count].contact
+        for node, finger_table in zip(self.node_list, tables):
             node.finger_table = finger_table
 
     def _find_successor(self, position):
-        """Find the successor node for a position"""
-        for node in self.node_list:
-            if node.position > position:
-                return node
-        return self.node_list[0]  # Wrap around to first node
+        """Find the successor node for a position: the first at or after it"""
+        index = bisect.bisect_left(self.positions, position)
+        return self.node_list[index % len(self.node_list)]  # Wrap around to first node
+
+    def _entry_node(self, user_id=None):
+        """Member node that starts lookups, preferring the user's own"""
+        return self.nodes.get(user_id) or self.node_list[0]
 
     def store_message(self, message_data):
         """Store a message in the DHT"""
         timestamp = time.time()
         message_key = f"msg_{timestamp}_{message_data['sender_id']}"
-        key_hash = self.node_list[0]._hash(message_key) % 1024
-        
-        # Find responsible node
-        responsible_node = self._find_successor(key_hash)
-        responsible_node.store_data(message_key, message_data)
-        
-        # Track message key for retrieval
+
+        # The owner among our members is found by binary search and sent the message directly; if a node
+        # that joined from elsewhere owns the key now, a Chord lookup finds it
+        entry = self._entry_node(message_data['sender_id'])
+        owner = self._find_successor(entry.key_position(message_key))
+        if not entry.store(message_key, message_data, owner=owner.contact) \
+                and not entry.store(message_key, message_data):
+            raise DHTError(f"No node in group {self.group_id} accepted message {message_key}")
+
+        # Track message key for retrieval, once it is stored
         self.message_keys.add(message_key)
         return message_key
 
     def get_messages(self):
         """Retrieve all messages from the DHT"""
         messages = []
+        entry = self._entry_node()
         for key in sorted(self.message_keys):  # Sort by key to maintain chronological order
-            key_hash = self.node_list[0]._hash(key) % 1024
-            responsible_node = self._find_successor(key_hash)
-            message = responsible_node.get_data(key)
+            owner = self._find_successor(entry.key_position(key))
+            message = entry.retrieve(key, owner=owner.contact) or entry.retrieve(key)
             if message:
                 messages.append(message)
-        return messages
\ No newline at end of file
+        return messages
+
+    def stats(self):
+        """Per-member lookup hops and latency"""
+        return {user_id: node.stats() for user_id, node in self.nodes.items()}
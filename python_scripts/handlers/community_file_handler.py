@@ -1,12 +1,16 @@
+import os
 import socket
+import tempfile
 import threading
 import hashlib
+import time
 from datetime import datetime
 import mimetypes
+from config import Config
 
 class CommunityFileHandler:
     # Class variables to store file data
-    shared_files = {}  # file_hash -> file_content mapping
+    shared_files = {}  # file_hash -> path of the file on disk
     file_metadata = {}  # file_hash -> metadata mapping
     file_servers = {}  # community_id -> {user_id: (host, port)}
 
@@ -39,15 +43,16 @@ class CommunityFileHandler:
                             message = data.decode()
                             if message.startswith("FILE_REQUEST:"):
                                 file_hash = message.split(":")[1]
-                                file_content = CommunityFileHandler.shared_files.get(file_hash)
-                                if file_content:
-                                    # Send file size first
-                                    size = len(file_content)
-                                    conn.sendall(f"SIZE:{size}".encode())
-                                    # Wait for acknowledgment
-                                    conn.recv(1024)
-                                    # Send file content
-                                    conn.sendall(file_content)
+                                file_path = CommunityFileHandler.get_shared_path(file_hash)
+                                if file_path:
+                                    with open(file_path, 'rb') as f:
+                                        # Send file size first
+                                        size = os.fstat(f.fileno()).st_size
+                                        conn.sendall(f"SIZE:{size}".encode())
+                                        # Wait for acknowledgment
+                                        conn.recv(1024)
+                                        # Send file content straight from disk with sendfile
+                                        conn.sendfile(f)
                                 else:
                                     conn.sendall(b"FILE_NOT_FOUND")
                         except Exception as e:
@@ -68,22 +73,39 @@ class CommunityFileHandler:
     def register_file(file_content, filename, user_id, community_id):
         """Register a new file in the community"""
         try:
-            # Ensure file_content is bytes
+            # Ensure file_content is bytes or a readable stream
             if isinstance(file_content, str):
                 file_content = file_content.encode('utf-8')
-            elif hasattr(file_content, 'read'):
-                file_content = file_content.read()
             
-            # Generate file hash
-            file_hash = hashlib.sha256(file_content).hexdigest()
-            
-            # Store file content
-            CommunityFileHandler.shared_files[file_hash] = file_content
+            # Write the file to disk while hashing it, so it is never held in memory
+            os.makedirs(Config.SHARED_FILES_FOLDER, exist_ok=True)
+            CommunityFileHandler.prune_shared_files()
+            hasher = hashlib.sha256()
+            size = 0
+            fd, temp_path = tempfile.mkstemp(dir=Config.SHARED_FILES_FOLDER)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    chunks = iter(lambda: file_content.read(1024 * 1024), b'') if hasattr(file_content, 'read') \
+                        else [file_content]
+                    for chunk in chunks:
+                        hasher.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+                file_hash = hasher.hexdigest()
+                
+                # Store the file under its hash; identical uploads share one copy
+                file_path = os.path.join(Config.SHARED_FILES_FOLDER, file_hash)
+                os.replace(temp_path, file_path)
+            except Exception:
+                os.remove(temp_path)
+                raise
+            CommunityFileHandler.shared_files[file_hash] = file_path
             
             # Store metadata
             CommunityFileHandler.file_metadata[file_hash] = {
                 'filename': filename,
                 'hash': file_hash,
+                'size': size,
                 'user_id': user_id,
                 'community_id': community_id,
                 'timestamp': datetime.now().isoformat(),
@@ -147,7 +169,48 @@ class CommunityFileHandler:
             if not CommunityFileHandler.file_servers[community_id]:
                 del CommunityFileHandler.file_servers[community_id]
 
+    @staticmethod
+    def prune_shared_files():
+        """Delete uploads older than SHARED_FILES_MAX_AGE, then the oldest beyond SHARED_FILES_QUOTA"""
+        files = []
+        try:
+            with os.scandir(Config.SHARED_FILES_FOLDER) as entries:
+                for entry in entries:
+                    if entry.name.startswith('tmp') or not entry.is_file():
+                        continue  # Uploads still being written
+                    info = entry.stat()
+                    files.append((info.st_mtime, info.st_size, entry.path))
+        except OSError as e:
+            print(f"Error scanning shared files: {e}")
+            return
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        cutoff = time.time() - Config.SHARED_FILES_MAX_AGE
+        for mtime, size, path in files:
+            if mtime >= cutoff and total <= Config.SHARED_FILES_QUOTA:
+                break
+            try:
+                os.remove(path)  # Downloads already streaming it keep their open handle
+            except OSError as e:
+                print(f"Error pruning shared file {path}: {e}")
+                continue
+            total -= size
+        for file_hash, path in list(CommunityFileHandler.shared_files.items()):
+            if not os.path.isfile(path):
+                CommunityFileHandler.shared_files.pop(file_hash, None)
+                CommunityFileHandler.file_metadata.pop(file_hash, None)
+
+    @staticmethod
+    def get_shared_path(file_hash):
+        """Get the path of a shared file on disk, or None if it is not shared here"""
+        file_path = CommunityFileHandler.shared_files.get(file_hash)
+        return file_path if file_path and os.path.isfile(file_path) else None
+
     @staticmethod
     def get_shared_file(file_hash):
         """Get a file directly from shared files"""
-        return CommunityFileHandler.shared_files.get(file_hash)
\ No newline at end of file
+        file_path = CommunityFileHandler.get_shared_path(file_hash)
+        if not file_path:
+            return None
+        with open(file_path, 'rb') as f:
+            return f.read()
\ No newline at end of file
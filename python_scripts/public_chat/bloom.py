@@ -0,0 +1,68 @@
+import hashlib
+import math
+from typing import Iterable
+
+class BloomFilter:
+    """Fixed-size Bloom filter over string keys"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001, num_bits: int = None, num_hashes: int = None):
+        self.capacity = max(1, int(capacity))
+        self.error_rate = error_rate
+        # Optimal sizing for the target capacity and false-positive rate
+        self.num_bits = num_bits or max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = num_hashes or max(1, int(round(self.num_bits / self.capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str) -> Iterable[int]:
+        """Bit positions for a key, using double hashing over one digest"""
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, key: str) -> bool:
+        """Add a key; returns True if it was (probably) already present"""
+        present = True
+        for position in self._positions(key):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not self.bits[byte] & mask:
+                present = False
+                self.bits[byte] |= mask
+        if not present:
+            self.count += 1
+        return present
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def union(self, other: 'BloomFilter'):
+        """Merge another filter of the same shape into this one"""
+        if other.num_bits != self.num_bits or other.num_hashes != self.num_hashes:
+            raise ValueError("Bloom filters must have the same size and hash count to merge")
+        merged = int.from_bytes(self.bits, 'big') | int.from_bytes(other.bits, 'big')
+        self.bits = bytearray(merged.to_bytes(len(self.bits), 'big'))
+        self.count += other.count
+
+    @property
+    def is_full(self) -> bool:
+        return self.count >= self.capacity
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self.bits)
+
+    def estimated_false_positive_rate(self) -> float:
+        """Expected false-positive rate for the number of keys added so far"""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, num_hashes: int, count: int = 0) -> 'BloomFilter':
+        """Rebuild a filter received from a peer"""
+        bloom = cls(capacity=max(1, count), num_bits=len(data) * 8, num_hashes=num_hashes)
+        bloom.bits = bytearray(data)
+        bloom.count = count
+        return bloom
@@ -1,54 +1,361 @@
+import atexit
 import json
 import os
-from typing import Dict, Optional
+import sqlite3
+import threading
+import uuid
+from typing import Callable, Dict, List, Optional, Set
 import time
+from config import Config
 
 class BucketManager:
-    def __init__(self):
-        self.buckets_file = "data/user_buckets.json"
+    BUCKET_COLUMNS = ('hash', 'sent_requests_hash', 'received_requests_hash', 'created_at')
+
+    def __init__(self, db_file: str = "data/user_buckets.db", buckets_file: str = "data/user_buckets.json"):
+        self.db_file = db_file
+        self.buckets_file = buckets_file  # Legacy JSON store, imported once on first start
         self.buckets_data = {}  # user_id -> {hash, sent_requests_hash, received_requests_hash, created_at} mapping
+        self.commit_interval = Config.BUCKET_COMMIT_INTERVAL
+        self.max_batch_size = Config.BUCKET_MAX_BATCH_SIZE
+        self.watch_interval = Config.BUCKET_WATCH_INTERVAL
+        self.history_length = Config.BUCKET_HISTORY_LENGTH
+
+        # Identifies rows written by this process so only other workers' changes are announced
+        self.writer_id = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.version = 0  # Highest store version reflected in buckets_data
+        self._subscribers = []
+
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._pending = {}  # user_id -> {column: value} waiting for the next group commit
+        self._pending_history = []  # (user_id, hash, timestamp, summary) chain entries for the next commit
+        self._pending_event = threading.Event()
+        self._flushed = threading.Condition(self._lock)
+        self._in_flight = False
+        self._running = True
+
         self._init_buckets_file()
-        
+
+        # Single writer thread batches updates from all callers into one transaction
+        self._writer_thread = threading.Thread(target=self._writer_loop)
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+
+        # Watcher thread picks up commits made by other worker processes
+        self._watch_thread = threading.Thread(target=self._watch_loop)
+        self._watch_thread.daemon = True
+        self._watch_thread.start()
+        atexit.register(self.close)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection to the bucket store in WAL mode"""
+        connection = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
     def _init_buckets_file(self):
-        """Initialize or load buckets file"""
+        """Initialize the bucket store, migrate the legacy JSON file and load all rows"""
         # Create data directory if it doesn't exist
-        os.makedirs(os.path.dirname(self.buckets_file), exist_ok=True)
-        
-        # Load existing bucket data if available
+        os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
+
+        self._db = self._connect()
+        with self._db:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    user_id TEXT PRIMARY KEY,
+                    hash TEXT,
+                    sent_requests_hash TEXT,
+                    received_requests_hash TEXT,
+                    created_at REAL,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    writer TEXT
+                )
+            """)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS bucket_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    summary TEXT
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS bucket_history_user ON bucket_history (user_id, id)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', '0')")
+
+            # Stores created before change tracking lack the version columns
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(buckets)")}
+            if 'version' not in columns:
+                self._db.execute("ALTER TABLE buckets ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            if 'writer' not in columns:
+                self._db.execute("ALTER TABLE buckets ADD COLUMN writer TEXT")
+
+        self._migrate_json_file()
+
+        # Load existing bucket data
         try:
-            if os.path.exists(self.buckets_file):
-                with open(self.buckets_file, 'r') as f:
-                    self.buckets_data = json.load(f)
+            self.buckets_data = self._load_rows()
+            self.version = self._db.execute("SELECT COALESCE(MAX(version), 0) FROM buckets").fetchone()[0]
         except Exception as e:
-            print(f"Error loading buckets file: {e}")
+            print(f"Error loading buckets store: {e}")
             self.buckets_data = {}
 
-    def _save_buckets_data(self):
-        """Save buckets data to file"""
+    def _migrate_json_file(self):
+        """Import data/user_buckets.json into the store the first time it is opened"""
+        migrated = self._db.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+        if migrated or not os.path.exists(self.buckets_file):
+            return
+
+        try:
+            with open(self.buckets_file, 'r') as f:
+                legacy_data = json.load(f)
+
+            with self._db:
+                for user_id, bucket_info in legacy_data.items():
+                    self._upsert(self._db, str(user_id), bucket_info)
+                    if bucket_info.get('hash'):
+                        self._append_history(
+                            self._db, str(user_id), bucket_info['hash'],
+                            bucket_info.get('created_at', time.time()), {'op': 'migrated'}
+                        )
+                self._db.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                    (str(time.time()),)
+                )
+            print(f"Migrated {len(legacy_data)} buckets from {self.buckets_file}")
+        except Exception as e:
+            print(f"Error migrating buckets file: {e}")
+
+    def _load_rows(self) -> Dict[str, Dict]:
+        """Read every bucket row into the user_id -> info mapping"""
+        rows = self._db.execute(
+            f"SELECT user_id, {', '.join(self.BUCKET_COLUMNS)} FROM buckets"
+        ).fetchall()
+        return {row[0]: self._row_to_info(row[1:]) for row in rows}
+
+    def _row_to_info(self, values) -> Dict:
+        """Convert a row to the dict shape callers expect, omitting unset columns"""
+        return {
+            column: value
+            for column, value in zip(self.BUCKET_COLUMNS, values)
+            if value is not None
+        }
+
+    def _upsert(self, connection: sqlite3.Connection, user_id: str, fields: Dict, version: int = 0):
+        """Atomically update only the given columns of a user's row"""
+        columns = [column for column in self.BUCKET_COLUMNS if column in fields] + ['version', 'writer']
+        values = [fields[column] for column in columns[:-2]] + [version, self.writer_id]
+        assignments = ', '.join(f"{column} = excluded.{column}" for column in columns)
+        connection.execute(
+            f"INSERT INTO buckets (user_id, {', '.join(columns)}) "
+            f"VALUES (?, {', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT(user_id) DO UPDATE SET {assignments}",
+            [user_id] + values
+        )
+
+    def _append_history(self, connection: sqlite3.Connection, user_id: str, bucket_hash: str,
+                        timestamp: float, summary: Optional[Dict]):
+        """Add a CID to a user's version chain and drop entries beyond the chain length"""
+        last = connection.execute(
+            "SELECT hash FROM bucket_history WHERE user_id = ? ORDER BY id DESC LIMIT 1", (user_id,)
+        ).fetchone()
+        if last and last[0] == bucket_hash:
+            return
+        connection.execute(
+            "INSERT INTO bucket_history (user_id, hash, created_at, summary) VALUES (?, ?, ?, ?)",
+            (user_id, bucket_hash, timestamp, json.dumps(summary) if summary else None)
+        )
+        connection.execute(
+            "DELETE FROM bucket_history WHERE user_id = ? AND id NOT IN "
+            "(SELECT id FROM bucket_history WHERE user_id = ? ORDER BY id DESC LIMIT ?)",
+            (user_id, user_id, self.history_length)
+        )
+
+    def _next_version(self, connection: sqlite3.Connection) -> int:
+        """Bump the store-wide version inside the current transaction"""
+        connection.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+        return int(connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0])
+
+    def _writer_loop(self):
+        """Group-commit pending updates in batches"""
+        while self._running or self._pending:
+            self._pending_event.wait()
+            # Give concurrent writers a moment to join this batch
+            if self.commit_interval and len(self._pending) < self.max_batch_size:
+                time.sleep(self.commit_interval)
+            self._commit_pending()
+
+    def _commit_pending(self):
+        """Write the current batch of pending updates in a single transaction"""
+        with self._lock:
+            batch = self._pending
+            history = self._pending_history
+            self._pending = {}
+            self._pending_history = []
+            self._pending_event.clear()
+            self._in_flight = bool(batch)
+        if not batch:
+            return
+
         try:
-            with open(self.buckets_file, 'w') as f:
-                json.dump(self.buckets_data, f, indent=4)
+            with self._db_lock, self._db:
+                version = self._next_version(self._db)
+                for user_id, fields in batch.items():
+                    self._upsert(self._db, user_id, fields, version)
+                for entry in history:
+                    self._append_history(self._db, *entry)
         except Exception as e:
             print(f"Error saving buckets data: {e}")
-            raise
+            # Put the batch back, under any newer updates, so it is retried with the next commit
+            with self._lock:
+                for user_id, fields in batch.items():
+                    self._pending[user_id] = {**fields, **self._pending.get(user_id, {})}
+                self._pending_history = history + self._pending_history
+                self._in_flight = False
+                self._pending_event.set()
+            time.sleep(1)
+            return
+
+        with self._lock:
+            self._in_flight = False
+            self._flushed.notify_all()
+
+    def _save_bucket_fields(self, user_id: str, fields: Dict, history_entry: Optional[tuple] = None):
+        """Apply an update to the cache and queue it for the next group commit"""
+        user_id = str(user_id)
+        with self._lock:
+            # Replace the entry rather than mutating it so readers never see a partial update
+            self.buckets_data[user_id] = {**self.buckets_data.get(user_id, {}), **fields}
+            self._pending[user_id] = {**self._pending.get(user_id, {}), **fields}
+            if history_entry:
+                self._pending_history.append((user_id,) + history_entry)
+            self._pending_event.set()
+
+    def _watch_loop(self):
+        """Poll the store for commits by other processes and refresh the cache"""
+        connection = self._connect()
+        last_data_version = None
+        while self._running:
+            try:
+                # data_version only changes when another connection commits
+                data_version = connection.execute("PRAGMA data_version").fetchone()[0]
+                if data_version != last_data_version:
+                    last_data_version = data_version
+                    self.refresh()
+            except Exception as e:
+                print(f"Error watching buckets store: {e}")
+            time.sleep(self.watch_interval)
+        connection.close()
+
+    def refresh(self) -> Set[str]:
+        """Pull rows changed since the cached version; returns users changed by other processes"""
+        with self._db_lock:
+            rows = self._db.execute(
+                f"SELECT user_id, {', '.join(self.BUCKET_COLUMNS)}, version, writer "
+                f"FROM buckets WHERE version > ? ORDER BY version",
+                (self.version,)
+            ).fetchall()
+        if not rows:
+            return set()
+
+        changed = set()
+        with self._lock:
+            for row in rows:
+                user_id, values, version, writer = row[0], row[1:-2], row[-2], row[-1]
+                self.version = max(self.version, version)
+                if writer == self.writer_id:
+                    continue  # Our own commit, the cache already has it
+                # Updates still waiting to be committed locally are newer than the store
+                self.buckets_data[user_id] = {
+                    **self._row_to_info(values),
+                    **self._pending.get(user_id, {})
+                }
+                changed.add(user_id)
+
+        if changed:
+            for callback in list(self._subscribers):
+                try:
+                    callback(changed)
+                except Exception as e:
+                    print(f"Error notifying bucket subscriber: {e}")
+        return changed
+
+    def subscribe(self, callback: Callable[[Set[str]], None]):
+        """Call callback(user_ids) whenever another process updates those users' buckets"""
+        self._subscribers.append(callback)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every update queued so far has been committed"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._flushed.wait(remaining)
+        return True
+
+    def close(self):
+        """Commit outstanding updates and stop the writer thread"""
+        if not self._running:
+            return
+        self._running = False
+        self._pending_event.set()
+        self._writer_thread.join(timeout=5)
+        self._watch_thread.join(timeout=self.watch_interval + 1)
+        self._commit_pending()
+        self._db.close()
 
     def get_bucket_hash(self, user_id: str) -> Optional[str]:
         """Get bucket hash for user"""
         bucket_info = self.buckets_data.get(str(user_id))
-        return bucket_info['hash'] if bucket_info else None
+        return bucket_info.get('hash') if bucket_info else None
 
-    def update_bucket_hash(self, user_id: str, bucket_hash: str):
-        """Update bucket hash for user"""
-        self.buckets_data[str(user_id)] = {
+    def update_bucket_hash(self, user_id: str, bucket_hash: str, summary: Optional[Dict] = None):
+        """Update bucket hash for user, recording the previous one in the version chain"""
+        timestamp = time.time()
+        self._save_bucket_fields(user_id, {
             'hash': bucket_hash,
-            'created_at': time.time()
-        }
-        self._save_buckets_data()
+            'created_at': timestamp
+        }, (bucket_hash, timestamp, summary))
+
+    def get_bucket_history(self, user_id: str) -> List[Dict]:
+        """Get the version chain for a user's bucket, oldest first"""
+        self.flush(timeout=5)
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT hash, created_at, summary FROM bucket_history WHERE user_id = ? ORDER BY id",
+                (str(user_id),)
+            ).fetchall()
+        return [
+            {'hash': row[0], 'timestamp': row[1], 'summary': json.loads(row[2]) if row[2] else None}
+            for row in rows
+        ]
+
+    def get_changes_since(self, user_id: str, bucket_hash: str) -> Optional[List[Dict]]:
+        """Get the chain entries after bucket_hash, or None if it fell off the chain"""
+        history = self.get_bucket_history(user_id)
+        for index in range(len(history) - 1, -1, -1):
+            if history[index]['hash'] == bucket_hash:
+                return history[index + 1:]
+        return None
+
+    def rollback_bucket(self, user_id: str, bucket_hash: str) -> bool:
+        """Point a user's bucket back at an earlier CID from its version chain"""
+        if not any(entry['hash'] == bucket_hash for entry in self.get_bucket_history(user_id)):
+            return False
+        self.update_bucket_hash(user_id, bucket_hash, {
+            'op': 'rollback',
+            'from': self.get_bucket_hash(user_id)
+        })
+        return True
 
     def get_bucket_creation_time(self, user_id: str) -> Optional[float]:
         """Get bucket creation timestamp"""
         bucket_info = self.buckets_data.get(str(user_id))
-        return bucket_info['created_at'] if bucket_info else None
+        return bucket_info.get('created_at') if bucket_info else None
 
     def user_has_bucket(self, user_id: str) -> bool:
         """Check if user has a bucket"""
@@ -56,17 +363,11 @@ class BucketManager:
 
     def update_sent_requests_hash(self, user_id: str, hash: str):
         """Update sent requests hash for user"""
-        if str(user_id) not in self.buckets_data:
-            self.buckets_data[str(user_id)] = {}
-        self.buckets_data[str(user_id)]['sent_requests_hash'] = hash
-        self._save_buckets_data()
+        self._save_bucket_fields(user_id, {'sent_requests_hash': hash})
 
     def update_received_requests_hash(self, user_id: str, hash: str):
         """Update received requests hash for user"""
-        if str(user_id) not in self.buckets_data:
-            self.buckets_data[str(user_id)] = {}
-        self.buckets_data[str(user_id)]['received_requests_hash'] = hash
-        self._save_buckets_data()
+        self._save_bucket_fields(user_id, {'received_requests_hash': hash})
 
     def get_sent_requests_hash(self, user_id: str) -> Optional[str]:
         """Get sent requests hash for user"""
@@ -76,4 +377,4 @@ class BucketManager:
     def get_received_requests_hash(self, user_id: str) -> Optional[str]:
         """Get received requests hash for user"""
         bucket_info = self.buckets_data.get(str(user_id), {})
-        return bucket_info.get('received_requests_hash')
\ No newline at end of file
+        return bucket_info.get('received_requests_hash')
@@ -1,7 +1,9 @@
 import hashlib
+import tempfile
+import threading
 import time
-from typing import Dict, List
-import socket
+from typing import Dict, List, Optional
+from python_scripts.public_chat.content_index import ContentIndex
 from python_scripts.public_chat.secure_bucket import SecureBucket
 from python_scripts.public_chat.p2p_flood import P2PFloodNetwork
 
@@ -11,21 +13,49 @@ class ChatNode:
         self.username = username
         self.secure_bucket = SecureBucket(node_id, username)
         
-        # Initialize P2P flooding network
-        self.p2p_network = P2PFloodNetwork(
-            host='0.0.0.0',  # Listen on all interfaces
-            port=self._get_available_port(),
-            username=username
-        )
-    
-    def _get_available_port(self):
-        """Get an available port for P2P communication"""
-        sock = socket.socket()
-        sock.bind(('', 0))
-        port = sock.getsockname()[1]
-        sock.close()
-        return port
+        # The P2P flooding network is only started once it is actually used
+        self._p2p_network = None
+        self._p2p_lock = threading.Lock()
+        self._p2p_stopped_at = time.time()
+        self._downloads = None  # Finished P2P downloads; kept across idle network stops, deleted with the node
+
+    @property
+    def p2p_network(self) -> P2PFloodNetwork:
+        """Get the P2P flooding network, starting it on first use"""
+        with self._p2p_lock:
+            if self._p2p_network is None:
+                if self._downloads is None:
+                    self._downloads = ContentIndex(tempfile.mkdtemp(prefix=f"p2p_flood_{self.username}_"))
+                # Traffic reaches the network through the process-wide P2P endpoint
+                self._p2p_network = P2PFloodNetwork(
+                    node_id=self.node_id,
+                    username=self.username,
+                    file_provider=self.secure_bucket,
+                    temp_files=self._downloads
+                )
+            return self._p2p_network
+
+    @property
+    def downloads(self) -> Optional[ContentIndex]:
+        """Files this node has downloaded from peers, or None before its first download session"""
+        return self._downloads
 
+    @property
+    def p2p_started(self) -> bool:
+        """Whether the P2P flooding network is currently running"""
+        return self._p2p_network is not None
+
+    def stop_idle_p2p(self, idle_timeout: float) -> bool:
+        """Shut the P2P flooding network down if it has seen no traffic for idle_timeout"""
+        with self._p2p_lock:
+            network = self._p2p_network
+            if network is None or time.time() - network.last_activity < idle_timeout:
+                return False
+            self._p2p_network = None
+            self._p2p_stopped_at = network.last_activity
+        network.shutdown()
+        return True
+    
     def broadcast_message(self, content: str) -> Dict:
         """Create and broadcast a new message"""
         message = {
@@ -66,6 +96,40 @@ class ChatNode:
         """Get current bucket hash"""
         return self.secure_bucket._save_bucket()
 
+    def last_activity(self) -> float:
+        """Timestamp of the last peer traffic handled by this node"""
+        network = self._p2p_network
+        return network.last_activity if network else self._p2p_stopped_at
+
+    def shutdown(self):
+        """Flush the bucket pointer and release the node's P2P sockets and threads"""
+        try:
+            from app import bucket_manager
+            bucket_hash = self.secure_bucket.bucket_hash
+            current = bucket_manager.get_bucket_hash(self.node_id)
+            # Compare-and-set: a pointer another worker saved since this node loaded its copy wins
+            if bucket_hash and bucket_hash != current and self.secure_bucket.derives_from(current):
+                bucket_manager.update_bucket_hash(
+                    self.node_id, bucket_hash, self.secure_bucket.mutation_summary(bucket_hash)
+                )
+        except Exception as e:
+            print(f"Error flushing bucket for node {self.node_id}: {e}")
+        finally:
+            with self._p2p_lock:
+                network, self._p2p_network = self._p2p_network, None
+                downloads, self._downloads = self._downloads, None
+            if network:
+                network.shutdown()
+            if downloads is not None:
+                downloads.close()
+
+    def reload_bucket(self, bucket_hash: str, sent_requests_hash: Optional[str] = None,
+                      received_requests_hash: Optional[str] = None):
+        """Replace local bucket state and request lists with ones saved elsewhere"""
+        if bucket_hash and bucket_hash != self.secure_bucket.bucket_hash:
+            self.secure_bucket._load_bucket(bucket_hash)
+        self.secure_bucket._load_requests(sent_requests_hash, received_requests_hash)
+
     def clear_chat_history(self) -> Dict:
         """Clear chat history from bucket"""
         try:
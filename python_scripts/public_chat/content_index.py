@@ -0,0 +1,201 @@
+import os
+import shutil
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional
+
+class IndexedFile:
+    """One finished file in a node's temp directory"""
+
+    def __init__(self, name: str, size: int, mtime: float, sha256: str):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.sha256 = sha256  # Content root of the verified manifest; stable across processes
+        self.last_access = time.time()
+
+    def to_dict(self) -> Dict:
+        return {'name': self.name, 'size': self.size, 'mtime': self.mtime, 'sha256': self.sha256,
+                'last_access': self.last_access}
+
+class ContentIndex:
+    """In-memory index of a temp directory, updated as files are written so lookups never touch the disk"""
+    _indexes = weakref.WeakSet()  # Every open index in the process, for the global quota
+    _indexes_lock = threading.Lock()
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.files = {}  # {name: IndexedFile}
+        self.by_hash = {}  # {sha256: name}
+        self.pinned = {}  # {name: readers} files being served, never evicted
+        self.total_bytes = 0
+        self.reserved_bytes = 0  # Manifest sizes of downloads still in progress
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self._lock = threading.Lock()
+        with ContentIndex._indexes_lock:
+            ContentIndex._indexes.add(self)
+
+    def add(self, name: str, sha256: str) -> IndexedFile:
+        """Record a file that was just written; only its metadata is read"""
+        info = os.stat(os.path.join(self.directory, name))
+        entry = IndexedFile(name, info.st_size, info.st_mtime, sha256)
+        with self._lock:
+            self._discard(name)
+            self.files[name] = entry
+            self.by_hash[sha256] = name
+            self.total_bytes += entry.size
+        return entry
+
+    def remove(self, name: str) -> Optional[IndexedFile]:
+        """Forget a file that was deleted"""
+        with self._lock:
+            return self._discard(name)
+
+    def _discard(self, name: str) -> Optional[IndexedFile]:
+        entry = self.files.pop(name, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+            if self.by_hash.get(entry.sha256) == name:
+                del self.by_hash[entry.sha256]
+        return entry
+
+    def reserve(self, size: int):
+        """Count a download in progress against the quotas before its bytes arrive"""
+        with self._lock:
+            self.reserved_bytes += size
+
+    def unreserve(self, size: int):
+        with self._lock:
+            self.reserved_bytes = max(0, self.reserved_bytes - size)
+
+    @property
+    def used_bytes(self) -> int:
+        return self.total_bytes + self.reserved_bytes
+
+    def get(self, name: str) -> Optional[IndexedFile]:
+        return self.files.get(name)
+
+    def acquire(self, name: str) -> Optional[IndexedFile]:
+        """Pin a file while it is being served and mark it recently used"""
+        with self._lock:
+            entry = self.files.get(name)
+            if entry is not None:
+                entry.last_access = time.time()
+                self.pinned[name] = self.pinned.get(name, 0) + 1
+            return entry
+
+    def release(self, name: str):
+        with self._lock:
+            readers = self.pinned.get(name, 0) - 1
+            if readers > 0:
+                self.pinned[name] = readers
+            else:
+                self.pinned.pop(name, None)
+
+    def evict(self, limit: int, keep: str = None) -> List[str]:
+        """Delete least recently used files until this index holds at most limit bytes"""
+        evicted = []
+        while self.used_bytes > limit:
+            with self._lock:
+                candidates = [entry for entry in self.files.values()
+                              if entry.name != keep and entry.name not in self.pinned]
+            if not candidates:
+                break
+            victim = min(candidates, key=lambda entry: entry.last_access)
+            if self._evict(victim.name):
+                evicted.append(victim.name)
+        return evicted
+
+    def _evict(self, name: str) -> bool:
+        with self._lock:
+            if name in self.pinned:
+                return False
+            entry = self._discard(name)
+        if entry is None:
+            return False
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError as e:
+            print(f"Error evicting {name}: {e}")
+        self.evictions += 1
+        self.evicted_bytes += entry.size
+        return True
+
+    @classmethod
+    def _open_indexes(cls) -> List['ContentIndex']:
+        with cls._indexes_lock:
+            return list(cls._indexes)
+
+    @classmethod
+    def evict_global(cls, limit: int, keep: IndexedFile = None) -> int:
+        """Delete the least recently used files across every index until the process holds at most limit bytes"""
+        evicted = 0
+        while True:
+            indexes = cls._open_indexes()
+            if cls.used_global() <= limit:
+                break
+            candidates = [(entry.last_access, index, entry.name) for index in indexes
+                          for entry in index.entries() if entry is not keep and entry.name not in index.pinned]
+            if not candidates:
+                break
+            _, index, name = min(candidates, key=lambda candidate: candidate[0])
+            if index._evict(name):
+                evicted += 1
+        return evicted
+
+    @classmethod
+    def used_global(cls) -> int:
+        """Bytes held or reserved by every index in the process"""
+        return sum(index.used_bytes for index in cls._open_indexes())
+
+    def close(self):
+        """Delete the directory and everything in it"""
+        with ContentIndex._indexes_lock:
+            ContentIndex._indexes.discard(self)
+        with self._lock:
+            self.files.clear()
+            self.by_hash.clear()
+            self.total_bytes = 0
+            self.reserved_bytes = 0
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def stats(self) -> Dict:
+        return {
+            'files': len(self.files),
+            'bytes': self.total_bytes,
+            'reserved': self.reserved_bytes,
+            'pinned': len(self.pinned),
+            'evictions': self.evictions,
+            'evicted_bytes': self.evicted_bytes
+        }
+
+    @classmethod
+    def usage(cls) -> Dict:
+        """Process-wide gauges for downloaded content"""
+        indexes = cls._open_indexes()
+        return {
+            'directories': len(indexes),
+            'files': sum(len(index) for index in indexes),
+            'bytes': sum(index.total_bytes for index in indexes),
+            'reserved': sum(index.reserved_bytes for index in indexes),
+            'pinned': sum(len(index.pinned) for index in indexes),
+            'evictions': sum(index.evictions for index in indexes),
+            'evicted_bytes': sum(index.evicted_bytes for index in indexes)
+        }
+
+    def find(self, sha256: str) -> Optional[IndexedFile]:
+        """A file with this content, under whatever name it was saved"""
+        name = self.by_hash.get(sha256)
+        return self.files.get(name) if name else None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.files
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def entries(self) -> List[IndexedFile]:
+        with self._lock:
+            return list(self.files.values())
@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import deque
+from typing import Dict
+from config import Config
+from python_scripts.public_chat.bloom import BloomFilter
+
+class RotatingDedupeCache:
+    """Time-windowed set of seen message IDs built from rotating Bloom filter generations"""
+
+    def __init__(self, window: float = None, generations: int = None, initial_capacity: int = None,
+                 max_capacity: int = None, error_rate: float = None):
+        self.window = window or Config.P2P_DEDUPE_WINDOW
+        self.max_generations = generations or Config.P2P_DEDUPE_GENERATIONS
+        self.initial_capacity = initial_capacity or Config.P2P_DEDUPE_INITIAL_CAPACITY
+        self.max_capacity = max_capacity or Config.P2P_DEDUPE_MAX_CAPACITY
+        self.error_rate = error_rate or Config.P2P_DEDUPE_ERROR_RATE
+        # IDs are remembered for between one generation period and the whole window.
+        # Each generation is sized from the traffic the previous one saw, so quiet nodes
+        # stay at a few kilobytes and memory is capped at generations * max_capacity keys.
+        self.generation_period = self.window / self.max_generations
+
+        self._lock = threading.Lock()
+        self._generations = deque()  # (started_at, BloomFilter), oldest first
+        self.early_rotations = 0  # Generations retired before their time because they filled up
+        self._start_generation(self.initial_capacity)
+
+    def _start_generation(self, capacity: int):
+        """Open a new current generation, retiring the oldest if over the limit; call with lock held"""
+        capacity = min(self.max_capacity, max(self.initial_capacity, capacity))
+        self._generations.append((time.time(), BloomFilter(capacity, self.error_rate)))
+        while len(self._generations) > self.max_generations:
+            self._generations.popleft()
+
+    def _rotate(self):
+        """Expire old generations and start a new one when due; call with lock held"""
+        now = time.time()
+        while self._generations and now - self._generations[0][0] >= self.window:
+            self._generations.popleft()
+
+        if not self._generations:
+            self._start_generation(self.initial_capacity)
+            return
+
+        started_at, current = self._generations[-1]
+        if current.is_full:
+            self.early_rotations += 1
+            self._start_generation(current.capacity * 2)
+        elif now - started_at >= self.generation_period:
+            # Size the next generation for the rate this one actually saw
+            self._start_generation(current.count * 2)
+
+    def check_and_add(self, message_id: str) -> bool:
+        """Record an ID; returns True if it was already seen within the window"""
+        if message_id is None:
+            return False
+        message_id = str(message_id)
+        with self._lock:
+            self._rotate()
+            if any(message_id in bloom for _, bloom in self._generations):
+                return True
+            self._generations[-1][1].add(message_id)
+            return False
+
+    def add(self, message_id: str):
+        self.check_and_add(message_id)
+
+    def __contains__(self, message_id: str) -> bool:
+        message_id = str(message_id)
+        with self._lock:
+            self._rotate()
+            return any(message_id in bloom for _, bloom in self._generations)
+
+    def __len__(self) -> int:
+        return sum(bloom.count for _, bloom in self._generations)
+
+    def stats(self) -> Dict:
+        """Memory use and the expected false-positive rate of a membership check"""
+        with self._lock:
+            blooms = [bloom for _, bloom in self._generations]
+        miss_probability = 1.0
+        for bloom in blooms:
+            miss_probability *= 1 - bloom.estimated_false_positive_rate()
+        return {
+            'generations': len(blooms),
+            'items': sum(bloom.count for bloom in blooms),
+            'memory_bytes': sum(bloom.memory_bytes for bloom in blooms),
+            'early_rotations': self.early_rotations,
+            'generation_fill': [round(bloom.count / bloom.capacity, 4) for bloom in blooms],
+            'estimated_false_positive_rate': 1 - miss_probability
+        }
@@ -0,0 +1,191 @@
+import random
+import threading
+import zlib
+from typing import Dict, List, Optional, Set
+from config import Config
+from python_scripts.public_chat.bloom import BloomFilter
+
+def name_grams(text: str) -> Set[str]:
+    """Character trigrams of a lower-cased name; a substring query's trigrams are all in any name it matches"""
+    text = (text or '').lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class AttenuatedBloomFilter:
+    """One Bloom filter per hop distance: level 0 holds a node's own file names, level i what lies i hops further"""
+
+    def __init__(self, depth: int = None, num_bits: int = None, num_hashes: int = None):
+        self.depth = depth or Config.P2P_SUMMARY_DEPTH
+        self.num_bits = num_bits or Config.P2P_SUMMARY_BITS
+        self.num_hashes = num_hashes or Config.P2P_SUMMARY_HASHES
+        self.levels = [self._empty() for _ in range(self.depth)]
+
+    def _empty(self) -> BloomFilter:
+        return BloomFilter(capacity=1, num_bits=self.num_bits, num_hashes=self.num_hashes)
+
+    def same_shape(self, other: 'AttenuatedBloomFilter') -> bool:
+        return (other.depth, other.num_bits, other.num_hashes) == (self.depth, self.num_bits, self.num_hashes)
+
+    def matches(self, grams: Set[str], max_level: int) -> Optional[int]:
+        """Nearest level up to max_level whose filter holds every gram, or None"""
+        for level in range(min(max_level, self.depth - 1) + 1):
+            if all(gram in self.levels[level] for gram in grams):
+                return level
+        return None
+
+    def level_bytes(self) -> List[bytes]:
+        return [level.to_bytes() for level in self.levels]
+
+    def set_level(self, index: int, data: bytes):
+        self.levels[index] = BloomFilter.from_bytes(data, self.num_hashes)
+
+    def fill_ratios(self) -> List[float]:
+        """Share of bits set per level; a saturated level matches every query"""
+        return [round(int.from_bytes(level.bits, 'big').bit_count() / level.num_bits, 4) for level in self.levels]
+
+class FileSummaries:
+    """Exchanges attenuated Bloom filters of file names with neighbours and routes searches by them"""
+
+    def __init__(self, network):
+        self.network = network
+        self.own = AttenuatedBloomFilter()  # What we advertise
+        self.neighbours = {}  # {peer key: AttenuatedBloomFilter} advertised to us
+        self._advertised = None  # Level bytes last sent to synced neighbours
+        self._synced = set()  # Neighbour keys holding our current summary
+        self._names = None  # File names level 0 was last built from
+        self._lock = threading.Lock()
+        self.bytes_sent = 0
+        self.levels_sent = 0
+        self.searches_routed = 0
+        self.links_pruned = 0
+
+    def _build(self) -> AttenuatedBloomFilter:
+        """Level 0 from our shared files, level i from neighbours' level i - 1"""
+        summary = AttenuatedBloomFilter()
+        provider = self.network.file_provider
+        names = frozenset(file_info['name'] for file_info in provider.search_files('')) if provider else frozenset()
+        if names == self._names:
+            summary.levels[0] = self.own.levels[0]
+        else:
+            self._names = names
+            for name in names:
+                for gram in name_grams(name):
+                    summary.levels[0].add(gram)
+        with self.network._lock:
+            peers = list(self.network.peers)
+        with self._lock:
+            neighbours = [self.neighbours[key] for key in peers if key in self.neighbours]
+        for level in range(1, summary.depth):
+            merged = summary.levels[level]
+            for other in neighbours:
+                merged.union(other.levels[level - 1])
+        return summary
+
+    def refresh(self):
+        """Rebuild our summary and send each neighbour what changed since it last heard from us"""
+        self.own = self._build()
+        levels = self.own.level_bytes()
+        previous = self._advertised
+        changed = [i for i, data in enumerate(levels) if previous is None or previous[i] != data]
+        self._advertised = levels
+
+        with self.network._lock:
+            links = list(self.network.peers.values())
+        for link in links:
+            if link.key not in self._synced:
+                self._send(link, range(len(levels)))
+            elif changed:
+                self._send(link, changed)
+
+    def send_current(self, link):
+        """Give a new neighbour our whole summary"""
+        if self._advertised is not None:
+            self._send(link, range(len(self._advertised)))
+
+    def _send(self, link, indexes):
+        indexes = list(indexes)
+        data = zlib.compress(b''.join(self._advertised[i] for i in indexes))
+        try:
+            link.send({
+                'type': 'summary',
+                'levels': indexes,
+                'depth': self.own.depth,
+                'num_bits': self.own.num_bits,
+                'num_hashes': self.own.num_hashes,
+                'data': data
+            })
+        except Exception as e:
+            print(f"Error sending file summary to {link.key}: {e}")
+            self._synced.discard(link.key)
+            return
+        self._synced.add(link.key)
+        self.bytes_sent += len(data)
+        self.levels_sent += len(indexes)
+
+    def on_summary(self, message: Dict, link):
+        """Store the levels a neighbour sent; unknown shapes are ignored and the neighbour stays unsummarised"""
+        shape = (message.get('depth'), message.get('num_bits'), message.get('num_hashes'))
+        # Check the shape before allocating anything, so a peer can't make us build huge filters
+        if link.key not in self.network.peers or shape != (self.own.depth, self.own.num_bits, self.own.num_hashes):
+            return
+        size = self.own.num_bits // 8
+        indexes = message.get('levels', [])
+        if not isinstance(indexes, list) or not all(isinstance(i, int) and 0 <= i < self.own.depth for i in indexes) \
+                or len(set(indexes)) != len(indexes):
+            return
+        expected = size * len(indexes)
+        try:
+            # Inflate at most one byte past what the levels need, so a compression bomb can't exhaust memory
+            inflater = zlib.decompressobj()
+            data = inflater.decompress(message.get('data', b''), expected + 1)
+        except (zlib.error, TypeError) as e:
+            print(f"Error reading file summary from {link.key}: {e}")
+            return
+        if len(data) != expected or inflater.unconsumed_tail:
+            return
+        with self._lock:
+            summary = self.neighbours.setdefault(link.key, AttenuatedBloomFilter())
+            for position, index in enumerate(indexes):
+                summary.set_level(index, data[position * size:(position + 1) * size])
+
+    def forget(self, key):
+        with self._lock:
+            self.neighbours.pop(key, None)
+        self._synced.discard(key)
+
+    def route(self, query: str, links: List, hops: int) -> List:
+        """Neighbours whose summary matches within the hops a search may still travel past them"""
+        grams = name_grams(query)
+        if not grams or not links:
+            return links  # Too short to summarise
+        matched, unknown, others = [], [], []
+        with self._lock:
+            for link in links:
+                summary = self.neighbours.get(link.key)
+                if summary is None:
+                    unknown.append(link)
+                elif summary.matches(grams, hops) is not None:
+                    matched.append(link)
+                else:
+                    others.append(link)
+        # Neighbours that have not summarised yet always get it; if the search can travel beyond
+        # the summarised horizon and nothing inside it matched, a few others still carry it on
+        chosen = matched + unknown
+        if not matched and hops >= self.own.depth:
+            chosen += random.sample(others, min(len(others), Config.P2P_SUMMARY_FANOUT))
+        self.searches_routed += 1
+        self.links_pruned += len(links) - len(chosen)
+        return chosen
+
+    def stats(self) -> Dict:
+        with self._lock:
+            summarised = len(self.neighbours)
+        return {
+            'depth': self.own.depth,
+            'level_bytes': self.own.num_bits // 8,
+            'fill': self.own.fill_ratios(),
+            'neighbours_summarised': summarised,
+            'bytes_sent': self.bytes_sent,
+            'levels_sent': self.levels_sent,
+            'searches_routed': self.searches_routed,
+            'links_pruned': self.links_pruned
+        }
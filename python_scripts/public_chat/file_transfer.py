@@ -0,0 +1,184 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, Optional
+from config import Config
+from python_scripts.public_chat.p2p_protocol import FileRegion
+
+class OutgoingTransfer:
+    """Streams a byte range of a file on disk to one peer as acknowledged fixed-size chunks"""
+
+    def __init__(self, link, transfer_id: str, filename: str, path: str,
+                 offset: int = 0, length: int = None, chunk_size: int = None, window: int = None,
+                 sha256: str = None, on_close=None):
+        self.link = link
+        self.transfer_id = transfer_id
+        self.filename = filename
+        self.file = open(path, 'rb')  # Chunks are regions of this, handed to the socket with sendfile
+        self._file_lock = threading.Lock()  # Shared by the chunk regions, which seek the file when read
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.start = max(0, min(int(offset), self.size))
+        self.end = self.size if length is None else min(self.size, self.start + int(length))
+        self.chunk_size = chunk_size or Config.P2P_CHUNK_SIZE
+        self.window = (window or Config.P2P_TRANSFER_WINDOW) * self.chunk_size  # Unacknowledged bytes allowed
+        self.next_offset = self.start
+        self.acked_offset = self.start
+        self.sha256 = sha256  # Digest of the range when a manifest already has it
+        self.hasher = None if sha256 else hashlib.sha256()
+        self.end_sent = False
+        self.last_activity = time.time()
+        self._lock = threading.Lock()
+        self._pumping = False  # Guards against re-entry when acks arrive synchronously in-process
+        self.on_close = on_close  # Called once the file is released
+
+    def begin(self):
+        """Announce the transfer and send the first window of chunks"""
+        self.link.send({
+            'type': 'file_meta',
+            'transfer_id': self.transfer_id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': self.start,
+            'length': self.end - self.start,
+            'chunk_size': self.chunk_size
+        })
+        self.pump()
+
+    def pump(self):
+        """Send chunks while the receiver has granted credit"""
+        with self._lock:
+            if self._pumping:
+                return
+            self._pumping = True
+        while True:
+            with self._lock:
+                if self.end_sent or self.next_offset - self.acked_offset >= self.window:
+                    self._pumping = False
+                    return
+                offset = self.next_offset
+                chunk = FileRegion(self.file, offset, min(self.end, offset + self.chunk_size) - offset,
+                                   self._file_lock)
+                self.next_offset += len(chunk)
+                if self.hasher is not None:
+                    self.hasher.update(chunk.read())  # No digest to vouch for this range, so it must be read
+                finished = self.next_offset >= self.end
+                self.end_sent = finished
+
+            if chunk:
+                self.link.send({
+                    'type': 'file_chunk',
+                    'transfer_id': self.transfer_id,
+                    'offset': offset,
+                    'data': chunk
+                })
+            if finished:
+                self.link.send({
+                    'type': 'file_end',
+                    'transfer_id': self.transfer_id,
+                    'length': self.end - self.start,
+                    'sha256': self.sha256 or self.hasher.hexdigest()
+                })
+
+    def on_ack(self, offset: int):
+        """Receiver has written everything before offset; send more"""
+        self.last_activity = time.time()
+        with self._lock:
+            self.acked_offset = max(self.acked_offset, min(int(offset), self.end))
+        self.pump()
+
+    @property
+    def done(self) -> bool:
+        return self.end_sent and self.acked_offset >= self.end
+
+    def close(self):
+        """Stop sending and release the file; chunks still queued for it are padded by the endpoint"""
+        with self._lock:
+            if self.file.closed:
+                return
+            self.end_sent = True
+            with self._file_lock:
+                self.file.close()
+        if self.on_close:
+            self.on_close()
+
+class IncomingTransfer:
+    """Writes a streamed byte range to disk as chunks arrive and verifies it at the end"""
+
+    def __init__(self, link, transfer_id: str, filename: str, path: str, offset: int = 0, length: int = None,
+                 expected_sha256: str = None, owner=None):
+        self.link = link
+        self.transfer_id = transfer_id
+        self.filename = filename
+        self.path = path
+        self.start = int(offset)
+        self.length = length  # Filled in from file_meta when unknown
+        self.size = None  # Whole file size reported by the sender
+        self.expected_sha256 = expected_sha256  # Digest from a trusted manifest, if any
+        self.owner = owner  # SwarmDownload this range belongs to, if any
+        self.piece = None
+        self.next_offset = self.start
+        self.hasher = hashlib.sha256()
+        self.started_at = self.last_activity = time.time()
+        self.error = None
+        self.closed = False
+        self._lock = threading.Lock()  # Chunks arrive on handler threads while a swarm tick may close the range
+
+        # The file may be shared with other ranges of the same download, so never truncate it
+        self.file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o600), 'r+b')
+
+    def on_meta(self, message: Dict):
+        self.size = message.get('size')
+        if self.length is None:
+            self.length = message.get('length')
+
+    def on_chunk(self, offset: int, data) -> bool:
+        """Write a chunk at its offset and acknowledge it; chunks arrive in order per connection"""
+        self.last_activity = time.time()
+        if offset != self.next_offset:
+            self.error = f"Expected chunk at offset {self.next_offset}, got {offset}"
+            return False
+        view = memoryview(data)
+        with self._lock:
+            if self.closed:
+                self.error = "Transfer was closed"
+                return False
+            self.file.seek(offset)
+            self.file.write(view)
+            self.hasher.update(view)
+            self.next_offset += len(view)
+        self.link.send({'type': 'file_ack', 'transfer_id': self.transfer_id, 'offset': self.next_offset})
+        return True
+
+    def finish(self, message: Dict) -> bool:
+        """Check the end-of-stream length and digest; returns True if the range is intact"""
+        self.close()
+        if self.error:
+            return False
+        received = self.next_offset - self.start
+        if received != message.get('length'):
+            self.error = f"Received {received} of {message.get('length')} bytes"
+        elif self.hasher.hexdigest() != (self.expected_sha256 or message.get('sha256')):
+            self.error = "Checksum mismatch"
+        return self.error is None
+
+    @property
+    def received(self) -> int:
+        return self.next_offset - self.start
+
+    def throughput(self) -> float:
+        """Bytes per second so far"""
+        return self.received / max(time.time() - self.started_at, 1e-6)
+
+    def close(self):
+        with self._lock:
+            if not self.closed:
+                self.closed = True
+                self.file.close()
+
+def expire_transfers(transfers: Dict[str, object], timeout: Optional[float] = None) -> list:
+    """Remove transfers idle longer than timeout and return them"""
+    timeout = timeout or Config.P2P_TRANSFER_TIMEOUT
+    now = time.time()
+    expired = [key for key, transfer in list(transfers.items()) if now - transfer.last_activity > timeout]
+    return [transfers.pop(key) for key in expired if key in transfers]
@@ -0,0 +1,354 @@
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from config import Config
+from python_scripts.public_chat.p2p_endpoint import P2PEndpoint
+from python_scripts.public_chat.p2p_flood import P2PFloodNetwork
+from python_scripts.public_chat.socketio_bridge import SocketIOBridge
+
+TOPOLOGIES = ('random', 'small_world', 'scale_free')
+
+# Each generator aims for an average of `degree` links per node
+def random_graph(n: int, degree: int, rng: random.Random) -> Set[Tuple[int, int]]:
+    """Every node links to `degree // 2` others picked uniformly"""
+    edges = set()
+    for node in range(n):
+        for other in rng.sample(range(n), min(max(1, degree // 2) + 1, n)):
+            if other != node:
+                edges.add((min(node, other), max(node, other)))
+    return edges
+
+def small_world_graph(n: int, degree: int, rng: random.Random, rewire: float = 0.1) -> Set[Tuple[int, int]]:
+    """Watts-Strogatz: a ring lattice of `degree` neighbours with each link rewired with probability `rewire`"""
+    edges = set()
+    for node in range(n):
+        for step in range(1, max(1, degree // 2) + 1):
+            other = (node + step) % n
+            if rng.random() < rewire:
+                other = rng.randrange(n)
+            if other != node:
+                edges.add((min(node, other), max(node, other)))
+    return edges
+
+def scale_free_graph(n: int, degree: int, rng: random.Random) -> Set[Tuple[int, int]]:
+    """Barabasi-Albert: each new node attaches to `degree // 2` existing nodes in proportion to their degree"""
+    links = max(1, degree // 2)
+    edges = set()
+    targets = []  # One entry per link end, so sampling it is degree-proportional
+    for node in range(n):
+        if node <= links:
+            chosen = set(range(node))
+        else:
+            chosen = set()
+            while len(chosen) < links:
+                chosen.add(rng.choice(targets))
+        for other in chosen:
+            edges.add((other, node))
+            targets += [other, node]
+    return edges
+
+def build_topology(name: str, n: int, degree: int, rng: random.Random) -> Set[Tuple[int, int]]:
+    if name == 'small_world':
+        return small_world_graph(n, degree, rng)
+    if name == 'scale_free':
+        return scale_free_graph(n, degree, rng)
+    return random_graph(n, degree, rng)
+
+def percentiles(values: List[float], points=(50, 90, 99)) -> Dict[str, Optional[float]]:
+    ordered = sorted(values)
+    if not ordered:
+        return {f'p{point}': None for point in points}
+    return {f'p{point}': round(ordered[min(len(ordered) - 1, int(len(ordered) * point / 100))], 3) for point in points}
+
+class Catalog:
+    """In-memory stand-in for a SecureBucket: the file provider a simulated node serves from"""
+
+    def __init__(self, files: Dict[str, bytes]):
+        self.files = {hashlib.sha256(name.encode()).hexdigest(): (name, content) for name, content in files.items()}
+
+    def search_files(self, query: str) -> list:
+        query = query.lower()
+        return [{'id': file_id, 'name': name, 'size': len(content)}
+                for file_id, (name, content) in self.files.items() if query in name.lower()]
+
+    def get_file_content(self, file_id: str) -> Optional[bytes]:
+        entry = self.files.get(file_id)
+        return entry[1] if entry else None
+
+class RecordingBridge(SocketIOBridge):
+    """Keeps browser events in memory instead of emitting them through Flask-SocketIO"""
+
+    def __init__(self):
+        super().__init__()
+        self.events = []
+
+    def emit(self, event: str, data: Dict, **kwargs):
+        self.events.append((time.time(), event, data))
+        self.emitted += 1
+
+class _CpuMeter:
+    """Charges handler thread CPU time to the node whose handler is running, nested local deliveries included"""
+    _local = threading.local()
+
+    @classmethod
+    def enter(cls, network):
+        now = time.thread_time()
+        previous = getattr(cls._local, 'owner', None)
+        if previous is not None:
+            previous.cpu_seconds += now - cls._local.mark
+        cls._local.owner, cls._local.mark = network, now
+        return previous
+
+    @classmethod
+    def leave(cls, network, previous):
+        now = time.thread_time()
+        network.cpu_seconds += now - cls._local.mark
+        cls._local.owner, cls._local.mark = previous, now
+
+class SimulatedNode(P2PFloodNetwork):
+    """Flood network that measures the CPU its message handlers use"""
+
+    def __init__(self, *args, **kwargs):
+        self.cpu_seconds = 0.0
+        super().__init__(*args, **kwargs)
+
+    def handle_message(self, message, link):
+        previous = _CpuMeter.enter(self)
+        try:
+            return super().handle_message(message, link)
+        finally:
+            _CpuMeter.leave(self, previous)
+
+class FloodSimulator:
+    """Runs N flood networks in this process, linked over loopback in a chosen topology"""
+
+    def __init__(self, nodes: int = 100, servers: int = None, topology: str = 'random', degree: int = 4,
+                 titles: int = 200, files_per_node: int = 3, file_size: int = 64 * 1024, seed: int = 1,
+                 handler_threads: int = None):
+        self.node_count = nodes
+        self.server_count = max(1, min(servers or nodes, nodes))
+        self.topology = topology if topology in TOPOLOGIES else 'random'
+        self.degree = degree
+        self.title_count = titles
+        self.files_per_node = files_per_node
+        self.file_size = file_size
+        self.seed = seed
+        self.handler_threads = handler_threads
+        self.rng = random.Random(seed)
+        self.endpoints = []
+        self.nodes = []
+        self.edges = set()
+        self.titles = []
+        self._popularity = []
+        self._saved_config = {}
+
+    def _configure(self, **values):
+        for key, value in values.items():
+            self._saved_config.setdefault(key, getattr(Config, key))
+            setattr(Config, key, value)
+
+    def _title(self) -> str:
+        word = lambda: ''.join(self.rng.choice('bdfgklmnprstvz') + self.rng.choice('aeiou') for _ in range(3))
+        return f"{word()}_{word()}.{self.rng.choice(['mp3', 'pdf', 'mkv', 'zip'])}"
+
+    def _content(self, title: str) -> bytes:
+        """Same bytes on every replica, so multi-source downloads agree on the manifest"""
+        block = hashlib.sha256(title.encode()).digest()
+        return (block * (self.file_size // len(block) + 1))[:self.file_size]
+
+    def start(self):
+        """Bind the endpoints, create the nodes with their catalogs and link them"""
+        self.edges = build_topology(self.topology, self.node_count, self.degree, self.rng)
+        degrees = [0] * self.node_count
+        for a, b in self.edges:
+            degrees[a] += 1
+            degrees[b] += 1
+        # The overlay should be exactly the generated graph: no co-located extras, no refusals, no top-ups
+        self._configure(
+            P2P_ADVERTISE_HOST='127.0.0.1',
+            P2P_LOCAL_PEERS=0,
+            P2P_MAX_DEGREE=max(Config.P2P_MAX_DEGREE, max(degrees) + 1),
+            P2P_MIN_DEGREE=min(Config.P2P_MIN_DEGREE, min(degrees)),
+            P2P_HANDLER_THREADS=self.handler_threads or Config.P2P_HANDLER_THREADS,
+            P2P_PARTIAL_FOLDER=tempfile.mkdtemp(prefix='flood_sim_partial_')
+        )
+        SocketIOBridge._instance = RecordingBridge()
+
+        # Zipf popularity: title i is replicated and queried in proportion to 1 / (i + 1)
+        self.titles = [self._title() for _ in range(self.title_count)]
+        self._popularity = [1 / (rank + 1) for rank in range(self.title_count)]
+
+        self.endpoints = [P2PEndpoint(host='127.0.0.1', port=0, advertise_host='127.0.0.1')
+                          for _ in range(self.server_count)]
+        for index in range(self.node_count):
+            names = set(self.rng.choices(self.titles, weights=self._popularity, k=self.files_per_node))
+            self.nodes.append(SimulatedNode(
+                f'sim{index}', f'sim{index}',
+                file_provider=Catalog({name: self._content(name) for name in names}),
+                endpoint=self.endpoints[index % self.server_count]
+            ))
+        for a, b in sorted(self.edges):
+            self.nodes[a].connect_to_peer(self.nodes[b].host, self.nodes[b].port, self.nodes[b].node_id)
+
+    def wait_for_overlay(self, timeout: float = 30) -> bool:
+        """Wait until every link has completed its handshake, then let file summaries spread"""
+        deadline = time.time() + timeout
+        expected = 2 * len(self.edges)
+        while time.time() < deadline and sum(len(node.peers) for node in self.nodes) < expected:
+            time.sleep(0.1)
+        linked = sum(len(node.peers) for node in self.nodes) >= expected
+        # Refresh until no summary changes any more, so the searches measured don't pay for it
+        sent = None
+        for _ in range(4 * Config.P2P_SUMMARY_DEPTH):
+            for node in self.nodes:
+                node.summaries.refresh()
+            time.sleep(0.2)
+            total = sum(node.summaries.levels_sent for node in self.nodes)
+            if total == sent:
+                break
+            sent = total
+        return linked
+
+    def holders(self, query: str, exclude=None) -> Set[str]:
+        """Node ids that should answer a query"""
+        return {node.node_id for node in self.nodes
+                if node is not exclude and node.file_provider.search_files(query)}
+
+    def _messages(self, strategy: str) -> int:
+        return sum(node.router.stats().get(strategy, {}).get('messages', 0) for node in self.nodes)
+
+    def _bytes_sent(self) -> int:
+        return sum(peer['bytes_sent'] for endpoint in self.endpoints for peer in endpoint.stats()['peers'])
+
+    def _frames_dropped(self) -> int:
+        return sum(endpoint.stats()['frames_dropped'] for endpoint in self.endpoints)
+
+    def _cpu(self) -> Tuple[float, List[float]]:
+        return time.process_time(), [node.cpu_seconds for node in self.nodes]
+
+    def run_searches(self, queries: int = 100, rate: float = 20, strategy: str = None) -> Dict:
+        """Replay popularity-weighted searches from random nodes and measure what they cost and find"""
+        strategy = strategy or Config.P2P_SEARCH_STRATEGY
+        messages_before = self._messages(strategy)
+        bytes_before = self._bytes_sent()
+        dropped_before = self._frames_dropped()
+        process_before, nodes_before = self._cpu()
+
+        runs = []
+        lock = threading.Lock()
+        for _ in range(queries):
+            origin = self.rng.choice(self.nodes)
+            title = self.rng.choices(self.titles, weights=self._popularity)[0]
+            query = title.rsplit('.', 1)[0]
+            run = {'origin': origin, 'query': query, 'expected': self.holders(query, exclude=origin),
+                   'started': time.time(), 'hits': [], 'done': threading.Event()}
+
+            def on_results(query_id, hits, run=run):
+                with lock:
+                    run['hits'] += [(time.time(), hit) for hit in hits]
+
+            def on_complete(query_id, count, reason, run=run):
+                run['done'].set()
+
+            origin.flood_search(query, strategy, on_results=on_results, on_complete=on_complete)
+            runs.append(run)
+            time.sleep(1 / rate if rate else 0)
+        for run in runs:
+            run['done'].wait(Config.P2P_SEARCH_DEADLINE + 1)
+
+        process_after, nodes_after = self._cpu()
+        messages = self._messages(strategy) - messages_before
+        recalls, first_hit, all_hits = [], [], []
+        for run in runs:
+            found = {hit['node_id'] for _, hit in run['hits']} & run['expected']
+            if run['expected']:
+                recalls.append(len(found) / min(len(run['expected']), Config.P2P_SEARCH_QUORUM))
+            latencies = [(at - run['started']) * 1000 for at, _ in run['hits']]
+            all_hits += latencies
+            if latencies:
+                first_hit.append(min(latencies))
+        node_cpu = [(after - before) * 1000 for before, after in zip(nodes_before, nodes_after)]
+
+        return {
+            'strategy': strategy,
+            'queries': queries,
+            'messages_per_query': round(messages / queries, 2) if queries else 0,
+            # Search copies sent per other node in the overlay; 1.0 means each node got it exactly once
+            'amplification': round(messages / queries / max(1, self.node_count - 1), 3) if queries else 0,
+            'recall': round(sum(recalls) / len(recalls), 4) if recalls else None,
+            'answered': sum(1 for run in runs if run['hits']),
+            'first_hit_ms': percentiles(first_hit),
+            'hit_latency_ms': percentiles(all_hits),
+            # Everything the overlay sent over loopback while the searches ran, divided by the searches
+            'bytes_per_query': round((self._bytes_sent() - bytes_before) / queries) if queries else 0,
+            'frames_dropped': self._frames_dropped() - dropped_before,
+            'cpu': {
+                'process_seconds': round(process_after - process_before, 3),
+                'per_node_ms': percentiles(node_cpu, (50, 95, 100))
+            }
+        }
+
+    def run_downloads(self, downloads: int = 10, timeout: float = 60) -> Dict:
+        """Fetch popular files from every source the searches found and time the transfers"""
+        started = []
+        candidates = [node for node in self.nodes if node.file_sources]
+        self.rng.shuffle(candidates)
+        for node in candidates[:downloads]:
+            filename = next(reversed(node.file_sources))
+            path = node._download_path(filename)
+            if path.exists():
+                path.unlink()
+            try:
+                node.download_file(filename)
+            except Exception as e:
+                print(f"Error starting simulated download of {filename}: {e}")
+                continue
+            started.append((node, filename, path, time.time(), len(node.file_sources.get(filename, []))))
+
+        seconds, sources = [], []
+        deadline = time.time() + timeout
+        for node, filename, path, began, source_count in started:
+            while not path.exists() and time.time() < deadline:
+                time.sleep(0.01)
+            if path.exists():
+                seconds.append(time.time() - began)
+                sources.append(source_count)
+        total = sum(os.path.getsize(path) for _, _, path, _, _ in started if path.exists())
+        return {
+            'started': len(started),
+            'completed': len(seconds),
+            'seconds': percentiles(seconds),
+            'mean_sources': round(sum(sources) / len(sources), 2) if sources else None,
+            'throughput_mbps': round(total * 8 / 1e6 / sum(seconds), 2) if seconds and sum(seconds) else None
+        }
+
+    def describe(self) -> Dict:
+        degrees = [len(node.peers) for node in self.nodes]
+        return {
+            'nodes': self.node_count,
+            'servers': self.server_count,
+            'topology': self.topology,
+            'links': len(self.edges),
+            'degree': percentiles(degrees, (0, 50, 100)),
+            'titles': self.title_count,
+            'files_per_node': self.files_per_node,
+            'file_size': self.file_size,
+            'seed': self.seed,
+            'handler_threads': Config.P2P_HANDLER_THREADS
+        }
+
+    def stop(self):
+        """Shut every node and endpoint down and restore the configuration"""
+        for node in self.nodes:
+            node.shutdown()
+        for endpoint in self.endpoints:
+            endpoint.shutdown()
+        shutil.rmtree(Config.P2P_PARTIAL_FOLDER, ignore_errors=True)
+        for key, value in self._saved_config.items():
+            setattr(Config, key, value)
+        SocketIOBridge._instance = None
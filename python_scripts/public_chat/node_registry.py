@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from config import Config
+from python_scripts.public_chat.chat_node import ChatNode
+from python_scripts.public_chat.content_index import ContentIndex
+from python_scripts.public_chat.p2p_endpoint import P2PEndpoint
+from python_scripts.public_chat.p2p_flood import P2PFloodNetwork
+
+class ChatNodeRegistry:
+    """Bounded map of user_id -> ChatNode that evicts idle and least recently used nodes"""
+
+    def __init__(self, max_nodes: int = None, idle_timeout: float = None, reap_interval: float = None):
+        self.max_nodes = max_nodes or Config.CHAT_NODE_LIMIT
+        self.idle_timeout = idle_timeout or Config.CHAT_NODE_IDLE_TIMEOUT
+        self.reap_interval = reap_interval or Config.CHAT_NODE_REAP_INTERVAL
+        self.p2p_idle_timeout = Config.P2P_IDLE_TIMEOUT
+        self.evictions = 0
+
+        self._nodes = OrderedDict()  # user_id -> ChatNode, least recently used first
+        self._last_access = {}  # user_id -> timestamp
+        self._lock = threading.RLock()
+
+        # Frames for a live node whose network is stopped start it again
+        P2PEndpoint.set_node_resolver(self._resolve_network)
+
+        self._reaper_thread = threading.Thread(target=self._reap_loop)
+        self._reaper_thread.daemon = True
+        self._reaper_thread.start()
+
+    def _resolve_network(self, node_id: str):
+        """Start the flood network of a live node that is receiving peer traffic"""
+        with self._lock:
+            node = self._nodes.get(node_id)
+        return node.p2p_network if node else None
+
+    def _touch(self, user_id: str):
+        """Mark a node as just used; call with self._lock held"""
+        self._nodes.move_to_end(user_id)
+        self._last_access[user_id] = time.time()
+
+    def get(self, user_id: str, default=None) -> Optional[ChatNode]:
+        """Get a node and mark it as used"""
+        with self._lock:
+            if user_id not in self._nodes:
+                return default
+            self._touch(user_id)
+            return self._nodes[user_id]
+
+    def get_or_create(self, user_id: str, username: str) -> ChatNode:
+        """Get a node, creating it outside the lock if it does not exist yet"""
+        node = self.get(user_id)
+        if node:
+            return node
+
+        new_node = ChatNode(user_id, username)
+        with self._lock:
+            node = self._nodes.get(user_id)
+            if node is None:
+                self._nodes[user_id] = node = new_node
+            self._touch(user_id)
+        if node is not new_node:
+            # Another request created the node first
+            new_node.shutdown()
+        self._enforce_limit()
+        return node
+
+    def __getitem__(self, user_id: str) -> ChatNode:
+        node = self.get(user_id)
+        if node is None:
+            raise KeyError(user_id)
+        return node
+
+    def __setitem__(self, user_id: str, node: ChatNode):
+        with self._lock:
+            previous = self._nodes.get(user_id)
+            self._nodes[user_id] = node
+            self._touch(user_id)
+        if previous is not None and previous is not node:
+            previous.shutdown()
+        self._enforce_limit()
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._nodes
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def items(self):
+        """Snapshot of (user_id, node) pairs; does not count as use"""
+        with self._lock:
+            return list(self._nodes.items())
+
+    def values(self):
+        with self._lock:
+            return list(self._nodes.values())
+
+    def keys(self):
+        with self._lock:
+            return list(self._nodes.keys())
+
+    def evict(self, user_id: str) -> bool:
+        """Remove a node, flushing its bucket and releasing its sockets and threads"""
+        with self._lock:
+            node = self._nodes.pop(user_id, None)
+            self._last_access.pop(user_id, None)
+        if node is None:
+            return False
+
+        self.evictions += 1
+        try:
+            node.shutdown()
+        except Exception as e:
+            print(f"Error shutting down chat node {user_id}: {e}")
+        return True
+
+    def _enforce_limit(self):
+        """Evict least recently used nodes beyond max_nodes"""
+        while len(self._nodes) > self.max_nodes:
+            with self._lock:
+                user_id = next(iter(self._nodes), None)
+            if user_id is None or not self.evict(user_id):
+                break
+
+    def _last_activity(self, user_id: str, node: ChatNode) -> float:
+        """Latest of registry access and peer traffic handled by the node"""
+        return max(self._last_access.get(user_id, 0), node.last_activity())
+
+    def evict_idle(self) -> int:
+        """Evict every node that has been idle for longer than idle_timeout"""
+        cutoff = time.time() - self.idle_timeout
+        idle = [user_id for user_id, node in self.items() if self._last_activity(user_id, node) < cutoff]
+        return sum(1 for user_id in idle if self.evict(user_id))
+
+    def stop_idle_networks(self) -> int:
+        """Shut down the P2P networks of live nodes that have stopped using them"""
+        return sum(1 for node in self.values() if node.stop_idle_p2p(self.p2p_idle_timeout))
+
+    def _reap_loop(self):
+        """Periodically evict idle nodes, stop idle P2P networks and prune abandoned partial downloads"""
+        while True:
+            time.sleep(self.reap_interval)
+            try:
+                evicted = self.evict_idle()
+                stopped = self.stop_idle_networks()
+                pruned = P2PFloodNetwork.prune_partials()
+                if evicted or stopped or pruned:
+                    print(f"Evicted {evicted} idle chat nodes, stopped {stopped} idle P2P networks and pruned "
+                          f"{pruned} partial download files, {len(self)} nodes still live")
+            except Exception as e:
+                print(f"Error evicting idle chat nodes: {e}")
+
+    def stats(self) -> Dict:
+        """Gauges for live nodes and the process resources they hold"""
+        return {
+            'live_nodes': len(self),
+            'live_p2p_networks': sum(1 for node in self.values() if node.p2p_started),
+            'max_nodes': self.max_nodes,
+            'evictions': self.evictions,
+            'threads': threading.active_count(),
+            'open_fds': self._count_open_fds(),
+            'p2p_endpoint': P2PEndpoint._instance.stats() if P2PEndpoint._instance else None,
+            'p2p_downloads': {**ContentIndex.usage(), 'quota': Config.P2P_DISK_QUOTA, 'node_quota': Config.P2P_NODE_DISK_QUOTA}
+        }
+
+    @staticmethod
+    def _count_open_fds() -> Optional[int]:
+        """Number of open file descriptors, where the platform exposes it"""
+        for fd_dir in ('/proc/self/fd', '/dev/fd'):
+            if os.path.isdir(fd_dir):
+                return len(os.listdir(fd_dir))
+        return None
@@ -0,0 +1,598 @@
+import errno
+import heapq
+import itertools
+import os
+import queue
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+from config import Config
+from python_scripts.public_chat.p2p_protocol import (
+    DROPPABLE_TYPES, FileRegion, FrameDecoder, decode_message, encode_message_parts
+)
+
+HAS_SENDFILE = hasattr(os, 'sendfile')  # Elsewhere file bodies are read into memory when queued
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')  # Missing on Windows, where batches are joined and sent
+
+class PeerLink:
+    """Handle a local flood network uses to send to one remote node"""
+
+    def __init__(self, network, address: Tuple[str, int], node_id: str):
+        self.network = network
+        self.address = (address[0], int(address[1]))  # Listen address of the remote endpoint
+        self.node_id = str(node_id)
+
+    @property
+    def key(self) -> Tuple[str, int, str]:
+        return (self.address[0], self.address[1], self.node_id)
+
+    def send(self, message: Dict):
+        """Send a message from the owning network to the remote node"""
+        self.network.endpoint.send_frame(self.address, {
+            'src': self.network.node_id,
+            'dst': self.node_id,
+            'src_addr': list(self.network.endpoint.address),
+            'body': message
+        })
+
+    def __eq__(self, other):
+        return isinstance(other, PeerLink) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+class PeerConnection:
+    """Per-connection protocol state driven by the endpoint's event loop"""
+
+    def __init__(self, sock: socket.socket, address: Tuple[str, int], connecting: bool = False):
+        sock.setblocking(False)
+        self.sock = sock
+        self.address = address
+        self.connecting = connecting  # Non-blocking connect still in progress
+        self.opened_at = time.time()
+        self.decoder = FrameDecoder()
+        self._outbound = deque()  # memoryviews and FileRegions waiting to be written
+        self._buffered = 0
+        self._lock = threading.Lock()  # Guards _outbound and the inbox; senders run on many threads
+        self.write_pending = False  # Loop already asked to watch for writability
+        self.inbox = deque()  # Decoded frames waiting for a handler, kept in arrival order
+        self.dispatching = False  # A handler thread is draining the inbox
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+        # Backpressure and send latency
+        self._queued_total = 0
+        self._frame_ends = deque()  # (byte offset where a queued frame ends, time it was queued)
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.latency_avg = 0.0  # Moving average of seconds from queueing a frame to its last byte leaving
+        self.latency_max = 0.0
+
+    def data_received(self, data: bytes):
+        """Decode received bytes into (routing, message) pairs"""
+        self.bytes_received += len(data)
+        return [decode_message(frame_type, header, body) for frame_type, header, body in self.decoder.feed(data)]
+
+    def queue(self, parts, droppable: bool = False) -> bool:
+        """Buffer a frame's parts, or drop a droppable one if backed up; returns True if the loop needs waking"""
+        with self._lock:
+            if droppable and self._buffered >= Config.P2P_OUTBOUND_LIMIT:
+                self.frames_dropped += 1
+                return False
+            for part in parts:
+                if isinstance(part, FileRegion):
+                    part = part if HAS_SENDFILE else memoryview(part.read())
+                else:
+                    part = memoryview(part)
+                self._outbound.append(part)
+                self._buffered += len(part)
+                self._queued_total += len(part)
+            self._frame_ends.append((self._queued_total, time.time()))
+            wake = not self.write_pending
+            self.write_pending = True
+            return wake
+
+    def flush(self) -> bool:
+        """Write as much as the socket takes without blocking; returns True once drained"""
+        with self._lock:
+            if self.connecting:
+                return False
+            while self._outbound:
+                head = self._outbound[0]
+                if isinstance(head, FileRegion) and head.closed:
+                    # Its upload was closed before the body left; zeros keep the stream framed and fail the
+                    # receiver's digest check
+                    head = self._outbound[0] = memoryview(bytes(len(head)))
+                try:
+                    if isinstance(head, FileRegion):
+                        # File bodies go from the page cache to the socket without entering Python
+                        sent = os.sendfile(self.sock.fileno(), head.fileno(), head.offset, len(head))
+                        if not sent:
+                            raise OSError(errno.EIO, "Shared file shrank while it was being sent")
+                    else:
+                        # Hand the kernel several buffers at once instead of joining them first
+                        buffers = itertools.takewhile(lambda part: not isinstance(part, FileRegion), self._outbound)
+                        batch = list(itertools.islice(buffers, 64))
+                        sent = self.sock.sendmsg(batch) if HAS_SENDMSG else self.sock.send(b''.join(batch))
+                except (BlockingIOError, InterruptedError):
+                    return False
+                self.bytes_sent += sent
+                self._buffered -= sent
+                while sent:
+                    head = self._outbound[0]
+                    if len(head) <= sent:
+                        sent -= len(head)
+                        self._outbound.popleft()
+                    else:
+                        self._outbound[0] = head.advance(sent) if isinstance(head, FileRegion) else head[sent:]
+                        sent = 0
+                self._record_latency()
+            self.write_pending = False
+            return True
+
+    def _record_latency(self):
+        """Account for frames whose last byte has been written; call with the lock held"""
+        now = time.time()
+        while self._frame_ends and self._frame_ends[0][0] <= self.bytes_sent:
+            latency = now - self._frame_ends.popleft()[1]
+            self.frames_sent += 1
+            self.latency_avg = latency if self.frames_sent == 1 else 0.9 * self.latency_avg + 0.1 * latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def stats(self) -> Dict:
+        return {
+            'address': list(self.address),
+            'connecting': self.connecting,
+            'buffered': self._buffered,
+            'frames_sent': self.frames_sent,
+            'frames_dropped': self.frames_dropped,
+            'send_latency_ms': round(self.latency_avg * 1000, 3),
+            'send_latency_max_ms': round(self.latency_max * 1000, 3),
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received
+        }
+
+    def push_inbox(self, frames) -> bool:
+        """Queue decoded frames; returns True if a handler must be started to drain them"""
+        with self._lock:
+            self.inbox.extend(frames)
+            if self.dispatching or not self.inbox:
+                return False
+            self.dispatching = True
+            return True
+
+    def pop_inbox(self):
+        """Next frame to handle, or None once the inbox is empty and dispatching has stopped"""
+        with self._lock:
+            if self.inbox:
+                return self.inbox.popleft()
+            self.dispatching = False
+            return None
+
+    @property
+    def buffered(self) -> int:
+        return self._buffered
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+class ScheduledCall:
+    """Callback the endpoint runs once its time comes, unless it is cancelled first"""
+
+    def __init__(self, due: float, callback: Callable[[], None]):
+        self.due = due
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class P2PEndpoint:
+    """Process-wide P2P listener that routes frames to local flood networks by node id"""
+    _instance = None
+    _instance_lock = threading.Lock()
+    _node_resolver = None  # node_id -> P2PFloodNetwork for live nodes whose network is stopped
+
+    def __init__(self, host: str = None, port: int = None, advertise_host: str = None):
+        self.networks = {}  # node_id -> P2PFloodNetwork hosted in this process
+        self.connections = {}  # (host, port) of remote endpoint -> outbound PeerConnection
+        self._lock = threading.Lock()
+        self.frames_routed = 0
+        self.frames_local = 0
+        self._last_maintenance = time.time()
+
+        # Setup socket
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host or Config.P2P_HOST, Config.P2P_PORT if port is None else port))
+        self.socket.listen(128)
+        self.socket.setblocking(False)
+        self.port = self.socket.getsockname()[1]
+        self.host = advertise_host or Config.P2P_ADVERTISE_HOST or self._get_system_ip()
+        self.address = (self.host, self.port)
+        self.running = True
+
+        # One selector thread serves every connection; decoded frames go to a small fixed
+        # pool so a slow handler (e.g. an IPFS fetch) can't stall other peers
+        self._open = set()  # PeerConnections registered with the selector
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ, None)
+        self._commands = queue.Queue()  # Callables other threads want run on the loop
+        self._timers = []  # Heap of (due, sequence, ScheduledCall), so deadlines don't each need a thread
+        self._timer_sequence = itertools.count()
+        self._waker, self._wake_sender = socket.socketpair()
+        self._waker.setblocking(False)
+        self._wake_sender.setblocking(False)
+        self.selector.register(self._waker, selectors.EVENT_READ, None)
+        self._handlers = ThreadPoolExecutor(max_workers=Config.P2P_HANDLER_THREADS,
+                                            thread_name_prefix='p2p-handler')
+
+        # Start the event loop
+        self.loop_thread = threading.Thread(target=self._run_loop, name='p2p-endpoint')
+        self.loop_thread.daemon = True
+        self.loop_thread.start()
+
+    @classmethod
+    def get_instance(cls) -> 'P2PEndpoint':
+        """Get the shared endpoint, binding it on first use"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    @classmethod
+    def set_node_resolver(cls, resolver: Callable[[str], Optional[object]]):
+        """Register a callback that starts the network of a live node on incoming traffic"""
+        cls._node_resolver = resolver
+
+    @staticmethod
+    def _get_system_ip() -> str:
+        """Primary address of this host, advertised to remote peers"""
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.connect(('8.8.8.8', 80))
+            ip = s.getsockname()[0]
+            s.close()
+            return ip
+        except Exception:
+            return '127.0.0.1'
+
+    def is_local(self, address: Tuple[str, int]) -> bool:
+        """Whether an advertised address is this endpoint"""
+        return int(address[1]) == self.port and address[0] in (self.host, '127.0.0.1', 'localhost', '0.0.0.0')
+
+    def register(self, network):
+        """Route frames addressed to network.node_id to this network"""
+        with self._lock:
+            self.networks[network.node_id] = network
+
+    def unregister(self, network):
+        """Stop routing to a network and drop co-located links pointing at it"""
+        with self._lock:
+            if self.networks.get(network.node_id) is network:
+                del self.networks[network.node_id]
+            others = list(self.networks.values())
+        for other in others:
+            other.drop_peer((self.host, self.port, network.node_id))
+
+    def local_networks(self):
+        """Snapshot of networks hosted in this process"""
+        with self._lock:
+            return list(self.networks.values())
+
+    def _resolve(self, node_id: str):
+        """Find the local network for a node id, starting it if the node is live"""
+        network = self.networks.get(node_id)
+        if network is None and P2PEndpoint._node_resolver:
+            try:
+                network = P2PEndpoint._node_resolver(node_id)
+            except Exception as e:
+                print(f"Error resolving P2P node {node_id}: {e}")
+        return network
+
+    def _call_soon(self, callback: Callable[[], None]):
+        """Run a callback on the loop thread"""
+        self._commands.put(callback)
+        try:
+            self._wake_sender.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # Wake-up already pending, or shutting down
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> ScheduledCall:
+        """Run a callback on the handler pool after delay seconds"""
+        call = ScheduledCall(time.time() + delay, callback)
+        with self._lock:
+            heapq.heappush(self._timers, (call.due, next(self._timer_sequence), call))
+            earliest = self._timers[0][2] is call
+        if earliest:
+            self._call_soon(lambda: None)  # Wake the loop so it sleeps until the new deadline instead
+        return call
+
+    def _next_timer(self) -> float:
+        """Seconds until the earliest scheduled call"""
+        with self._lock:
+            return max(0.0, self._timers[0][0] - time.time()) if self._timers else 1
+
+    def _run_timers(self):
+        """Hand due calls to the handler pool, which may block where the loop must not"""
+        now = time.time()
+        due = []
+        with self._lock:
+            while self._timers and self._timers[0][0] <= now:
+                due.append(heapq.heappop(self._timers)[2])
+        for call in due:
+            if call.cancelled:
+                continue
+            try:
+                self._handlers.submit(self._run_scheduled, call)
+            except RuntimeError:
+                return  # Shutting down
+
+    @staticmethod
+    def _run_scheduled(call: ScheduledCall):
+        if call.cancelled:
+            return
+        try:
+            call.callback()
+        except Exception as e:
+            print(f"Error in scheduled P2P callback: {e}")
+
+    def _run_loop(self):
+        """Serve the listener and every connection from one thread"""
+        while self.running:
+            try:
+                events = self.selector.select(timeout=min(1, self._maintenance_interval(), self._next_timer()))
+            except OSError:
+                break
+            self._expire_connects()
+            self._run_timers()
+            if time.time() - self._last_maintenance >= self._maintenance_interval():
+                self._last_maintenance = time.time()
+                self._handlers.submit(self._maintain_networks)
+            for key, mask in events:
+                if key.fileobj is self.socket:
+                    self._accept()
+                elif key.fileobj is self._waker:
+                    self._run_commands()
+                else:
+                    connection = key.data
+                    try:
+                        if mask & selectors.EVENT_READ:
+                            self._on_readable(connection)
+                        if mask & selectors.EVENT_WRITE and connection.sock.fileno() != -1:
+                            self._on_writable(connection)
+                    except Exception as e:
+                        # One broken connection must not stop the loop serving every other one
+                        print(f"Error serving endpoint connection {connection.address}: {e}")
+                        self._close_connection(connection)
+        self._close_all()
+
+    def _maintenance_interval(self) -> float:
+        return min(Config.P2P_KEEPALIVE_INTERVAL, Config.P2P_SUMMARY_INTERVAL)
+
+    def _maintain_networks(self):
+        """Run keepalives, degree upkeep and summary refreshes for every local network"""
+        for network in self.local_networks():
+            try:
+                network.maintain()
+            except Exception as e:
+                print(f"Error maintaining peers of node {network.node_id}: {e}")
+
+    def _expire_connects(self):
+        """Give up on connects that have not completed in time"""
+        now = time.time()
+        with self._lock:
+            stale = [connection for connection in self._open
+                     if connection.connecting and now - connection.opened_at > Config.P2P_CONNECT_TIMEOUT]
+        for connection in stale:
+            print(f"Error connecting to endpoint {connection.address}: timed out")
+            self._close_connection(connection)
+
+    def _accept(self):
+        """Accept every pending connection from remote endpoints"""
+        while True:
+            try:
+                sock, address = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if self.running:
+                    print(f"Error accepting connection: {e}")
+                return
+            self._register(PeerConnection(sock, address))
+
+    def _run_commands(self):
+        """Drain wake-up bytes and run queued callbacks"""
+        try:
+            while self._waker.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while True:
+            try:
+                callback = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in P2P endpoint loop: {e}")
+
+    def _register(self, connection: PeerConnection):
+        """Start watching a connection; runs on the loop thread"""
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if connection.buffered or connection.connecting else 0)
+        self.selector.register(connection.sock, events, connection)
+        with self._lock:
+            self._open.add(connection)
+
+    def _on_readable(self, connection: PeerConnection):
+        """Read what is available and hand complete frames to the handler pool"""
+        try:
+            data = connection.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            if self.running:
+                print(f"Error handling endpoint connection {connection.address}: {e}")
+            self._close_connection(connection)
+            return
+        if not data:
+            self._close_connection(connection)
+            return
+        try:
+            # One read may hold several pipelined frames or only part of one
+            frames = [{**routing, 'body': message} for routing, message in connection.data_received(data)]
+            if connection.push_inbox(frames):
+                self._handlers.submit(self._dispatch, connection)
+        except Exception as e:
+            print(f"Error handling endpoint connection {connection.address}: {e}")
+            self._close_connection(connection)
+
+    def _on_writable(self, connection: PeerConnection):
+        """Finish a pending connect, send buffered bytes and stop watching for writability once drained"""
+        if connection.connecting:
+            error = connection.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                print(f"Error connecting to endpoint {connection.address}: {os.strerror(error)}")
+                self._close_connection(connection)
+                return
+            connection.connecting = False
+        try:
+            drained = connection.flush()
+        except OSError as e:
+            if self.running:
+                print(f"Error sending to endpoint {connection.address}: {e}")
+            self._close_connection(connection)
+            return
+        if drained:
+            self.selector.modify(connection.sock, selectors.EVENT_READ, connection)
+
+    def _want_write(self, connection: PeerConnection):
+        """Watch a connection for writability; runs on the loop thread"""
+        try:
+            self.selector.modify(connection.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, connection)
+        except (KeyError, ValueError):
+            pass  # Closed before the loop got to it
+
+    def _dispatch(self, connection: PeerConnection):
+        """Deliver a connection's frames in order on one handler thread at a time"""
+        while True:
+            frame = connection.pop_inbox()
+            if frame is None:
+                return
+            try:
+                self.deliver(frame)
+            except Exception as e:
+                print(f"Error delivering frame to node {frame.get('dst')}: {e}")
+
+    def deliver(self, frame: Dict):
+        """Hand a frame to the local network it is addressed to"""
+        network = self._resolve(str(frame.get('dst')))
+        if network is None:
+            return
+        self.frames_routed += 1
+        reply_link = PeerLink(network, tuple(frame['src_addr']), frame['src'])
+        network.handle_message(frame['body'], reply_link)
+
+    def send_frame(self, address: Tuple[str, int], frame: Dict):
+        """Send a frame to a node, short-circuiting in memory when it lives in this process"""
+        if self.is_local(address):
+            self.frames_local += 1
+            # Copy the body so the receiver can't change a message the sender is still forwarding
+            body = dict(frame['body'])
+            if isinstance(body.get('data'), FileRegion):
+                body['data'] = body['data'].read()
+            self.deliver({**frame, 'body': body})
+            return
+
+        connection = self._get_connection(address)
+        routing = {key: value for key, value in frame.items() if key != 'body'}
+        droppable = frame['body'].get('type') in DROPPABLE_TYPES
+        if connection.queue(encode_message_parts(routing, frame['body']), droppable):
+            self._call_soon(lambda: self._want_write(connection))
+
+    def _get_connection(self, address: Tuple[str, int]) -> PeerConnection:
+        """Get the shared outbound connection to a remote endpoint"""
+        address = (address[0], int(address[1]))
+        with self._lock:
+            connection = self.connections.get(address)
+            if connection is not None:
+                return connection
+        # Connect without blocking; frames queue up until the loop sees the connect complete
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        error = sock.connect_ex(address)
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            raise OSError(error, f"Error connecting to endpoint {address}: {os.strerror(error)}")
+        with self._lock:
+            existing = self.connections.get(address)
+            if existing is not None:
+                sock.close()
+                return existing
+            connection = PeerConnection(sock, address, connecting=error != 0)
+            self.connections[address] = connection
+        self._call_soon(lambda: self._register(connection))
+        return connection
+
+    def _close_connection(self, connection: PeerConnection):
+        """Forget and close a connection; runs on the loop thread"""
+        lost = None
+        with self._lock:
+            for address, existing in list(self.connections.items()):
+                if existing is connection:
+                    del self.connections[address]
+                    lost = address
+            self._open.discard(connection)
+            networks = list(self.networks.values())
+        # Links through a failed outbound connection are dead; stop flooding to them
+        if lost and self.running:
+            for network in networks:
+                network.drop_peers_at(lost)
+        try:
+            self.selector.unregister(connection.sock)
+        except (KeyError, ValueError):
+            pass
+        connection.close()
+
+    def _close_all(self):
+        """Close the selector and every socket once the loop stops"""
+        for key in list(self.selector.get_map().values()):
+            try:
+                key.fileobj.close()
+            except OSError:
+                pass
+        self.selector.close()
+        self._wake_sender.close()
+        with self._lock:
+            self.connections.clear()
+            self._open.clear()
+
+    def stats(self) -> Dict:
+        """Gauges for the shared endpoint"""
+        with self._lock:
+            connections = list(self._open)
+        return {
+            'port': self.port,
+            'local_networks': len(self.networks),
+            'remote_connections': len(self.connections),
+            'open_connections': len(connections),
+            'outbound_buffered': sum(connection.buffered for connection in connections),
+            'frames_dropped': sum(connection.frames_dropped for connection in connections),
+            'peers': [connection.stats() for connection in connections],
+            'frames_routed': self.frames_routed,
+            'frames_local': self.frames_local
+        }
+
+    def shutdown(self):
+        """Stop the event loop, which closes the listener and every connection"""
+        self.running = False
+        self._call_soon(lambda: None)
+        self._handlers.shutdown(wait=False)
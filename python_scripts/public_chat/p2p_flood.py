@@ -1,282 +1,750 @@
-import socket
-import json
-import threading
+import os
+import random
+import re
+import shutil
 from pathlib import Path
 import tempfile
+import threading
 import time
+import uuid
+from collections import OrderedDict
+from config import Config
+from python_scripts.public_chat.content_index import ContentIndex
+from python_scripts.public_chat.dedupe_cache import RotatingDedupeCache
+from python_scripts.public_chat.file_summary import FileSummaries
+from python_scripts.public_chat.file_transfer import IncomingTransfer, OutgoingTransfer, expire_transfers
+from python_scripts.public_chat.p2p_endpoint import P2PEndpoint, PeerLink
+from python_scripts.public_chat.peer_manager import PeerManager
+from python_scripts.public_chat.query_routing import CACHED_STRATEGIES, SEARCH_STRATEGIES, QueryRouter
+from python_scripts.public_chat.search_collector import SearchCollector
+from python_scripts.public_chat.socketio_bridge import SocketIOBridge
+from python_scripts.public_chat.swarm import SwarmDownload, build_manifest
+
+# Message types that reach a node along several paths and are deduplicated by id
+FLOODED_TYPES = {'search'}
 
 class P2PFloodNetwork:
-    def __init__(self, host, port, username):
-        self.host = host
-        self.port = port
+    def __init__(self, node_id, username, file_provider=None, endpoint=None, temp_files=None):
+        self.node_id = str(node_id)
         self.username = username
-        self.peers = {}  # {(host, port): connection}
-        self.file_sources = {}  # {filename: [(host, port, file_id)]}
-        self.temp_directory = tempfile.mkdtemp(prefix=f"p2p_flood_{username}_")
-        self.processed_messages = set()  # Track processed message IDs
-        
-        # Setup socket
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.bind((host, port))
-        self.socket.listen(5)
-        
-        # Start listening thread
-        self.listen_thread = threading.Thread(target=self.listen_for_connections)
-        self.listen_thread.daemon = True
-        self.listen_thread.start()
-
-    def listen_for_connections(self):
-        """Listen for incoming peer connections"""
-        while True:
-            try:
-                connection, address = self.socket.accept()
-                # Start a new thread to handle this peer
-                peer_thread = threading.Thread(
-                    target=self.handle_peer,
-                    args=(connection, address)
-                )
-                peer_thread.daemon = True
-                peer_thread.start()
-                
-                # Store the connection
-                self.peers[address] = connection
-            except Exception as e:
-                print(f"Error accepting connection: {e}")
+        self.file_provider = file_provider  # Owner's SecureBucket: search_files() and get_file_content()
+        self.endpoint = endpoint or P2PEndpoint.get_instance()
+        self.host, self.port = self.endpoint.address  # Advertised address of the shared listener
+        self.peers = {}  # {(host, port, node_id): PeerLink} neighbours that completed the handshake
+        self.file_sources = OrderedDict()  # {filename: [(host, port, file_id, node_id)]} from recent searches
+        self.content_roots = OrderedDict()  # {(node_id, file_id): manifest root} advertised in search results
+        # Finished downloads, indexed as they are written; an index passed in belongs to the caller and
+        # outlives this network, otherwise the network owns one and deletes it on shutdown
+        self._owns_temp_files = temp_files is None
+        if self._owns_temp_files:
+            temp_files = ContentIndex(tempfile.mkdtemp(prefix=f"p2p_flood_{username}_"))
+        self.temp_files = temp_files
+        self.temp_directory = self.temp_files.directory
+        self.processed_messages = RotatingDedupeCache()  # Track processed message IDs
+        self.uploads = {}  # {(peer key, transfer_id): OutgoingTransfer}
+        self.downloads = {}  # {transfer_id: IncomingTransfer}
+        self.swarms = {}  # {swarm_id: SwarmDownload}
+        self.swarms_by_root = {}  # {content root: SwarmDownload}; one download per content owns its partial files
+        # Decrypted shared files; mkdtemp makes the directory owner-only and mkstemp spools files mode 0600
+        self.serve_directory = tempfile.mkdtemp(prefix=f"p2p_serve_{username}_")
+        self._serving = OrderedDict()  # {file_id: (path, manifest)} recently served, most recent last
+        self._serving_pins = {}  # {path: open uploads} spooled files kept on disk until their uploads close
+        self.router = QueryRouter()
+        self.summaries = FileSummaries(self)  # Attenuated Bloom filters of file names, ours and our neighbours'
+        self._last_summary = 0.0
+        self.queries = OrderedDict()  # {query_id: SearchCollector} for searches we originated
+        self.last_activity = time.time()
+        self.running = True
+        self._lock = threading.Lock()  # Guards peers and file_sources; frames arrive on pool threads
+        self.peer_manager = PeerManager(self)
+
+        # Receive frames addressed to this node through the shared endpoint
+        self.endpoint.register(self)
+        self._join_local_overlay()
+
+    def _join_local_overlay(self):
+        """Link to a few co-located nodes so floods reach them without touching the network"""
+        candidates = [network for network in self.endpoint.local_networks() if network is not self]
+        for other in random.sample(candidates, min(Config.P2P_LOCAL_PEERS, len(candidates))):
+            # The handshake links both sides
+            self.add_peer(PeerLink(self, self.endpoint.address, other.node_id))
+
+    def add_peer(self, link):
+        """Offer a link to the flooding overlay; it joins once the handshake completes"""
+        return self.peer_manager.offer(link)
+
+    def drop_peer(self, key):
+        """Remove a link from the flooding overlay"""
+        self.peer_manager.prune(key)
+
+    def drop_peers_at(self, address):
+        """Remove every link to nodes behind a remote endpoint that went away"""
+        for state in self.peer_manager._snapshot():
+            if state.link.key[:2] == tuple(address):
+                self.peer_manager.prune(state.link.key)
+
+    def _attach_peer(self, link):
+        with self._lock:
+            self.peers.setdefault(link.key, link)
+        self.summaries.send_current(link)
+
+    def _detach_peer(self, key):
+        with self._lock:
+            self.peers.pop(tuple(key), None)
+        self.summaries.forget(tuple(key))
+
+    def maintain(self):
+        """Periodic upkeep run by the endpoint: neighbour liveness and degree, then file summaries"""
+        self.peer_manager.maintain()
+        if time.time() - self._last_summary >= Config.P2P_SUMMARY_INTERVAL:
+            self._last_summary = time.time()
+            self.summaries.refresh()
+
+    def handle_message(self, message, link):
+        """Handle a message routed to this node by the endpoint"""
+        if not self.running:
+            return
+        self.last_activity = time.time()
+
+        try:
+            # Overlay maintenance is point to point and never deduplicated or forwarded
+            if message['type'] in ('hello', 'hello_ack', 'bye', 'ping', 'pong', 'peers_request', 'peers'):
+                self.handle_lifecycle(message, link)
+                return
+            if message['type'] == 'summary':
+                self.summaries.on_summary(message, link)
+                return
+
+            # Skip flooded messages we've already processed; point-to-point requests and responses arrive
+            # once, so they never risk being dropped by a Bloom filter false positive
+            flooded = message['type'] in FLOODED_TYPES or message.get('ttl', 0) > 0
+            if flooded and self.processed_messages.check_and_add(message.get('id')):
+                return
+
+            # Refresh the sender's liveness, or offer it a link so floods also travel back towards it
+            self.peer_manager.on_message(link)
+
+            # Handle different message types
+            answered = None
+            if message['type'] == 'search':
+                answered = self.handle_search(message, link)
+            elif message['type'] == 'search_response':
+                self.handle_search_response(message)
+            elif message['type'] == 'file_request':
+                self.handle_file_request(message, link)
+            elif message['type'] == 'file_meta':
+                self.handle_file_meta(message)
+            elif message['type'] == 'file_chunk':
+                self.handle_file_chunk(message)
+            elif message['type'] == 'file_ack':
+                self.handle_file_ack(message, link)
+            elif message['type'] == 'file_end':
+                self.handle_file_end(message)
+            elif message['type'] == 'manifest_request':
+                self.handle_manifest_request(message, link)
+            elif message['type'] == 'manifest':
+                self.handle_manifest(message, link)
+
+            # Searches travel along their routing strategy; other messages with a TTL are flooded
+            if message['type'] == 'search':
+                # A walker stops at its first hit, and a cached answer stops a non-flood query
+                if answered != 'cache' and not (answered and message.get('strategy') == 'random_walk'):
+                    self._forward_search(message, exclude=link)
+            elif message.get('ttl', 0) > 0:
+                self._flood_message(message, exclude=link)
+
+        except Exception as e:
+            print(f"Error handling message from peer {link.key}: {e}")
+
+    def handle_lifecycle(self, message, link):
+        """Handshake, keepalive and neighbour exchange messages"""
+        manager = self.peer_manager
+        message_type = message['type']
+        if message_type == 'hello':
+            manager.on_hello(message, link)
+        elif message_type == 'hello_ack':
+            manager.on_hello_ack(message, link)
+        elif message_type == 'bye':
+            manager.on_bye(message, link)
+        elif message_type == 'ping':
+            manager.on_message(link)
+            manager.on_ping(message, link)
+        elif message_type == 'pong':
+            manager.on_message(link)
+            manager.on_pong(message, link)
+        elif message_type == 'peers_request':
+            manager.on_peers_request(link)
+        elif message_type == 'peers':
+            manager.on_peers(message)
+
+    def shutdown(self):
+        """Stop receiving frames, drop all peer links and delete downloaded files"""
+        self.running = False
+        self.endpoint.unregister(self)
+        with self._lock:
+            self.peers.clear()
+            downloads = list(self.downloads.values())
+            self.downloads.clear()
+            uploads = list(self.uploads.values())
+            self.uploads.clear()
+            swarms = list(self.swarms.values())
+            self.swarms.clear()
+            self.swarms_by_root.clear()
+            self._serving.clear()
+            queries = list(self.queries.values())
+            self.queries.clear()
+        for query in queries:
+            query.finish('shutdown')
+        for swarm in swarms:
+            swarm.stop()
+        for transfer in downloads:
+            transfer.close()
+        for upload in uploads:
+            upload.close()
+        if self._owns_temp_files:
+            self.temp_files.close()
+        shutil.rmtree(self.serve_directory, ignore_errors=True)
+        self.prune_partials(self.node_id)
 
-    def handle_peer(self, connection, address):
-        """Handle messages from a connected peer"""
-        while True:
+    @staticmethod
+    def prune_partials(node_id=None) -> int:
+        """Delete unfinished downloads, of one node or every node, that have not progressed for P2P_PARTIAL_MAX_AGE"""
+        try:
+            node_ids = [node_id] if node_id else os.listdir(Config.P2P_PARTIAL_FOLDER)
+        except OSError:
+            return 0
+        cutoff = time.time() - Config.P2P_PARTIAL_MAX_AGE
+        pruned = 0
+        for owner in node_ids:
+            directory = os.path.join(Config.P2P_PARTIAL_FOLDER, owner)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        pruned += 1
+                except OSError as e:
+                    print(f"Error pruning partial download {path}: {e}")
             try:
-                data = connection.recv(4096)
-                if not data:
-                    break
-                
-                message = json.loads(data.decode())
-                message_id = message.get('id')
-                
-                # Skip if we've already processed this message
-                if message_id in self.processed_messages:
-                    continue
-                    
-                self.processed_messages.add(message_id)
-                
-                # Handle different message types
-                if message['type'] == 'search':
-                    self.handle_search(message, connection)
-                elif message['type'] == 'search_response':
-                    self.handle_search_response(message)
-                elif message['type'] == 'file_request':
-                    self.handle_file_request(message, connection)
-                elif message['type'] == 'file_response':
-                    self.handle_file_response(message)
-                    
-                # Forward the message to other peers (flooding)
-                if message.get('ttl', 0) > 0:
-                    self._flood_message(message, exclude=connection)
-                    
-            except Exception as e:
-                print(f"Error handling peer {address}: {e}")
-                break
-                
-        # Clean up
-        connection.close()
-        self.peers.pop(address, None)
-
-    def handle_search(self, message, connection):
-        """Handle incoming search request"""
+                os.rmdir(directory)  # Only succeeds once nothing is left to resume
+            except OSError:
+                pass
+        return pruned
+
+    def share_file(self, file_info):
+        """Announce a newly shared file; it is served straight from the owner's bucket"""
+        self.last_activity = time.time()
+        self.summaries.refresh()
+        print(f"Sharing {file_info.get('name')} on P2P port {self.port}")
+
+    def handle_search(self, message, link):
+        """Answer a search from local files, or from cached hits; returns 'local', 'cache' or None"""
         try:
             filename = message['filename']
             requester = message['from']
-            
-            # Check local files
-            local_files = self.get_matching_files(filename)
-            
-            if local_files:
-                # Send response for each matching file
-                for file_info in local_files:
-                    response = {
-                        'type': 'search_response',
-                        'id': f"response_{message['id']}",
-                        'filename': file_info['name'],
-                        'size': file_info['size'],
-                        'host': self.host,
-                        'port': self.port,
-                        'username': self.username,
-                        'file_id': file_info['id']
-                    }
-                    connection.send(json.dumps(response).encode())
+
+            # Check local files, then answers this node has seen for the same query
+            answered = 'local'
+            hits = [{
+                'filename': file_info['name'],
+                'size': file_info['size'],
+                'host': self.host,
+                'port': self.port,
+                'node_id': self.node_id,
+                'username': self.username,
+                'file_id': file_info['id'],
+                'root': file_info.get('root') or self.content_roots.get((self.node_id, file_info['id']))
+            } for file_info in self.get_matching_files(filename)]
+            if not hits and message.get('strategy') in CACHED_STRATEGIES:
+                answered = 'cache'
+                hits = [hit for hit in self.router.cached_hits(filename) if hit['node_id'] != requester.get('node_id')]
+            if not hits:
+                return None
+
+            # Answer the searcher directly rather than the neighbour that forwarded the query
+            if requester.get('node_id'):
+                link = PeerLink(self, (requester['host'], requester['port']), requester['node_id'])
+
+            # Send response for each matching file
+            for hit in hits:
+                response = {
+                    'type': 'search_response',
+                    'id': f"response_{message['id']}_{hit['node_id']}_{hit['file_id']}",
+                    'query_id': message.get('query_id'),
+                    'first_hop': message.get('first_hop'),
+                    'cached': answered == 'cache',
+                    **hit
+                }
+                link.send(response)
+            return answered
         except Exception as e:
             print(f"Error handling search: {e}")
+            return None
 
     def has_file(self, filename):
         """Check if we have the requested file"""
-        file_path = Path(self.temp_directory) / filename
-        return file_path.exists()
+        return Path(filename).name in self.temp_files
 
     def get_file_id(self, filename):
-        """Get unique ID for a file"""
-        file_path = Path(self.temp_directory) / filename
-        if file_path.exists():
-            return str(hash(file_path.read_bytes()))
-        return None
+        """Stable content ID (SHA-256 manifest root) of a downloaded file"""
+        entry = self.temp_files.get(Path(filename).name)
+        return entry.sha256 if entry else None
 
     def _flood_message(self, message, exclude=None):
         """Forward message to all peers except the sender"""
         if message.get('ttl', 0) <= 0:
             return
-            
+
         message['ttl'] = message['ttl'] - 1
-        encoded_message = json.dumps(message).encode()
-        
-        for peer in self.peers.values():
+
+        with self._lock:
+            peers = list(self.peers.items())
+        for key, peer in peers:
             if peer != exclude:
                 try:
-                    peer.send(encoded_message)
+                    peer.send(message)
                 except Exception as e:
                     print(f"Error sending to peer: {e}")
+                    self.drop_peer(key)
 
-    def handle_file_request(self, message, connection):
-        """Handle request for file download"""
+    def _forward_search(self, message, exclude=None):
+        """Pass a search on: to every other neighbour, or to one neighbour for a random walker"""
+        if message.get('ttl', 0) <= 0:
+            return
+        message['ttl'] = message['ttl'] - 1
+
+        with self._lock:
+            links = [peer for peer in self.peers.values() if peer != exclude]
+        strategy = message.get('strategy', 'flood')
+        routed = self.summaries.route(message['filename'], links, message['ttl'])
+        if strategy == 'random_walk':
+            step = self.router.pick_walk_step(message['filename'], routed or links)
+            links = [step] if step else []
+        else:
+            links = routed
+        self._send_search(message, links, strategy)
+
+    def _send_search(self, message, links, strategy, first_hop=False):
+        """Send a search to each link; the originator tags each copy with the neighbour it went to"""
+        for peer in links:
+            try:
+                peer.send({**message, 'first_hop': peer.node_id} if first_hop else message)
+                self.router.count(strategy, 'messages')
+            except Exception as e:
+                print(f"Error sending to peer: {e}")
+                self.drop_peer(peer.key)
+
+    def handle_file_request(self, message, link):
+        """Stream the requested file, or the requested byte range of it, back to the requester"""
         try:
             filename = message.get('filename')
             file_id = message.get('file_id')
-            
-            if not filename or not file_id:
+            transfer_id = message.get('transfer_id')
+
+            if not filename or not file_id or not transfer_id:
                 return
-                
-            # Get file content from local storage
-            file_content = None
-            
-            # Import chat_nodes here to avoid circular imports
-            from app import chat_nodes
-            
-            # Find the node that has this file
-            node_id = next((id for id, node in chat_nodes.items() 
-                           if node.p2p_network == self), None)
-            if node_id:
-                node = chat_nodes[node_id]
-                file_content = node.secure_bucket.get_file_content(file_id)
-                        
-            if file_content:
-                # Send file content back to requester
-                response = {
-                    'type': 'file_response',
-                    'id': f"file_{message.get('id')}",
-                    'filename': filename,
-                    'content': file_content.hex()  # Convert bytes to hex string
-                }
-                connection.send(json.dumps(response).encode())
-                
+
+            # Spooled to disk from the owner's bucket, then sent straight from the file; the spool entry
+            # stays pinned until the upload closes
+            path, manifest = self._get_serving_content(file_id, pin=True)
+
+            if not path:
+                link.send({'type': 'file_end', 'transfer_id': transfer_id, 'error': 'File not found'})
+                return
+
+            offset = message.get('offset', 0)
+            length = message.get('length')
+            try:
+                upload = OutgoingTransfer(
+                    link, transfer_id, filename, path,
+                    offset=offset,
+                    length=length,
+                    window=message.get('window'),
+                    sha256=self._piece_digest(manifest, offset, length),
+                    on_close=lambda: self._unpin_serving(path)
+                )
+            except OSError as e:
+                self._unpin_serving(path)
+                link.send({'type': 'file_end', 'transfer_id': transfer_id, 'error': f"File unavailable: {e}"})
+                return
+            with self._lock:
+                expired = expire_transfers(self.uploads)
+                self.uploads[(link.key, transfer_id)] = upload
+            for stale in expired:
+                stale.close()
+            upload.begin()
+
         except Exception as e:
             print(f"Error handling file request: {e}")
 
-    def connect_to_peer(self, host, port):
-        """Establish connection to another peer"""
+    def _get_serving_content(self, file_id, pin: bool = False):
+        """Spooled file and manifest of a shared file, cached so piece requests don't refetch it from IPFS"""
+        with self._lock:
+            if file_id in self._serving:
+                self._serving.move_to_end(file_id)
+                entry = self._serving[file_id]
+                if pin:
+                    self._serving_pins[entry[0]] = self._serving_pins.get(entry[0], 0) + 1
+                return entry
+
+        content = self.file_provider.get_file_content(file_id) if self.file_provider else None
+        if not content:
+            return None, None
+        manifest = build_manifest(content)
+        path = os.path.join(self.serve_directory, manifest['root'])
+        if not os.path.exists(path):
+            # Write under a temporary name so a concurrent request never serves a half-written file
+            fd, spooling = tempfile.mkstemp(dir=self.serve_directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(spooling, path)
+        entry = (path, manifest)
+
+        with self._lock:
+            self._remember_root(self.node_id, file_id, manifest['root'])
+            self._serving[file_id] = entry
+            if pin:
+                self._serving_pins[path] = self._serving_pins.get(path, 0) + 1
+            # Keep the spool within its byte budget, but always hold the file being served
+            while len(self._serving) > 1 and \
+                    sum(cached['size'] for _, cached in self._serving.values()) > Config.P2P_SERVE_CACHE_BYTES:
+                evicted, _ = self._serving.popitem(last=False)[1]
+                self._remove_spooled(evicted)  # Files with open uploads go once the last one closes
+        return entry
+
+    def _unpin_serving(self, path):
+        with self._lock:
+            readers = self._serving_pins.get(path, 0) - 1
+            if readers > 0:
+                self._serving_pins[path] = readers
+                return
+            self._serving_pins.pop(path, None)
+            self._remove_spooled(path)
+
+    def _remove_spooled(self, path):
+        """Delete a spooled file no cache entry or upload uses any more; call with the lock held"""
+        if path in self._serving_pins or any(path == kept for kept, _ in self._serving.values()):
+            return
         try:
-            if (host, port) not in self.peers:
-                connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                connection.connect((host, port))
-                self.peers[(host, port)] = connection
-                
-                # Start thread to handle this peer
-                peer_thread = threading.Thread(
-                    target=self.handle_peer,
-                    args=(connection, (host, port))
-                )
-                peer_thread.daemon = True
-                peer_thread.start()
-                
-                return True
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error removing spooled file {path}: {e}")
+
+    @staticmethod
+    def _piece_digest(manifest, offset, length):
+        """The manifest's hash for a request covering exactly one piece, so the upload needn't hash it"""
+        piece_size = manifest['piece_size']
+        piece, remainder = divmod(offset, piece_size)
+        if remainder or piece >= len(manifest['hashes']):
+            return None
+        if length != min(piece_size, manifest['size'] - offset):
+            return None
+        return manifest['hashes'][piece]
+
+    def handle_manifest_request(self, message, link):
+        """Describe a shared file's pieces so a swarm can fetch them from several sources"""
+        try:
+            reply = {'type': 'manifest', 'swarm_id': message.get('swarm_id'), 'filename': message.get('filename')}
+            _, manifest = self._get_serving_content(message.get('file_id'))
+            if manifest is None:
+                reply['error'] = 'File not found'
+            else:
+                reply.update(manifest)
+            link.send(reply)
         except Exception as e:
-            print(f"Error connecting to peer {host}:{port}: {e}")
-            return False
+            print(f"Error handling manifest request: {e}")
+
+    def handle_manifest(self, message, link):
+        swarm = self.swarms.get(message.get('swarm_id'))
+        if swarm:
+            swarm.on_manifest(link, message)
+
+    def handle_file_ack(self, message, link):
+        """Grant an upload more credit once the receiver has written earlier chunks"""
+        key = (link.key, message.get('transfer_id'))
+        upload = self.uploads.get(key)
+        if upload is None:
+            return
+        upload.on_ack(message.get('offset', 0))
+        if upload.done:
+            with self._lock:
+                self.uploads.pop(key, None)
+            upload.close()
+
+    def connect_to_peer(self, host, port, node_id):
+        """Add a link to a node, which may live behind another server's endpoint"""
+        link = PeerLink(self, (host, port), node_id)
+        with self._lock:
+            existing = self.peers.get(link.key)
+        if existing is not None:
+            return existing
+        # Direct sends work at once; the link joins the flood overlay if there is room for it
+        self.add_peer(link)
+        return link
+
+    def flood_search(self, filename, strategy=None, on_results=None, on_complete=None):
+        """Start a search using one of SEARCH_STRATEGIES, streaming hits to on_results; returns its query id"""
+        self.last_activity = time.time()
+        strategy = strategy if strategy in SEARCH_STRATEGIES else Config.P2P_SEARCH_STRATEGY
+        query_id = uuid.uuid4().hex
 
-    def flood_search(self, filename):
-        """Broadcast file search to all peers"""
-        search_msg = {
+        collector = SearchCollector(query_id, filename, strategy, self.endpoint.call_later, on_results, on_complete)
+        with self._lock:
+            self.queries[query_id] = collector
+            while len(self.queries) > Config.P2P_TRACKED_QUERIES:
+                self.queries.popitem(last=False)[1].finish('evicted')
+        self.router.count(strategy, 'queries')
+
+        # Answer repeated queries from the hit cache without sending anything, unless flooding for full recall
+        cached = self.router.cached_hits(filename) if strategy in CACHED_STRATEGIES else []
+        if cached:
+            self.router.count(strategy, 'cache_answers')
+            for hit in cached:
+                self.handle_search_response({**hit, 'query_id': query_id, 'cached': True}, learn=False)
+            return query_id
+
+        with self._lock:
+            links = list(self.peers.values())
+        if strategy == 'random_walk':
+            # Each walker gets its own id so walkers crossing paths don't cancel each other
+            routed = self.summaries.route(filename, links, Config.P2P_WALK_TTL - 1)
+            walkers = self.router.rank_neighbors(filename, routed or links)[:Config.P2P_WALKERS]
+            for index, link in enumerate(walkers):
+                search_msg = self._search_message(f"{query_id}_w{index}", query_id, filename, strategy, Config.P2P_WALK_TTL)
+                self._send_search(search_msg, [link], strategy, first_hop=True)
+        elif strategy == 'expanding_ring':
+            self._search_ring(query_id, filename, 1)
+        else:
+            search_msg = self._search_message(query_id, query_id, filename, strategy, Config.P2P_SEARCH_TTL)
+            self._send_search(search_msg, self.summaries.route(filename, links, search_msg['ttl']), strategy, first_hop=True)
+        return query_id
+
+    def _search_message(self, message_id, query_id, filename, strategy, ttl):
+        """Build a search; ttl is the number of hops it may travel"""
+        # Don't answer our own search when it is flooded back to us
+        self.processed_messages.add(message_id)
+        return {
             'type': 'search',
-            'id': f"search_{time.time()}_{self.username}",  # Add unique ID
+            'id': message_id,
+            'query_id': query_id,
+            'strategy': strategy,
             'filename': filename,
             'from': {
                 'host': self.host,
                 'port': self.port,
+                'node_id': self.node_id,
                 'username': self.username
             },
-            'ttl': 7  # Time-to-live to prevent infinite flooding
+            'ttl': ttl - 1  # Hops left after reaching our neighbours
         }
-        
-        # Clear previous search results
-        self.file_sources = {}
-        
-        # Send search message to all peers
-        self._flood_message(search_msg)
-
-    def handle_search_response(self, response_data):
+
+    def _search_ring(self, query_id, filename, ttl):
+        """Flood to ttl hops, then widen the ring if too few hits came back in time"""
+        query = self.queries.get(query_id)
+        if query is None or query.finished or not self.running:
+            return
+        with self._lock:
+            links = list(self.peers.values())
+        search_msg = self._search_message(f"{query_id}_r{ttl}", query_id, filename, 'expanding_ring', ttl)
+        links = self.summaries.route(filename, links, search_msg['ttl'])
+        self._send_search(search_msg, links, 'expanding_ring', first_hop=True)
+        if ttl >= Config.P2P_SEARCH_TTL:
+            return
+
+        def widen():
+            if query.hits < Config.P2P_RING_TARGET_HITS:
+                self.router.count('expanding_ring', 'rings')
+                self._search_ring(query_id, filename, min(ttl * 2, Config.P2P_SEARCH_TTL))
+        self.endpoint.call_later(Config.P2P_RING_DELAY * ttl, widen)
+
+    def handle_search_response(self, response_data, learn=True):
         """Handle response from a peer that has the file"""
         filename = response_data['filename']
-        source = (response_data['host'], response_data['port'])
-        file_id = response_data.get('file_id')
-        
-        if filename not in self.file_sources:
-            self.file_sources[filename] = []
-        self.file_sources[filename].append((source[0], source[1], file_id))
+        source = (response_data['host'], response_data['port'], response_data.get('file_id'), response_data.get('node_id'))
+
+        with self._lock:
+            # Sources outlive the search that found them so later downloads can swarm over them
+            sources = self.file_sources.setdefault(filename, [])
+            if source not in sources:
+                sources.append(source)
+            self.file_sources.move_to_end(filename)
+            while len(self.file_sources) > Config.P2P_KNOWN_FILES:
+                self.file_sources.popitem(last=False)
+            if response_data.get('root'):
+                self._remember_root(source[3], source[2], response_data['root'])
+            query = self.queries.get(response_data.get('query_id'))
+
+        hit = {key: response_data.get(key) for key in ('filename', 'size', 'host', 'port', 'file_id', 'node_id', 'username', 'root')}
+        # The collector drops holders already reached through another ring or walker
+        if query and query.add(hit):
+            self.router.count(query.strategy, 'hits')
+            if learn:
+                self.router.record_hit(query.filename, response_data.get('first_hop'))
+                self.router.cache_hit(query.filename, response_data)
+
+    def _remember_root(self, node_id, file_id, root):
+        """Record which content a source's file is; callers hold self._lock"""
+        self.content_roots[(node_id, file_id)] = root
+        self.content_roots.move_to_end((node_id, file_id))
+        while len(self.content_roots) > Config.P2P_KNOWN_FILES * 4:
+            self.content_roots.popitem(last=False)
 
     def get_matching_files(self, query):
         """Get list of files matching the search query"""
         try:
-            from app import chat_nodes
-            node_id = next((id for id, node in chat_nodes.items() if node.p2p_network == self), None)
-            if node_id:
-                node = chat_nodes[node_id]
-                return node.secure_bucket.search_files(query)
+            if self.file_provider:
+                return self.file_provider.search_files(query)
             return []
         except Exception as e:
             print(f"Error getting matching files: {e}")
             return []
 
+    def _download_path(self, filename):
+        """Path in the temp directory for a peer-supplied file name"""
+        return Path(self.temp_directory) / Path(filename).name
+
+    def _file_saved(self, name, root):
+        """Index a finished download, then keep downloaded content within the node and process quotas"""
+        entry = self.temp_files.add(name, root)
+        self.temp_files.evict(Config.P2P_NODE_DISK_QUOTA, keep=name)
+        ContentIndex.evict_global(Config.P2P_DISK_QUOTA, keep=entry)
+
+    def _reserve_space(self, size):
+        """Count an unfinished download against the node and process quotas, evicting finished files for room"""
+        self.temp_files.reserve(size)
+        self.temp_files.evict(Config.P2P_NODE_DISK_QUOTA)
+        ContentIndex.evict_global(Config.P2P_DISK_QUOTA)
+        if self.temp_files.used_bytes > Config.P2P_NODE_DISK_QUOTA or \
+                ContentIndex.used_global() > Config.P2P_DISK_QUOTA:
+            self.temp_files.unreserve(size)
+            return False
+        return True
+
+    def _partial_path(self, root):
+        """Where an unfinished download of some content is kept, without extension; survives restarts"""
+        directory = os.path.join(Config.P2P_PARTIAL_FOLDER, self.node_id)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, root)
+
     def request_file(self, filename, source):
         """Request a file from a specific peer"""
-        try:
-            host, port, file_id = source
-            request_msg = {
-                'type': 'file_request',
-                'id': f"request_{time.time()}_{self.username}",
-                'filename': filename,
-                'file_id': file_id,
-                'requester': {
-                    'host': self.host,
-                    'port': self.port
-                }
-            }
-            
-            # Connect to the source peer if not already connected
-            if (host, port) not in self.peers:
-                if not self.connect_to_peer(host, port):
-                    raise Exception("Could not connect to peer")
-                
-            # Send request
-            self.peers[(host, port)].send(json.dumps(request_msg).encode())
-            
-        except Exception as e:
-            print(f"Error requesting file: {e}")
-            raise
+        return self._start_swarm(filename, [tuple(source)])
 
-    def handle_file_response(self, message):
-        """Handle incoming file response"""
-        try:
-            filename = message['filename']
-            content = bytes.fromhex(message['content'])  # Convert hex string back to bytes
-            
-            # Save file to temp directory
-            file_path = Path(self.temp_directory) / filename
-            with open(file_path, 'wb') as f:
-                f.write(content)
-            
-            # Emit download ready event
-            from app import socketio
-            socketio.emit('download_ready', {
-                'url': f'/download_temp/{filename}'
-            })
-            
-        except Exception as e:
-            print(f"Error handling file response: {e}")
\ No newline at end of file
+    def download_file(self, filename, source=None):
+        """Fetch a file from every known source that has it, starting with the chosen one"""
+        with self._lock:
+            sources = list(self.file_sources.get(filename, []))
+        if source is not None:
+            if tuple(source) in sources:
+                sources.remove(tuple(source))
+            sources.insert(0, tuple(source))
+        if not sources:
+            raise ValueError(f"No known sources for {filename}")
+        return self._start_swarm(filename, sources)
+
+    def _start_swarm(self, filename, sources):
+        """Download from sources piece by piece, verified against the Merkle manifest and resumable"""
+        self.last_activity = time.time()
+        with self._lock:
+            roots = [self.content_roots.get((node_id, file_id)) for _, _, file_id, node_id in sources]
+        # Follow the content of the first source that advertised a root; sources known to differ are left out
+        root = next((root for root in roots if root), None)
+        if root is not None and not re.fullmatch(r'[0-9a-f]{64}', root):
+            root = None
+        if root is not None:
+            sources = [source for source, other in zip(sources, roots) if other in (None, root)]
+            with self._lock:
+                existing = self.swarms_by_root.get(root)
+            # The same content is already downloading; give it these sources rather than racing it
+            if existing is not None and existing.add_sources(sources):
+                return existing
+
+        swarm = SwarmDownload(self, filename, sources, root=root)
+        with self._lock:
+            self.swarms[swarm.swarm_id] = swarm
+        swarm.start()
+        return swarm
+
+    def _open_range_download(self, link, filename, path, offset, length, expected_sha256=None, owner=None):
+        """Register an incoming byte range before it is requested"""
+        download = IncomingTransfer(link, uuid.uuid4().hex, filename, path, offset, length,
+                                    expected_sha256=expected_sha256, owner=owner)
+        with self._lock:
+            for expired in expire_transfers(self.downloads):
+                expired.close()
+            self.downloads[download.transfer_id] = download
+        return download
+
+    def _send_range_request(self, download, file_id):
+        download.link.send({
+            'type': 'file_request',
+            'id': f"request_{download.transfer_id}",
+            'transfer_id': download.transfer_id,
+            'filename': download.filename,
+            'file_id': file_id,
+            'offset': download.start,
+            'length': download.length,
+            'window': Config.P2P_TRANSFER_WINDOW
+        })
+
+    def _abandon_download(self, download):
+        """Stop tracking a range; late chunks for it are ignored"""
+        with self._lock:
+            self.downloads.pop(download.transfer_id, None)
+        download.close()
+
+    def _claim_root(self, swarm, root):
+        """Make swarm the download of some content, or return the unfinished one that already is"""
+        with self._lock:
+            existing = self.swarms_by_root.get(root)
+            if existing is not None and existing is not swarm and not existing.finished:
+                return existing
+            self.swarms_by_root[root] = swarm
+            return None
+
+    def _swarm_finished(self, swarm, url, error):
+        """Forget a swarm and report its outcome; neither url nor error means it merged into another"""
+        with self._lock:
+            self.swarms.pop(swarm.swarm_id, None)
+            for root in [root for root, other in self.swarms_by_root.items() if other is swarm]:
+                del self.swarms_by_root[root]
+        if url:
+            SocketIOBridge.get_instance().emit('download_ready', {'url': url})
+        elif error:
+            print(error)
+            SocketIOBridge.get_instance().emit('download_error', {'error': error})
+
+    def handle_file_meta(self, message):
+        """Record the size of an incoming file"""
+        download = self.downloads.get(message.get('transfer_id'))
+        if download:
+            download.on_meta(message)
+
+    def handle_file_chunk(self, message):
+        """Write an incoming chunk straight to disk"""
+        download = self.downloads.get(message.get('transfer_id'))
+        if download and not download.on_chunk(message.get('offset', -1), message.get('data', b'')):
+            self._fail_download(download)
+
+    def handle_file_end(self, message):
+        """Verify a finished range and report it to its swarm"""
+        with self._lock:
+            download = self.downloads.pop(message.get('transfer_id'), None)
+        if download is None:
+            return
+        if message.get('error'):
+            download.error = message['error']
+        ok = not download.error and download.finish(message)
+        download.close()
+        download.owner.transfer_finished(download, ok)
+
+    def _fail_download(self, download):
+        """Abandon a range and let its swarm reassign the piece"""
+        with self._lock:
+            self.downloads.pop(download.transfer_id, None)
+        download.close()
+        download.owner.transfer_finished(download, False)
@@ -0,0 +1,157 @@
+import json
+import struct
+import threading
+from typing import Dict, List, Tuple
+
+# Frame layout, all integers big-endian:
+#   version (1 byte) | type (1 byte) | header length (4 bytes) | body length (4 bytes)
+#   header (UTF-8 JSON) | body (raw bytes)
+PROTOCOL_VERSION = 1
+FRAME_PREFIX = struct.Struct('!BBII')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# Type byte for each flood message type; 0 carries any type not listed here
+MESSAGE_TYPES = {
+    'search': 1,
+    'search_response': 2,
+    'file_request': 3,
+    'file_response': 4,
+    'file_meta': 5,
+    'file_chunk': 6,
+    'file_ack': 7,
+    'file_end': 8,
+    'manifest_request': 9,
+    'manifest': 10,
+    'hello': 11,
+    'hello_ack': 12,
+    'ping': 13,
+    'pong': 14,
+    'peers_request': 15,
+    'peers': 16,
+    'bye': 17,
+    'summary': 18
+}
+MESSAGE_TYPE_NAMES = {code: name for name, code in MESSAGE_TYPES.items()}
+
+# Flooded queries a congested connection may drop; other neighbours still carry them.
+# Responses, control messages and transfers (which have their own flow control) are never dropped.
+DROPPABLE_TYPES = {'search'}
+
+class ProtocolError(Exception):
+    """Raised when a peer sends bytes that are not a valid frame"""
+    pass
+
+class FileRegion:
+    """A byte range of an open file, carried as a frame body and written to the socket with sendfile"""
+
+    def __init__(self, file, offset: int, length: int, lock: threading.Lock = None):
+        self.file = file  # Binary file object; held open by every region that refers to it
+        self.offset = offset
+        self.length = length
+        self.lock = lock or threading.Lock()  # Shared by regions of one file, since reading moves its position
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    @property
+    def closed(self) -> bool:
+        """The upload that queued this region has been closed"""
+        return self.file.closed
+
+    def advance(self, count: int) -> 'FileRegion':
+        """The rest of the region once count bytes have been sent"""
+        return FileRegion(self.file, self.offset + count, self.length - count, self.lock)
+
+    def read(self) -> bytes:
+        """The region's bytes, for peers that can't take a sendfile, such as nodes in this process"""
+        with self.lock:
+            self.file.seek(self.offset)
+            data = self.file.read(self.length)
+        if len(data) != self.length:
+            raise ProtocolError(f"File ended {self.length - len(data)} bytes short of a queued region")
+        return data
+
+    def __len__(self) -> int:
+        return self.length
+
+def encode_frame_parts(frame_type: int, header: Dict, body=b'') -> List:
+    """Serialize one frame as [prefix and header, body] so the body is never copied"""
+    header_bytes = json.dumps(header, separators=(',', ':')).encode()
+    if not isinstance(body, FileRegion):
+        body = memoryview(body).cast('B')
+    if FRAME_PREFIX.size + len(header_bytes) + len(body) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {len(header_bytes) + len(body)} bytes exceeds the maximum frame size")
+    prefix = FRAME_PREFIX.pack(PROTOCOL_VERSION, frame_type, len(header_bytes), len(body)) + header_bytes
+    return [prefix, body] if len(body) else [prefix]
+
+def encode_frame(frame_type: int, header: Dict, body: bytes = b'') -> bytes:
+    """Serialize one frame"""
+    return b''.join(encode_frame_parts(frame_type, header, body))
+
+def encode_message_parts(routing: Dict, message: Dict) -> List:
+    """Serialize a routed flood message; a bytes 'data' field travels as the raw body"""
+    body = message.get('data', b'')
+    if isinstance(body, (bytes, bytearray, memoryview, FileRegion)):
+        message = {key: value for key, value in message.items() if key != 'data'}
+    else:
+        body = b''
+    return encode_frame_parts(
+        MESSAGE_TYPES.get(message.get('type'), 0),
+        {**routing, 'body': message},
+        body
+    )
+
+def encode_message(routing: Dict, message: Dict) -> bytes:
+    """Serialize a routed flood message into one bytes object"""
+    return b''.join(part.read() if isinstance(part, FileRegion) else part
+                    for part in encode_message_parts(routing, message))
+
+def decode_message(frame_type: int, header: Dict, body: bytes) -> Tuple[Dict, Dict]:
+    """Split a decoded frame back into routing fields and the flood message"""
+    message = header.pop('body', {})
+    if 'type' not in message and frame_type in MESSAGE_TYPE_NAMES:
+        message['type'] = MESSAGE_TYPE_NAMES[frame_type]
+    if body:
+        message['data'] = body
+    return header, message
+
+class FrameDecoder:
+    """Incremental decoder that turns a TCP byte stream back into frames"""
+
+    def __init__(self, max_frame_size: int = MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[Tuple[int, Dict, bytes]]:
+        """Add received bytes and return every frame they complete, in order"""
+        self._buffer += data
+        frames = []
+        offset = 0
+        while len(self._buffer) - offset >= FRAME_PREFIX.size:
+            version, frame_type, header_length, body_length = FRAME_PREFIX.unpack_from(self._buffer, offset)
+            if version != PROTOCOL_VERSION:
+                raise ProtocolError(f"Unsupported protocol version {version}")
+            frame_length = FRAME_PREFIX.size + header_length + body_length
+            if frame_length > self.max_frame_size:
+                raise ProtocolError(f"Frame of {frame_length} bytes exceeds the maximum frame size")
+            if len(self._buffer) - offset < frame_length:
+                break  # Wait for the rest of this frame
+
+            header_start = offset + FRAME_PREFIX.size
+            body_start = header_start + header_length
+            try:
+                header = json.loads(bytes(self._buffer[header_start:body_start]))
+            except ValueError as e:
+                raise ProtocolError(f"Invalid frame header: {e}")
+            frames.append((frame_type, header, bytes(self._buffer[body_start:offset + frame_length])))
+            offset += frame_length
+
+        # Drop consumed bytes in one go rather than once per frame
+        if offset:
+            del self._buffer[:offset]
+        return frames
+
+    @property
+    def buffered(self) -> int:
+        """Bytes received but not yet part of a complete frame"""
+        return len(self._buffer)
@@ -0,0 +1,267 @@
+import random
+import threading
+import time
+import uuid
+from typing import Dict
+from config import Config
+from python_scripts.public_chat.p2p_endpoint import PeerLink
+
+class PeerState:
+    """Lifecycle of one overlay link"""
+
+    def __init__(self, link):
+        self.link = link
+        self.active = False  # Handshake completed
+        self.added_at = self.last_seen = time.time()
+        self.last_ping = 0.0
+        self.ping_nonce = None
+        self.rtt = None  # Smoothed round-trip time in seconds
+        self.remote_degree = 0  # Neighbour count the other side reported in its handshake
+
+class PeerManager:
+    """Handshakes, keepalives and degree limits for one flood network's overlay links"""
+
+    def __init__(self, network):
+        self.network = network
+        self.states = {}  # {peer key: PeerState}
+        self.candidates = {}  # {peer key: PeerLink} learned from neighbours, tried when under-connected
+        self._lock = threading.Lock()
+        self.handshakes = 0
+        self.pruned = 0
+        self.replaced = 0
+
+    @property
+    def degree(self) -> int:
+        return sum(1 for state in self._snapshot() if state.active)
+
+    def _snapshot(self) -> list:
+        """The current link states; handler threads add and drop links while others iterate"""
+        with self._lock:
+            return list(self.states.values())
+
+    def _is_local(self, link) -> bool:
+        return self.network.endpoint.is_local(link.address)
+
+    def offer(self, link) -> bool:
+        """Start a handshake with a link if there is room for it; returns True if it is or becomes a neighbour"""
+        if link.node_id == self.network.node_id:
+            return False
+        with self._lock:
+            if link.key in self.states:
+                return True
+            if len(self.states) >= Config.P2P_MAX_DEGREE:
+                self.candidates.setdefault(link.key, link)
+                return False
+            self.states[link.key] = PeerState(link)
+        try:
+            link.send(self._hello('hello'))
+        except Exception as e:
+            print(f"Error greeting peer {link.key}: {e}")
+            self.prune(link.key)
+            return False
+        return True
+
+    def _hello(self, message_type: str) -> Dict:
+        return {
+            'type': message_type,
+            'node_id': self.network.node_id,
+            'host': self.network.host,
+            'port': self.network.port,
+            'degree': self.degree
+        }
+
+    def on_hello(self, message: Dict, link):
+        """A node wants to be our neighbour; accept if there is room and tell it either way"""
+        victim = None
+        with self._lock:
+            state = self.states.get(link.key)
+            needy = message.get('degree', 0) < Config.P2P_MIN_DEGREE
+            if state is None and len(self.states) >= Config.P2P_MAX_DEGREE and (needy or not self._is_local(link)):
+                # Make room for an under-connected node, or for a link bridging to another server, by
+                # shedding a neighbour that can easily find another link: a co-located node first,
+                # else (for needy nodes only) the best-connected remote one
+                actives = [other for other in self.states.values() if other.active]
+                best = max(actives, key=lambda other: (self._is_local(other.link), other.remote_degree), default=None)
+                if best is not None and (self._is_local(best.link)
+                                         or (needy and best.remote_degree > Config.P2P_MIN_DEGREE)):
+                    victim = best
+                    del self.states[victim.link.key]
+            if state is None and len(self.states) < Config.P2P_MAX_DEGREE:
+                state = self.states[link.key] = PeerState(link)
+            accepted = state is not None
+            if accepted:
+                state.remote_degree = message.get('degree', 0)
+        if victim is not None:
+            # Tell the shed neighbour, with somewhere else to go, so it doesn't wait for a keepalive timeout
+            try:
+                victim.link.send({'type': 'bye', 'peers': self._sample_neighbours(exclude=victim.link.key)})
+            except Exception as e:
+                print(f"Error saying goodbye to peer {victim.link.key}: {e}")
+            self.network._detach_peer(victim.link.key)
+            self._remember(victim.link)
+        ack = {**self._hello('hello_ack'), 'accepted': accepted}
+        if not accepted:
+            ack['peers'] = self._sample_neighbours(exclude=link.key)  # Where else to try
+        link.send(ack)
+        if accepted:
+            self._activate(state)
+        else:
+            self._remember(link)
+
+    def on_hello_ack(self, message: Dict, link):
+        """The other side answered our handshake"""
+        state = self.states.get(link.key)
+        if state is None:
+            return
+        if not message.get('accepted'):
+            # It is full: forget it but keep it as a fallback
+            self.prune(link.key, count=False)
+            self._remember(link)
+            self.on_peers(message)
+            if self.degree < Config.P2P_MIN_DEGREE:
+                self._replace(ask=False)
+            return
+        state.remote_degree = message.get('degree', 0)
+        self._activate(state)
+
+    def on_bye(self, message: Dict, link):
+        """A neighbour shed our link to make room; try the peers it suggested instead"""
+        if link.key not in self.states:
+            return
+        self.prune(link.key, count=False)
+        self.on_peers(message)
+        if self.degree < Config.P2P_MIN_DEGREE:
+            self._replace(ask=False)
+
+    def _activate(self, state: PeerState):
+        state.last_seen = time.time()
+        if not state.active:
+            state.active = True
+            self.handshakes += 1
+            self.network._attach_peer(state.link)
+
+    def on_message(self, link):
+        """Any traffic proves a neighbour is alive; an under-connected node offers unknown senders a link"""
+        state = self.states.get(link.key)
+        if state is not None:
+            state.last_seen = time.time()
+        elif link.node_id != self.network.node_id and self.degree < Config.P2P_MIN_DEGREE:
+            # Search answers come straight from their holders, so linking every sender would churn the overlay
+            self.offer(link)
+
+    def on_ping(self, message: Dict, link):
+        link.send({'type': 'pong', 'nonce': message.get('nonce'), 'sent_at': message.get('sent_at')})
+
+    def on_pong(self, message: Dict, link):
+        state = self.states.get(link.key)
+        if state is None or message.get('nonce') != state.ping_nonce:
+            return
+        rtt = time.time() - message.get('sent_at', time.time())
+        state.rtt = rtt if state.rtt is None else 0.8 * state.rtt + 0.2 * rtt
+        state.ping_nonce = None
+
+    def on_peers_request(self, link):
+        """Share our neighbours so an under-connected node can find replacements"""
+        link.send({'type': 'peers', 'peers': self._sample_neighbours(exclude=link.key)})
+
+    def _sample_neighbours(self, exclude=None) -> list:
+        neighbours = [list(state.link.key) for state in self._snapshot()
+                      if state.active and state.link.key != exclude]
+        return random.sample(neighbours, min(len(neighbours), Config.P2P_MAX_DEGREE))
+
+    def on_peers(self, message: Dict):
+        for host, port, node_id in message.get('peers', []):
+            link = PeerLink(self.network, (host, port), node_id)
+            if link.key not in self.states and node_id != self.network.node_id:
+                self._remember(link)
+
+    def _remember(self, link):
+        """Keep a link to try when under-connected, forgetting the oldest beyond the limit"""
+        with self._lock:
+            self.candidates.setdefault(link.key, link)
+            while len(self.candidates) > Config.P2P_MAX_DEGREE * 4:
+                self.candidates.pop(next(iter(self.candidates)))
+
+    def prune(self, key, count: bool = True):
+        """Drop a link from the overlay"""
+        key = tuple(key)
+        with self._lock:
+            state = self.states.pop(key, None)
+        self.network._detach_peer(key)
+        if state is not None and count:
+            self.pruned += 1
+
+    def maintain(self):
+        """Ping neighbours, prune dead ones and keep the degree between its limits"""
+        now = time.time()
+        with self._lock:
+            states = list(self.states.items())
+        for key, state in states:
+            if self._is_local(state.link):
+                # Co-located nodes can't drop packets; they are alive while registered
+                if state.link.node_id not in self.network.endpoint.networks:
+                    self.prune(key)
+                continue
+            if not state.active and now - state.added_at > 2 * Config.P2P_CONNECT_TIMEOUT:
+                self.prune(key, count=False)  # Handshake never answered
+            elif now - state.last_seen > Config.P2P_PEER_TIMEOUT:
+                self.prune(key)
+            elif now - state.last_ping >= Config.P2P_KEEPALIVE_INTERVAL:
+                state.last_ping = now
+                state.ping_nonce = uuid.uuid4().hex
+                try:
+                    state.link.send({'type': 'ping', 'nonce': state.ping_nonce, 'sent_at': now})
+                except Exception:
+                    self.prune(key)
+
+        if self.degree < Config.P2P_MIN_DEGREE:
+            self._replace()
+        elif self.degree > Config.P2P_MAX_DEGREE:
+            self._trim()
+
+    def _replace(self, ask: bool = True):
+        """Fill empty slots from known candidates and ask neighbours for more"""
+        actives = [state.link for state in self._snapshot() if state.active] if ask else []
+        for link in actives:
+            try:
+                link.send({'type': 'peers_request'})
+            except Exception:
+                pass
+
+        with self._lock:
+            pool = list(self.candidates.values())
+        pool += [PeerLink(self.network, self.network.endpoint.address, other.node_id)
+                 for other in self.network.endpoint.local_networks() if other is not self.network]
+        random.shuffle(pool)
+        for link in pool:
+            if self.degree + self._pending() >= Config.P2P_MIN_DEGREE:
+                break
+            if link.key in self.states:
+                continue
+            with self._lock:
+                self.candidates.pop(link.key, None)
+            if self.offer(link):
+                self.replaced += 1
+
+    def _pending(self) -> int:
+        return sum(1 for state in self._snapshot() if not state.active)
+
+    def _trim(self):
+        """Drop the slowest neighbours beyond the maximum degree"""
+        actives = sorted((state for state in self._snapshot() if state.active),
+                         key=lambda state: state.rtt if state.rtt is not None else 0)
+        for state in actives[Config.P2P_MAX_DEGREE:]:
+            self.prune(state.link.key, count=False)
+            self._remember(state.link)
+
+    def stats(self) -> Dict:
+        return {
+            'degree': self.degree,
+            'pending': self._pending(),
+            'candidates': len(self.candidates),
+            'handshakes': self.handshakes,
+            'pruned': self.pruned,
+            'replaced': self.replaced,
+            'rtt_ms': {state.link.node_id: round(state.rtt * 1000, 3)
+                       for state in self._snapshot() if state.rtt is not None}
+        }
@@ -0,0 +1,90 @@
+import random
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+from config import Config
+
+SEARCH_STRATEGIES = ('flood', 'expanding_ring', 'random_walk')
+CACHED_STRATEGIES = ('expanding_ring', 'random_walk')  # Flood keeps full recall, so it never stops at cached hits
+
+def query_tokens(query: str) -> List[str]:
+    """Lower-case word tokens of a query or file name"""
+    return [token for token in re.split(r'[^a-z0-9]+', (query or '').lower()) if token]
+
+class QueryRouter:
+    """Chooses which neighbours a search goes to and learns which ones lead to answers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.neighbor_hits = OrderedDict()  # {token: Counter({neighbour node_id: hits})}, most recent last
+        self.hit_cache = OrderedDict()  # {normalized query: (expires_at, [search_response, ...])}
+        self.counters = {strategy: Counter() for strategy in SEARCH_STRATEGIES}
+
+    def count(self, strategy: str, field: str, amount: int = 1):
+        with self._lock:
+            self.counters.setdefault(strategy, Counter())[field] += amount
+
+    def record_hit(self, query: str, neighbor_id: Optional[str]):
+        """Credit the first-hop neighbour a query went through for an answer"""
+        if not neighbor_id:
+            return
+        with self._lock:
+            for token in query_tokens(query):
+                self.neighbor_hits.setdefault(token, Counter())[neighbor_id] += 1
+                self.neighbor_hits.move_to_end(token)
+            while len(self.neighbor_hits) > Config.P2P_ROUTING_TOKENS:
+                self.neighbor_hits.popitem(last=False)
+
+    def neighbor_score(self, query: str, neighbor_id: str) -> int:
+        with self._lock:
+            return sum(self.neighbor_hits.get(token, {}).get(neighbor_id, 0) for token in query_tokens(query))
+
+    def rank_neighbors(self, query: str, links: List) -> List:
+        """Links ordered by how often they answered similar queries, ties broken randomly"""
+        shuffled = list(links)
+        random.shuffle(shuffled)
+        return sorted(shuffled, key=lambda link: self.neighbor_score(query, link.node_id), reverse=True)
+
+    def pick_walk_step(self, query: str, links: List):
+        """Next hop for a random walker, biased towards neighbours that answered before"""
+        if not links:
+            return None
+        weights = [1 + self.neighbor_score(query, link.node_id) for link in links]
+        return random.choices(links, weights=weights)[0]
+
+    def cache_hit(self, query: str, response: Dict):
+        """Remember a search response so later identical queries can be answered without routing"""
+        key = (query or '').lower().strip()
+        entry = {k: v for k, v in response.items() if k in ('filename', 'size', 'host', 'port', 'node_id', 'username', 'file_id', 'root')}
+        with self._lock:
+            expires_at, hits = self.hit_cache.get(key, (0, []))
+            if expires_at < time.time():
+                hits = []
+            if not any(hit['node_id'] == entry.get('node_id') and hit['file_id'] == entry.get('file_id') for hit in hits):
+                hits.append(entry)
+            self.hit_cache[key] = (time.time() + Config.P2P_HIT_CACHE_TTL, hits)
+            self.hit_cache.move_to_end(key)
+            while len(self.hit_cache) > Config.P2P_HIT_CACHE_SIZE:
+                self.hit_cache.popitem(last=False)
+
+    def cached_hits(self, query: str) -> List[Dict]:
+        key = (query or '').lower().strip()
+        with self._lock:
+            expires_at, hits = self.hit_cache.get(key, (0, []))
+            if expires_at < time.time():
+                self.hit_cache.pop(key, None)
+                return []
+            return list(hits)
+
+    def stats(self) -> Dict:
+        """Per-strategy counters: queries, search messages sent, hits and cache answers"""
+        with self._lock:
+            stats = {strategy: dict(counter) for strategy, counter in self.counters.items()}
+        for counter in stats.values():
+            queries = counter.get('queries', 0)
+            if queries:
+                counter['messages_per_query'] = counter.get('messages', 0) / queries
+                counter['hits_per_query'] = counter.get('hits', 0) / queries
+        return stats
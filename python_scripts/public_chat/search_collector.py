@@ -0,0 +1,66 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from config import Config
+
+class SearchCollector:
+    """Gathers one query's hits and streams them to the searcher as they arrive"""
+
+    def __init__(self, query_id: str, filename: str, strategy: str, call_later: Callable,
+                 on_results: Optional[Callable[[str, List[Dict]], None]] = None,
+                 on_complete: Optional[Callable[[str, int, str], None]] = None,
+                 deadline: float = None, quorum: int = None):
+        self.query_id = query_id
+        self.filename = filename
+        self.strategy = strategy
+        self.on_results = on_results
+        self.on_complete = on_complete
+        self.quorum = quorum or Config.P2P_SEARCH_QUORUM
+        self.started_at = time.time()
+        self.results = []
+        self._seen = set()  # (node_id, file_id) already reported
+        self.finished = False
+        self._lock = threading.Lock()
+
+        # The deadline is kept by the endpoint loop rather than a thread per search
+        self._timer = call_later(deadline or Config.P2P_SEARCH_DEADLINE, lambda: self.finish('deadline'))
+
+    @property
+    def hits(self) -> int:
+        return len(self.results)
+
+    def add(self, hit: Dict) -> bool:
+        """Record a hit and pass it on; returns False for duplicates and late arrivals"""
+        with self._lock:
+            key = (hit.get('node_id'), hit.get('file_id'))
+            if self.finished or key in self._seen:
+                return False
+            self._seen.add(key)
+            self.results.append(hit)
+            reached_quorum = len(self.results) >= self.quorum
+
+        if self.on_results:
+            try:
+                self.on_results(self.query_id, [hit])
+            except Exception as e:
+                print(f"Error streaming search results for {self.query_id}: {e}")
+        if reached_quorum:
+            self.finish('quorum')
+        return True
+
+    def finish(self, reason: str = 'deadline'):
+        """Stop collecting and signal completion once"""
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+        self._timer.cancel()
+        if self.on_complete:
+            try:
+                self.on_complete(self.query_id, len(self.results), reason)
+            except Exception as e:
+                print(f"Error completing search {self.query_id}: {e}")
+
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self.started_at
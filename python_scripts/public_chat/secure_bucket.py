@@ -1,9 +1,13 @@
 from cryptography.fernet import Fernet
 import json
+import threading
+from collections import OrderedDict
 import time
+from types import MappingProxyType
 from typing import Dict, List, Optional
 from config import Config
 from python_scripts.handlers.ipfs_handler import IPFSHandler
+from python_scripts.public_chat.swarm import build_manifest
 import hashlib
 
 class SecureBucket:
@@ -16,6 +20,15 @@ class SecureBucket:
         # Initialize Fernet cipher with existing ENCRYPTION_KEY
         self.cipher_suite = Fernet(Config.ENCRYPTION_KEY)
         
+        # Saves serialize on _save_lock so hashes are ordered like the mutations; _lock only guards
+        # swapping in saved state and is never held across IPFS. Readers only ever touch self._snapshot
+        self._save_lock = threading.RLock()
+        self._lock = threading.RLock()
+        self._snapshot = MappingProxyType({})
+        
+        # Recent saved hashes -> summary of the mutation that produced them
+        self.mutation_summaries = OrderedDict()
+        
         # Initialize bucket structure
         self.bucket_structure = {
             'metadata': {
@@ -59,6 +72,10 @@ class SecureBucket:
             
             self.sent_requests = []
             self.received_requests = []
+            self.bucket_hash = main_bucket_hash  # Hash of the state currently held in memory
+            self.loaded_hash = main_bucket_hash  # Pointer that state was last loaded from
+            self.sent_requests_hash = sent_requests_hash
+            self.received_requests_hash = received_requests_hash
             
             # Load main bucket
             if main_bucket_hash:
@@ -86,11 +103,34 @@ class SecureBucket:
                         print(f"Loaded {len(self.received_requests)} received requests")
                 except Exception as e:
                     print(f"Error loading received requests: {e}")
+            
+            self._publish_snapshot()
                     
         except Exception as e:
             print(f"Error initializing buckets: {e}")
             raise
 
+    def _publish_snapshot(self):
+        """Publish an immutable read snapshot of the bucket; call with self._lock held"""
+        # Entries are never mutated in place, so shallow copies of the containers
+        # are enough. Swapping the attribute is atomic, so readers never see torn state.
+        self._snapshot = MappingProxyType({
+            'chat_history': tuple(self.bucket_structure.get('chat_history', [])),
+            'files': MappingProxyType(dict(self.bucket_structure.get('files', {}))),
+            'sent_requests': tuple(self.sent_requests),
+            'received_requests': tuple(self.received_requests)
+        })
+
+    def _copy_structure(self) -> Dict:
+        """Copy of the bucket whose containers a mutation may change without touching the published state"""
+        structure = dict(self.bucket_structure)
+        for key, value in structure.items():
+            if isinstance(value, dict):
+                structure[key] = dict(value)
+            elif isinstance(value, list):
+                structure[key] = list(value)
+        return structure
+
     def _merge_bucket_structures(self, loaded_structure):
         """Merge loaded structure with current structure while preserving existing data"""
         for key, value in loaded_structure.items():
@@ -118,19 +158,26 @@ class SecureBucket:
 
             result = {}
             
-            # Add request to appropriate list and get hash
-            if request_data.get('requester_id') == self.node_id:
-                self.sent_requests.append(request_data)
-                encrypted_data = self._encrypt_data(self.sent_requests)
-                sent_hash = self.ipfs_handler.add_content(encrypted_data)
-                bucket_manager.update_sent_requests_hash(self.node_id, sent_hash)
-                result['sent_hash'] = sent_hash
-            else:
-                self.received_requests.append(request_data)
-                encrypted_data = self._encrypt_data(self.received_requests)
-                received_hash = self.ipfs_handler.add_content(encrypted_data)
-                bucket_manager.update_received_requests_hash(self.node_id, received_hash)
-                result['received_hash'] = received_hash
+            # Add request to appropriate list and get hash; readers see it once it is saved
+            with self._save_lock:
+                if request_data.get('requester_id') == self.node_id:
+                    sent_requests = self.sent_requests + [request_data]
+                    sent_hash = self.ipfs_handler.add_content(self._encrypt_data(sent_requests))
+                    with self._lock:
+                        self.sent_requests = sent_requests
+                        self.sent_requests_hash = sent_hash
+                        self._publish_snapshot()
+                    bucket_manager.update_sent_requests_hash(self.node_id, sent_hash)
+                    result['sent_hash'] = sent_hash
+                else:
+                    received_requests = self.received_requests + [request_data]
+                    received_hash = self.ipfs_handler.add_content(self._encrypt_data(received_requests))
+                    with self._lock:
+                        self.received_requests = received_requests
+                        self.received_requests_hash = received_hash
+                        self._publish_snapshot()
+                    bucket_manager.update_received_requests_hash(self.node_id, received_hash)
+                    result['received_hash'] = received_hash
 
             return result
 
@@ -138,85 +185,41 @@ class SecureBucket:
             print(f"Error adding file request: {e}")
             raise
 
-    def get_requests(self) -> Dict:
-        """Get all requests from both buckets"""
-        try:
-            from app import bucket_manager
-            
-            # Get hashes from bucket manager
-            sent_hash = bucket_manager.get_sent_requests_hash(self.node_id)
-            received_hash = bucket_manager.get_received_requests_hash(self.node_id)
-            
-            # Initialize empty lists
-            sent_requests = []
-            received_requests = []
-            
-            # Load sent requests if hash exists
-            if sent_hash:
-                try:
-                    encrypted_data = self.ipfs_handler.get_content(sent_hash)
-                    if encrypted_data:
-                        sent_requests = self._decrypt_data(encrypted_data)
-                except Exception as e:
-                    print(f"Error loading sent requests: {e}")
-            
-            # Load received requests if hash exists
-            if received_hash:
-                try:
-                    encrypted_data = self.ipfs_handler.get_content(received_hash)
-                    if encrypted_data:
-                        received_requests = self._decrypt_data(encrypted_data)
-                except Exception as e:
-                    print(f"Error loading received requests: {e}")
-            
-            return {
-                'sent': sent_requests,
-                'received': received_requests
-            }
-            
-        except Exception as e:
-            print(f"Error getting requests: {e}")
-            return {'sent': [], 'received': []}
-
     def clear_all_requests(self):
         """Clear all requests from bucket"""
         try:
             from app import bucket_manager
-            # Clear both sent and received requests
-            self.sent_requests = []
-            self.received_requests = []
-            
-            # Save empty states to IPFS
-            sent_hash = self.ipfs_handler.add_content(self._encrypt_data([]))
-            received_hash = self.ipfs_handler.add_content(self._encrypt_data([]))
-            
-            # Update bucket manager
-            bucket_manager.update_sent_requests_hash(self.node_id, sent_hash)
-            bucket_manager.update_received_requests_hash(self.node_id, received_hash)
+            with self._save_lock:
+                # Save empty states to IPFS
+                sent_hash = self.ipfs_handler.add_content(self._encrypt_data([]))
+                received_hash = self.ipfs_handler.add_content(self._encrypt_data([]))
+                
+                # Clear both sent and received requests
+                with self._lock:
+                    self.sent_requests = []
+                    self.received_requests = []
+                    self.sent_requests_hash = sent_hash
+                    self.received_requests_hash = received_hash
+                    self._publish_snapshot()
+                
+                # Update bucket manager
+                bucket_manager.update_sent_requests_hash(self.node_id, sent_hash)
+                bucket_manager.update_received_requests_hash(self.node_id, received_hash)
         
         except Exception as e:
             print(f"Error clearing all requests: {e}")
             raise
 
-    def get_requests(self) -> Dict:
-        """Get all requests"""
-        # Filter requests based on user ID/username
-        sent = [r for r in self.sent_requests if r.get('requester_id') == self.node_id]
-        received = [r for r in self.received_requests if r.get('requester_id') != self.node_id]
-        
-        return {
-        'sent': sent,
-            'received': received
-        }
-
     def get_requests(self) -> Dict:
         """Get all requests"""
         try:
+            snapshot = self._snapshot
+            
             # Filter sent requests - those created by current user
-            sent = [r for r in self.sent_requests if r.get('requester_id') == self.node_id]
+            sent = [r for r in snapshot['sent_requests'] if r.get('requester_id') == self.node_id]
             
             # Filter received requests - those created by other users
-            received = [r for r in self.received_requests if r.get('requester_id') != self.node_id]
+            received = [r for r in snapshot['received_requests'] if r.get('requester_id') != self.node_id]
             
             return {
                 'sent': sent,
@@ -231,28 +234,77 @@ class SecureBucket:
         decrypted_data = self.cipher_suite.decrypt(encrypted_data)
         return json.loads(decrypted_data)
 
-    def _save_bucket(self) -> str:
-        """Save encrypted bucket to IPFS"""
+    def _save_bucket(self, summary: Optional[Dict] = None, mutate=None) -> str:
+        """Save encrypted bucket to IPFS, applying mutate to a copy first; the change is published only once saved"""
         try:
-            # Update last modified timestamp
-            self.bucket_structure['metadata']['last_updated'] = time.time()
-            
-            # Encrypt and save
-            encrypted_data = self._encrypt_data(self.bucket_structure)
-            return self.ipfs_handler.add_content(encrypted_data)
+            with self._save_lock:
+                with self._lock:
+                    structure = self._copy_structure()
+                if mutate is not None:
+                    summary = mutate(structure) or summary
+                
+                # Update last modified timestamp
+                structure['metadata']['last_updated'] = time.time()
+                
+                # Encrypt and save; if this fails the bucket is left as it was
+                encrypted_data = self._encrypt_data(structure)
+                bucket_hash = self.ipfs_handler.add_content(encrypted_data)
+                
+                with self._lock:
+                    self.bucket_structure = structure
+                    self.bucket_hash = bucket_hash
+                    # Remember what changed so the bucket manager can record it in the version chain
+                    self.mutation_summaries[bucket_hash] = summary or {'op': 'save'}
+                    while len(self.mutation_summaries) > 32:
+                        self.mutation_summaries.popitem(last=False)
+                    self._publish_snapshot()
+                return bucket_hash
         except Exception as e:
             print(f"Error saving bucket: {e}")
             raise
 
+    def mutation_summary(self, bucket_hash: str) -> Optional[Dict]:
+        """Get the summary of the mutation that produced a saved bucket hash"""
+        return self.mutation_summaries.get(bucket_hash)
+
     def _load_bucket(self, bucket_hash: str):
         """Load and decrypt bucket from IPFS"""
         try:
             encrypted_data = self.ipfs_handler.get_content(bucket_hash)
-            self.bucket_structure = self._decrypt_data(encrypted_data)
+            bucket_structure = self._decrypt_data(encrypted_data)
+            with self._save_lock, self._lock:
+                self.bucket_structure = bucket_structure
+                self.bucket_hash = self.loaded_hash = bucket_hash
+                self.mutation_summaries.clear()  # Saves made before the load are no longer this state's history
+                self._publish_snapshot()
         except Exception as e:
             print(f"Error loading bucket: {e}")
             raise
 
+    def _load_requests(self, sent_requests_hash: Optional[str], received_requests_hash: Optional[str]):
+        """Load request lists saved elsewhere when they differ from the ones held in memory"""
+        try:
+            with self._save_lock:
+                sent_requests, received_requests = self.sent_requests, self.received_requests
+                if sent_requests_hash and sent_requests_hash != self.sent_requests_hash:
+                    sent_requests = self._decrypt_data(self.ipfs_handler.get_content(sent_requests_hash))
+                if received_requests_hash and received_requests_hash != self.received_requests_hash:
+                    received_requests = self._decrypt_data(self.ipfs_handler.get_content(received_requests_hash))
+                with self._lock:
+                    self.sent_requests = sent_requests
+                    self.received_requests = received_requests
+                    self.sent_requests_hash = sent_requests_hash or self.sent_requests_hash
+                    self.received_requests_hash = received_requests_hash or self.received_requests_hash
+                    self._publish_snapshot()
+        except Exception as e:
+            print(f"Error loading requests: {e}")
+            raise
+
+    def derives_from(self, bucket_hash: Optional[str]) -> bool:
+        """Whether the state in memory was loaded from bucket_hash or saved on top of it by this node"""
+        with self._lock:
+            return bucket_hash == self.loaded_hash or bucket_hash in self.mutation_summaries
+
     def _get_bucket_hash(self) -> Optional[str]:
         """Get latest bucket hash from IPFS"""
         try:
@@ -274,15 +326,12 @@ class SecureBucket:
                 message['content'].encode()
             ).decode()
             
-            # Add message to chat history
-            self.bucket_structure['chat_history'].append(storage_message)
-            
-            # Keep only last 100 messages
-            if len(self.bucket_structure['chat_history']) > 100:
-                self.bucket_structure['chat_history'] = self.bucket_structure['chat_history'][-100:]
+            def append(structure):
+                # Add message to chat history, keeping only the last 100 messages
+                structure['chat_history'] = (structure['chat_history'] + [storage_message])[-100:]
             
             # Save updated bucket and return new hash
-            return self._save_bucket()
+            return self._save_bucket({'op': 'add_message', 'message': storage_message}, mutate=append)
         except Exception as e:
             print(f"Error adding chat message: {e}")
             raise
@@ -291,7 +340,7 @@ class SecureBucket:
         """Get decrypted chat history"""
         try:
             decrypted_history = []
-            for message in self.bucket_structure['chat_history']:
+            for message in self._snapshot['chat_history']:
                 # Create a copy of the message
                 decrypted_message = message.copy()
                 # Decrypt only the content
@@ -307,13 +356,10 @@ class SecureBucket:
     def search_files(self, query: str) -> list:
         """Search for files in bucket matching the query"""
         try:
-            if 'files' not in self.bucket_structure:
-                return []
-                
             query = query.lower()
             matching_files = []
             
-            for file_info in self.bucket_structure['files'].values():
+            for file_info in self._snapshot['files'].values():
                 if query in file_info['name'].lower():
                     # Add download URL to file info
                     file_data = file_info.copy()
@@ -326,23 +372,6 @@ class SecureBucket:
             print(f"Error searching files: {e}")
             return []
 
-    def get_chat_history(self) -> List[Dict]:
-        """Get decrypted chat history"""
-        try:
-            decrypted_history = []
-            for message in self.bucket_structure['chat_history']:
-                # Create a copy of the message
-                decrypted_message = message.copy()
-                # Decrypt only the content
-                decrypted_message['content'] = self.cipher_suite.decrypt(
-                    message['content'].encode()
-                ).decode()
-                decrypted_history.append(decrypted_message)
-            return decrypted_history
-        except Exception as e:
-            print(f"Error getting chat history: {e}")
-            return []
-
     def sync_chat_history(self, peer_bucket_hash: str):
         """Sync chat history with another peer's bucket"""
         try:
@@ -350,17 +379,23 @@ class SecureBucket:
             encrypted_data = self.ipfs_handler.get_content(peer_bucket_hash)
             peer_bucket = self._decrypt_data(encrypted_data)
             
-            # Merge chat histories
-            merged_history = self._merge_chat_histories(
-                self.bucket_structure['chat_history'],
-                peer_bucket['chat_history']
-            )
-            
-            # Update local history
-            self.bucket_structure['chat_history'] = merged_history
+            def merge(structure):
+                known_ids = {msg['id'] for msg in structure['chat_history']}
+                
+                # Merge chat histories
+                merged_history = self._merge_chat_histories(
+                    structure['chat_history'],
+                    peer_bucket['chat_history']
+                )
+                structure['chat_history'] = merged_history
+                return {
+                    'op': 'sync',
+                    'peer_hash': peer_bucket_hash,
+                    'message_ids': [msg['id'] for msg in merged_history if msg['id'] not in known_ids]
+                }
             
             # Save updated bucket
-            return self._save_bucket()
+            return self._save_bucket(mutate=merge)
             
         except Exception as e:
             print(f"Error syncing chat history: {e}")
@@ -391,17 +426,21 @@ class SecureBucket:
                 'name': filename,
                 'ipfs_hash': ipfs_hash,
                 'timestamp': time.time(),
-                'size': len(file_content)
+                'size': len(file_content),
+                'root': build_manifest(file_content)['root']  # Advertised in P2P search results for verified, resumable downloads
             }
-            self.bucket_structure['files'][file_id] = file_info
-            
-            # Save updated bucket to IPFS
-            new_bucket_hash = self._save_bucket()
-            print(f"Updated bucket hash: {new_bucket_hash}")
-            
-            # Update bucket manager with new hash
             from app import bucket_manager
-            bucket_manager.update_bucket_hash(self.node_id, new_bucket_hash)
+            def add(structure):
+                structure['files'][file_id] = file_info
+            
+            with self._save_lock:
+                # Save updated bucket to IPFS
+                summary = {'op': 'add_file', 'file': file_info}
+                new_bucket_hash = self._save_bucket(summary, mutate=add)
+                print(f"Updated bucket hash: {new_bucket_hash}")
+                
+                # Update bucket manager with new hash
+                bucket_manager.update_bucket_hash(self.node_id, new_bucket_hash, summary)
             
             return file_info
         
@@ -412,11 +451,10 @@ class SecureBucket:
     def get_file_content(self, file_id: str) -> Optional[bytes]:
         """Get decrypted file content from bucket"""
         try:
-            if file_id not in self.bucket_structure['files']:
-                return None
-            
             # Get file info from bucket
-            file_info = self.bucket_structure['files'][file_id]
+            file_info = self._snapshot['files'].get(file_id)
+            if file_info is None:
+                return None
             
             # Get encrypted content from IPFS
             encrypted_content = self.ipfs_handler.get_content(file_info['ipfs_hash'])
@@ -431,12 +469,8 @@ class SecureBucket:
     def get_files(self) -> list:
         """Get list of files in bucket"""
         try:
-            # Ensure files dictionary exists in bucket structure
-            if 'files' not in self.bucket_structure:
-                self.bucket_structure['files'] = {}
-                
             # Convert dictionary values to list and sort by timestamp
-            files = list(self.bucket_structure.get('files', {}).values())
+            files = list(self._snapshot['files'].values())
             print(f"Retrieved {len(files)} files from bucket structure for user {self.username}")
             return sorted(files, key=lambda x: x['timestamp'], reverse=True)
         except Exception as e:
@@ -447,13 +481,14 @@ class SecureBucket:
     def delete_file(self, file_id: str) -> bool:
         """Delete a file from the bucket"""
         try:
-            if file_id in self.bucket_structure['files']:
-                # Remove file from bucket structure
-                del self.bucket_structure['files'][file_id]
-                
-                # Save updated bucket to IPFS
-                self._save_bucket()
-                return True
+            def remove(structure):
+                del structure['files'][file_id]
+            
+            with self._save_lock:
+                if file_id in self.bucket_structure['files']:
+                    # Save the bucket without the file to IPFS
+                    self._save_bucket({'op': 'delete_file', 'file_id': file_id}, mutate=remove)
+                    return True
             
             return False
         except Exception as e:
@@ -463,15 +498,17 @@ class SecureBucket:
     def clear_chat_history(self) -> Dict:
         """Clear all chat history from bucket"""
         try:
-            # Clear the chat history array
-            self.bucket_structure['chat_history'] = []
-            
-            # Save the updated bucket to IPFS
-            new_hash = self._save_bucket()
-            
-            # Update the bucket manager with new hash
             from app import bucket_manager
-            bucket_manager.update_bucket_hash(self.node_id, new_hash)
+            def clear(structure):
+                structure['chat_history'] = []
+            
+            with self._save_lock:
+                # Save the bucket with an empty chat history to IPFS
+                summary = {'op': 'clear_chat'}
+                new_hash = self._save_bucket(summary, mutate=clear)
+                
+                # Update the bucket manager with new hash
+                bucket_manager.update_bucket_hash(self.node_id, new_hash, summary)
             
             return {
                 'success': True,
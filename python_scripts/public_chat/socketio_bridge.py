@@ -0,0 +1,56 @@
+import queue
+import threading
+from typing import Dict
+from config import Config
+
+class SocketIOBridge:
+    """Hands events from P2P threads to Flask-SocketIO on one of its own background tasks"""
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self._events = queue.Queue()
+        self._started = False
+        self._start_lock = threading.Lock()
+        self.emitted = 0
+
+    @classmethod
+    def get_instance(cls) -> 'SocketIOBridge':
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def emit(self, event: str, data: Dict, **kwargs):
+        """Queue an event; safe to call from any thread, never blocks on the web server"""
+        self._events.put((event, data, kwargs))
+        if not self._started:
+            self._start()
+
+    def _start(self):
+        """Start the drain task in the server's async mode (thread, eventlet or gevent)"""
+        with self._start_lock:
+            if self._started:
+                return
+            from app import socketio
+            socketio.start_background_task(self._drain, socketio)
+            self._started = True
+
+    def _drain(self, socketio):
+        """Emit queued events; polls so a green thread never blocks on a native queue"""
+        while True:
+            while True:
+                try:
+                    event, data, kwargs = self._events.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    socketio.emit(event, data, **kwargs)
+                    self.emitted += 1
+                except Exception as e:
+                    print(f"Error emitting {event}: {e}")
+            socketio.sleep(Config.P2P_EMIT_INTERVAL)
+
+    @property
+    def pending(self) -> int:
+        return self._events.qsize()
@@ -0,0 +1,442 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+from config import Config
+
+def build_manifest(content: bytes, piece_size: int = None) -> Dict:
+    """Per-piece SHA-256 hashes of a file, plus a root hash identifying its content"""
+    piece_size = piece_size or Config.P2P_PIECE_SIZE
+    view = memoryview(content)
+    hashes = [hashlib.sha256(view[offset:offset + piece_size]).hexdigest()
+              for offset in range(0, len(view), piece_size)]
+    return {
+        'size': len(view),
+        'piece_size': piece_size,
+        'hashes': hashes,
+        'root': manifest_root(len(view), piece_size, hashes)
+    }
+
+def merkle_root(hashes: List[str]) -> str:
+    """Root of a binary SHA-256 Merkle tree over piece hashes; an unpaired node is carried up unchanged"""
+    level = [bytes.fromhex(piece_hash) for piece_hash in hashes]
+    if not level:
+        return hashlib.sha256(b'').hexdigest()
+    while len(level) > 1:
+        paired = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0].hex()
+
+def manifest_root(size: int, piece_size: int, hashes: List[str]) -> str:
+    """Content root binding the Merkle root to the file size and piece size"""
+    return hashlib.sha256(f"{size}:{piece_size}:{merkle_root(hashes)}".encode()).hexdigest()
+
+def valid_manifest(message: Dict) -> bool:
+    """Whether a manifest's piece hashes add up to its root"""
+    try:
+        size, piece_size, hashes = int(message['size']), int(message['piece_size']), list(message['hashes'])
+        if piece_size <= 0 or len(hashes) != -(-size // piece_size):
+            return False
+        return manifest_root(size, piece_size, hashes) == message.get('root')
+    except (KeyError, TypeError, ValueError):
+        return False
+
+class SwarmPeer:
+    """One source of a swarm download and how well it has been serving"""
+
+    def __init__(self, link, file_id: str):
+        self.link = link
+        self.file_id = file_id
+        self.have = set()  # Piece indexes this source can serve
+        self.ready = False  # Sent a manifest matching the download
+        self.outstanding = {}  # transfer_id -> IncomingTransfer
+        self.bytes_received = 0
+        self.busy_seconds = 0.0
+        self.failures = 0
+
+    @property
+    def throughput(self) -> float:
+        """Measured bytes per second; untried peers rank above slow ones"""
+        if not self.busy_seconds:
+            return float('inf') if not self.failures else 0.0
+        return self.bytes_received / self.busy_seconds
+
+class SwarmDownload:
+    """Fetches one file piece by piece from every source that has it"""
+
+    def __init__(self, network, filename: str, sources: List[tuple], root: str = None):
+        self.network = network
+        self.swarm_id = uuid.uuid4().hex
+        self.filename = filename
+        self.root = root  # Content root advertised in search results, if known
+        # Partial downloads are kept by content root, so any source of the same bytes can finish them
+        self.part_path = None
+        self.state_path = None
+        self.resumed = 0  # Pieces recovered from an earlier attempt
+        self.reserved = 0  # Bytes counted against the download quotas until the file is finished
+        self.last_error = None  # Most recent reason a source failed
+        self.peers = {}  # peer key -> SwarmPeer
+        for host, port, file_id, node_id in sources:
+            link = network.connect_to_peer(host, port, node_id)
+            self.peers.setdefault(link.key, SwarmPeer(link, file_id))
+
+        self.manifest = None
+        self.done = set()  # Verified piece indexes
+        self.assigned = {}  # piece index -> set of transfer_ids in flight
+        self.started_at = time.time()
+        self.finished = False
+        self._lock = threading.RLock()
+        self._timer = None
+        self._scheduling = False
+        self._reschedule = False
+
+    def start(self):
+        """Resume a saved partial download if there is one, and ask every source for its manifest"""
+        if self.root:
+            with self._lock:
+                if self._merge_duplicate(self.root):
+                    return
+            saved = self._load_state(self.network._partial_path(self.root) + '.json')
+            if saved and saved['root'] == self.root:
+                with self._lock:
+                    if not self._adopt(saved, saved.get('done', [])):
+                        return
+        for peer in list(self.peers.values()):
+            self._request_manifest(peer)
+        if self.manifest:
+            with self._lock:
+                self._check_progress()  # Everything may already be on disk
+        self._schedule_tick()
+
+    def _request_manifest(self, peer: SwarmPeer):
+        try:
+            peer.link.send({
+                'type': 'manifest_request',
+                'swarm_id': self.swarm_id,
+                'filename': self.filename,
+                'file_id': peer.file_id
+            })
+        except Exception as e:
+            print(f"Error requesting manifest from {peer.link.key}: {e}")
+            peer.failures = Config.P2P_SWARM_MAX_FAILURES
+
+    def add_sources(self, sources: List[tuple]) -> bool:
+        """Take more sources of the same content, e.g. from a duplicate download; False once finished"""
+        added = []
+        with self._lock:
+            if self.finished:
+                return False
+            for host, port, file_id, node_id in sources:
+                link = self.network.connect_to_peer(host, port, node_id)
+                if link.key not in self.peers:
+                    self.peers[link.key] = peer = SwarmPeer(link, file_id)
+                    added.append(peer)
+        for peer in added:
+            self._request_manifest(peer)
+        return True
+
+    def on_manifest(self, link, message: Dict):
+        """Adopt the first manifest received; only sources with the same content take part"""
+        with self._lock:
+            peer = self.peers.get(link.key)
+            if peer is None or self.finished:
+                return
+            if message.get('error'):
+                self.last_error = message['error']
+                peer.failures = Config.P2P_SWARM_MAX_FAILURES
+                self._check_progress()
+                return
+
+            if self.manifest is None:
+                if not valid_manifest(message) or (self.root and message['root'] != self.root):
+                    peer.failures = Config.P2P_SWARM_MAX_FAILURES
+                    self._check_progress()
+                    return
+                saved = self._load_state(self.network._partial_path(message['root']) + '.json')
+                if not self._adopt(message, saved.get('done', []) if saved and saved['root'] == message['root'] else []):
+                    return
+
+            if message.get('root') != self.manifest['root']:
+                print(f"Source {link.key} has a different {self.filename}, leaving it out of the swarm")
+                peer.failures = Config.P2P_SWARM_MAX_FAILURES
+                return
+
+            piece_count = len(self.manifest['hashes'])
+            have = message.get('have')
+            peer.have = set(range(piece_count)) if have is None else {i for i in have if 0 <= i < piece_count}
+            peer.ready = True
+            self._check_progress()
+
+    def _adopt(self, manifest: Dict, saved_pieces: List[int]) -> bool:
+        """Take a verified manifest and pick up whatever pieces an earlier attempt left on disk"""
+        if self._merge_duplicate(manifest['root']):
+            return False
+        if not self.network._reserve_space(manifest['size']):
+            self._fail(f"{manifest['size']} bytes do not fit in the download quota")
+            return False
+        self.reserved = manifest['size']
+        self.manifest = {key: manifest[key] for key in ('size', 'piece_size', 'hashes', 'root')}
+        base = self.network._partial_path(self.manifest['root'])
+        self.part_path, self.state_path = base + '.part', base + '.json'
+        if os.path.exists(self.part_path) and os.path.getsize(self.part_path) == self.manifest['size']:
+            self.done = self._verify_pieces(saved_pieces)
+        else:
+            with open(self.part_path, 'wb') as f:
+                f.truncate(self.manifest['size'])
+            self.done = set()
+        self.resumed = len(self.done)
+        if self.resumed:
+            print(f"Resuming {self.filename} with {self.resumed} of {len(self.manifest['hashes'])} pieces on disk")
+        self._save_state()
+        return True
+
+    def _merge_duplicate(self, root: str) -> bool:
+        """Claim some content for this download, or hand our sources to the one that already owns its partial files"""
+        existing = self.network._claim_root(self, root)
+        if existing is None:
+            return False
+        self.finished = True
+        self._cancel_outstanding()
+        existing.add_sources([(peer.link.address[0], peer.link.address[1], peer.file_id, peer.link.node_id)
+                              for peer in self.peers.values()])
+        self.network._swarm_finished(self, None, None)
+        return True
+
+    def _verify_pieces(self, pieces: List[int]) -> set:
+        """Pieces of the partial file that still match their hashes"""
+        piece_size = self.manifest['piece_size']
+        verified = set()
+        with open(self.part_path, 'rb') as f:
+            for piece in pieces:
+                if not isinstance(piece, int) or not 0 <= piece < len(self.manifest['hashes']):
+                    continue
+                f.seek(piece * piece_size)
+                if hashlib.sha256(f.read(piece_size)).hexdigest() == self.manifest['hashes'][piece]:
+                    verified.add(piece)
+        return verified
+
+    @staticmethod
+    def _load_state(path: str) -> Optional[Dict]:
+        """Saved progress of an interrupted download, if it is intact"""
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return state if isinstance(state, dict) and valid_manifest(state) else None
+
+    def _save_state(self):
+        """Record the manifest and verified pieces so the download survives restarts and lost sources"""
+        state = {**self.manifest, 'filename': self.filename, 'done': sorted(self.done), 'updated': time.time()}
+        try:
+            with open(self.state_path + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(self.state_path + '.tmp', self.state_path)
+        except OSError as e:
+            print(f"Error saving download state for {self.filename}: {e}")
+
+    def _alive_peers(self) -> List[SwarmPeer]:
+        return [peer for peer in self.peers.values() if peer.failures < Config.P2P_SWARM_MAX_FAILURES]
+
+    def _availability(self, piece: int) -> int:
+        return sum(1 for peer in self._alive_peers() if peer.ready and piece in peer.have)
+
+    def _next_piece(self, peer: SwarmPeer) -> Optional[int]:
+        """Rarest missing piece this peer can serve, or in the endgame a piece stuck on a slower peer"""
+        missing = [piece for piece in peer.have if piece not in self.done and not self.assigned.get(piece)]
+        if missing:
+            return min(missing, key=lambda piece: (self._availability(piece), piece))
+
+        # Endgame: duplicate a piece that has been in flight longer than this peer would take
+        # to fetch it; whichever copy lands first wins
+        if not peer.busy_seconds:
+            return None
+        now = time.time()
+        duplicates = []
+        for piece, transfer_ids in self.assigned.items():
+            if piece in self.done or piece not in peer.have or len(transfer_ids) > 1:
+                continue
+            if any(transfer_id in peer.outstanding for transfer_id in transfer_ids):
+                continue
+            holder = self._holder(next(iter(transfer_ids)))
+            transfer = holder.outstanding[next(iter(transfer_ids))] if holder else None
+            if transfer and now - transfer.started_at > 2 * transfer.length / peer.throughput:
+                duplicates.append((transfer.started_at, piece))
+        return min(duplicates)[1] if duplicates else None
+
+    def _holder(self, transfer_id: str) -> Optional[SwarmPeer]:
+        for peer in self.peers.values():
+            if transfer_id in peer.outstanding:
+                return peer
+        return None
+
+    def _schedule(self):
+        """Give idle pipeline slots to the fastest peers first"""
+        if self.manifest is None or self.finished:
+            return
+        # Co-located sources answer synchronously, so completions re-enter here; loop instead of recursing
+        if self._scheduling:
+            self._reschedule = True
+            return
+        self._scheduling = True
+        try:
+            self._reschedule = True
+            while self._reschedule and not self.finished:
+                self._reschedule = False
+                for peer in sorted(self._alive_peers(), key=lambda p: p.throughput, reverse=True):
+                    while peer.ready and not self.finished and len(peer.outstanding) < Config.P2P_SWARM_PIPELINE:
+                        piece = self._next_piece(peer)
+                        if piece is None:
+                            break
+                        self._request(peer, piece)
+        finally:
+            self._scheduling = False
+
+    def _request(self, peer: SwarmPeer, piece: int):
+        piece_size = self.manifest['piece_size']
+        offset = piece * piece_size
+        length = min(piece_size, self.manifest['size'] - offset)
+        transfer = self.network._open_range_download(
+            peer.link, self.filename, self.part_path, offset, length,
+            expected_sha256=self.manifest['hashes'][piece], owner=self
+        )
+        transfer.piece = piece
+        peer.outstanding[transfer.transfer_id] = transfer
+        self.assigned.setdefault(piece, set()).add(transfer.transfer_id)
+        try:
+            self.network._send_range_request(transfer, peer.file_id)
+        except Exception as e:
+            transfer.error = str(e)
+            self.network._abandon_download(transfer)
+            self.transfer_finished(transfer, False)
+
+    def transfer_finished(self, transfer, ok: bool):
+        """A piece request completed, failed verification, or timed out"""
+        with self._lock:
+            peer = self._holder(transfer.transfer_id)
+            if peer is None:
+                return
+            del peer.outstanding[transfer.transfer_id]
+            in_flight = self.assigned.get(transfer.piece, set())
+            in_flight.discard(transfer.transfer_id)
+            if not in_flight:
+                self.assigned.pop(transfer.piece, None)
+
+            if ok:
+                peer.bytes_received += transfer.received
+                peer.busy_seconds += time.time() - transfer.started_at
+                self.done.add(transfer.piece)
+                self._save_state()
+            else:
+                peer.failures += 1
+                self.last_error = transfer.error
+                print(f"Piece {transfer.piece} of {self.filename} from {peer.link.key} failed: {transfer.error}")
+            self._check_progress()
+
+    def _check_progress(self):
+        if self.finished:
+            return
+        if self.manifest and len(self.done) == len(self.manifest['hashes']):
+            self._complete()
+        elif not self._alive_peers():
+            self._fail(f"no sources left: {self.last_error}" if self.last_error else "no sources left")
+        else:
+            self._schedule()
+
+    def _tick(self):
+        """Reassign pieces that stalled, and let idle fast peers pick up endgame duplicates"""
+        with self._lock:
+            if self.finished:
+                return
+            if self.manifest is None and time.time() - self.started_at > Config.P2P_TRANSFER_TIMEOUT:
+                self._fail("no source sent a manifest")
+                return
+            now = time.time()
+            for peer in list(self.peers.values()):
+                for transfer in list(peer.outstanding.values()):
+                    expected = transfer.length / peer.throughput if peer.busy_seconds and peer.throughput else 0
+                    if now - transfer.last_activity > max(Config.P2P_SWARM_STALL_TIMEOUT, 4 * expected):
+                        transfer.error = "stalled"
+                        self.network._abandon_download(transfer)
+                        self.transfer_finished(transfer, False)
+            self._schedule()
+        self._schedule_tick()
+
+    def _schedule_tick(self):
+        if self.finished:
+            return
+        self._timer = self.network.endpoint.call_later(1.0, self._tick)
+
+    def _complete(self):
+        self.finished = True
+        self._cancel_outstanding()
+        final_path = self.network._download_path(self.filename)
+        shutil.move(self.part_path, final_path)  # The partial folder may be on another filesystem
+        self._release_space()  # The finished file is counted by the index instead
+        self.network._file_saved(final_path.name, self.manifest['root'])
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+        self.network._swarm_finished(self, f'/download_temp/{final_path.name}', None)
+
+    def _fail(self, reason: str):
+        self.finished = True
+        self._cancel_outstanding()
+        self._release_space()
+        if self.manifest and self.done:
+            # Verified pieces stay on disk; downloading the same content again resumes from them
+            reason += f" ({len(self.done)} of {len(self.manifest['hashes'])} pieces kept to resume)"
+        elif self.manifest:
+            for path in (self.part_path, self.state_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self.network._swarm_finished(self, None, f"Download of {self.filename} failed: {reason}")
+
+    def stop(self):
+        """Abandon the download when its node shuts down; verified pieces stay on disk to resume"""
+        with self._lock:
+            self.finished = True
+            self._cancel_outstanding()
+            self._release_space()
+
+    def _release_space(self):
+        if self.reserved:
+            self.network.temp_files.unreserve(self.reserved)
+            self.reserved = 0
+
+    def _cancel_outstanding(self):
+        if self._timer:
+            self._timer.cancel()
+        for peer in self.peers.values():
+            for transfer in list(peer.outstanding.values()):
+                self.network._abandon_download(transfer)
+            peer.outstanding.clear()
+        self.assigned.clear()
+
+    def stats(self) -> Dict:
+        """Progress and per-source throughput"""
+        with self._lock:
+            return {
+                'filename': self.filename,
+                'pieces': len(self.manifest['hashes']) if self.manifest else None,
+                'done': len(self.done),
+                'resumed': self.resumed,
+                'root': self.manifest['root'] if self.manifest else self.root,
+                'elapsed': time.time() - self.started_at,
+                'sources': [{
+                    'peer': list(peer.link.key),
+                    'bytes': peer.bytes_received,
+                    'throughput': peer.throughput if peer.busy_seconds else None,
+                    'outstanding': len(peer.outstanding),
+                    'failures': peer.failures
+                } for peer in self.peers.values()]
+            }
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+# Tests import the app's modules the way app.py does, from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from python_scripts.public_chat import chat_node, secure_bucket
+from python_scripts.public_chat.bucket_manager import BucketManager
+from python_scripts.public_chat.p2p_endpoint import P2PEndpoint
+from python_scripts.public_chat.socketio_bridge import SocketIOBridge
+
+class MemoryIPFS:
+    """Content-addressed store standing in for the IPFS API"""
+
+    def __init__(self):
+        self.blobs = {}
+        self.adds = 0
+        self.fail = False
+        self.gate = None  # Event an add waits on, to hold a save in flight
+        self._lock = threading.Lock()
+
+    def add_content(self, content):
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.fail:
+            raise ConnectionError("IPFS is unreachable")
+        content_hash = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            self.blobs[content_hash] = content
+            self.adds += 1
+        return content_hash
+
+    def get_content(self, content_hash):
+        return self.blobs.get(content_hash)
+
+@pytest.fixture
+def ipfs(monkeypatch):
+    store = MemoryIPFS()
+    monkeypatch.setattr(secure_bucket, 'IPFSHandler', lambda: store)
+    return store
+
+@pytest.fixture
+def bucket_manager(tmp_path, monkeypatch):
+    """A pointer store in a scratch directory, installed where SecureBucket imports it from"""
+    manager = BucketManager(str(tmp_path / 'buckets.db'), str(tmp_path / 'buckets.json'))
+    app = types.ModuleType('app')
+    app.bucket_manager = manager
+    monkeypatch.setitem(sys.modules, 'app', app)
+    yield manager
+    manager.close()
+
+@pytest.fixture
+def networks(monkeypatch):
+    """Stands in for each chat node's flood network and records the ones created"""
+    created = []
+
+    class StubNetwork:
+        def __init__(self, **kwargs):
+            self.temp_files = kwargs.get('temp_files')
+            self.last_activity = time.time()
+            self.stopped = False
+            created.append(self)
+
+        def shutdown(self):
+            self.stopped = True
+
+    monkeypatch.setattr(chat_node, 'P2PFloodNetwork', StubNetwork)
+    return created
+
+@pytest.fixture
+def endpoint(monkeypatch, tmp_path):
+    """A loopback endpoint standing in for the process-wide one, keeping partial downloads in tmp_path"""
+    monkeypatch.setattr(Config, 'P2P_PARTIAL_FOLDER', str(tmp_path / 'partial'))
+    endpoint = P2PEndpoint(host='127.0.0.1', port=0, advertise_host='127.0.0.1')
+    monkeypatch.setattr(P2PEndpoint, '_instance', endpoint)
+    monkeypatch.setattr(P2PEndpoint, '_node_resolver', None)
+    yield endpoint
+    endpoint.shutdown()
+
+@pytest.fixture
+def remote_endpoint():
+    """Factory for endpoints standing in for other servers"""
+    endpoints = []
+
+    def make():
+        endpoints.append(P2PEndpoint(host='127.0.0.1', port=0, advertise_host='127.0.0.1'))
+        return endpoints[-1]
+
+    yield make
+    for other in endpoints:
+        other.shutdown()
+
+@pytest.fixture
+def bridge(monkeypatch):
+    """Records the events P2P code would push to the browser"""
+
+    class RecordingBridge(SocketIOBridge):
+        def __init__(self):
+            super().__init__()
+            self.events = []
+
+        def emit(self, event, data, **kwargs):
+            self.events.append((event, data))
+
+        def of_type(self, event):
+            return [data for name, data in self.events if name == event]
+
+    recording = RecordingBridge()
+    monkeypatch.setattr(SocketIOBridge, '_instance', recording)
+    return recording
+
+def wait_for(condition, timeout=5):
+    """Poll until condition() holds; frames between endpoints arrive on other threads"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+class Catalog:
+    """File provider serving fixed contents, in the shape of a SecureBucket"""
+
+    def __init__(self, files=None):
+        self.files = {}
+        for name, content in (files or {}).items():
+            self.add(name, content)
+
+    def add(self, name, content):
+        file_id = hashlib.sha256(name.encode()).hexdigest()[:16]
+        self.files[file_id] = {'id': file_id, 'name': name, 'size': len(content), 'timestamp': time.time(),
+                               'content': content}
+        return file_id
+
+    def search_files(self, query):
+        return [{k: v for k, v in info.items() if k != 'content'}
+                for info in self.files.values() if query.lower() in info['name'].lower()]
+
+    def get_file_content(self, file_id):
+        info = self.files.get(file_id)
+        return info['content'] if info else None
@@ -0,0 +1,138 @@
+import json
+import time
+
+import pytest
+
+from python_scripts.public_chat.bucket_manager import BucketManager
+
+@pytest.fixture
+def store(tmp_path):
+    return str(tmp_path / 'buckets.db'), str(tmp_path / 'buckets.json')
+
+@pytest.fixture
+def manager(store):
+    manager = BucketManager(*store)
+    yield manager
+    manager.close()
+
+def test_updates_are_visible_at_once_and_committed_by_flush(manager, store):
+    manager.update_bucket_hash('1', 'h1')
+    manager.update_sent_requests_hash('1', 's1')
+    assert manager.get_bucket_hash('1') == 'h1'
+    assert manager.flush(timeout=5)
+    manager.close()
+
+    reopened = BucketManager(*store)
+    try:
+        assert reopened.get_bucket_hash('1') == 'h1'
+        assert reopened.get_sent_requests_hash('1') == 's1'
+    finally:
+        reopened.close()
+
+def test_updates_queued_together_share_one_commit(manager):
+    commits = []
+    commit_pending = manager._commit_pending
+
+    def counting_commit():
+        if manager._pending:
+            commits.append(len(manager._pending))
+        commit_pending()
+
+    manager._commit_pending = counting_commit
+    manager.commit_interval = 0.5
+    for user_id in range(50):
+        manager.update_bucket_hash(str(user_id), f"h{user_id}")
+    assert manager.flush(timeout=5)
+    assert sum(commits) == 50
+    assert len(commits) <= 2
+
+def test_a_hash_update_keeps_the_request_hashes(manager, store):
+    manager.update_sent_requests_hash('1', 's1')
+    manager.update_received_requests_hash('1', 'r1')
+    manager.update_bucket_hash('1', 'h1')
+    manager.close()
+
+    reopened = BucketManager(*store)
+    try:
+        assert reopened.get_bucket_hash('1') == 'h1'
+        assert reopened.get_sent_requests_hash('1') == 's1'
+        assert reopened.get_received_requests_hash('1') == 'r1'
+    finally:
+        reopened.close()
+
+def test_the_legacy_json_file_is_imported_once(store):
+    db_file, buckets_file = store
+    with open(buckets_file, 'w') as f:
+        json.dump({'1': {'hash': 'legacy', 'created_at': 1.0}}, f)
+    first = BucketManager(*store)
+    assert first.get_bucket_hash('1') == 'legacy'
+    first.update_bucket_hash('1', 'newer')
+    first.close()
+
+    with open(buckets_file, 'w') as f:
+        json.dump({'1': {'hash': 'stale'}, '2': {'hash': 'stale'}}, f)
+    second = BucketManager(*store)
+    try:
+        assert second.get_bucket_hash('1') == 'newer'
+        assert not second.user_has_bucket('2')
+    finally:
+        second.close()
+
+def test_history_keeps_every_hash_with_its_summary(manager):
+    for i in range(3):
+        manager.update_bucket_hash('1', f"h{i}", {'op': 'add_message', 'i': i})
+    history = manager.get_bucket_history('1')
+    assert [entry['hash'] for entry in history] == ['h0', 'h1', 'h2']
+    assert history[1]['summary'] == {'op': 'add_message', 'i': 1}
+
+def test_changes_since_a_known_hash(manager):
+    for i in range(3):
+        manager.update_bucket_hash('1', f"h{i}")
+    assert [entry['hash'] for entry in manager.get_changes_since('1', 'h0')] == ['h1', 'h2']
+    assert manager.get_changes_since('1', 'h2') == []
+    assert manager.get_changes_since('1', 'unknown') is None
+
+def test_rollback_points_back_at_an_earlier_hash(manager):
+    for i in range(3):
+        manager.update_bucket_hash('1', f"h{i}")
+    assert manager.rollback_bucket('1', 'h0')
+    assert manager.get_bucket_hash('1') == 'h0'
+    assert manager.get_bucket_history('1')[-1]['summary'] == {'op': 'rollback', 'from': 'h2'}
+
+def test_rollback_to_a_hash_outside_the_chain_is_refused(manager):
+    manager.update_bucket_hash('1', 'h0')
+    assert not manager.rollback_bucket('1', 'elsewhere')
+    assert manager.get_bucket_hash('1') == 'h0'
+
+def test_history_is_capped(manager):
+    for i in range(manager.history_length + 5):
+        manager.update_bucket_hash('1', f"h{i}")
+    history = manager.get_bucket_history('1')
+    assert len(history) == manager.history_length
+    assert history[-1]['hash'] == f"h{manager.history_length + 4}"
+
+def test_other_managers_pick_up_committed_changes(manager, store):
+    other = BucketManager(*store)
+    try:
+        other.update_bucket_hash('2', 'theirs')
+        assert other.flush(timeout=5)
+        manager.refresh()  # The watcher thread may already have done this
+        assert manager.get_bucket_hash('2') == 'theirs'
+    finally:
+        other.close()
+
+def test_the_watcher_announces_only_other_writers_changes(manager, store):
+    announced = []
+    manager.subscribe(announced.append)
+    other = BucketManager(*store)
+    try:
+        manager.update_bucket_hash('1', 'mine')
+        other.update_bucket_hash('2', 'theirs')
+        assert manager.flush(timeout=5) and other.flush(timeout=5)
+        deadline = time.time() + 5
+        while not announced and time.time() < deadline:
+            time.sleep(0.05)
+        assert announced == [{'2'}]
+        assert manager.get_bucket_hash('2') == 'theirs'
+    finally:
+        other.close()
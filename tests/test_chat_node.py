@@ -0,0 +1,80 @@
+import os
+import time
+
+import pytest
+
+from python_scripts.public_chat.chat_node import ChatNode
+from python_scripts.public_chat.secure_bucket import SecureBucket
+
+pytestmark = pytest.mark.usefixtures('networks')
+
+def test_reload_bucket_takes_the_state_another_worker_saved(ipfs, bucket_manager):
+    node = ChatNode('1', 'alice')
+    elsewhere = SecureBucket('1', 'alice')
+    bucket_hash = elsewhere.add_chat_message({'id': 'm1', 'content': 'hello', 'timestamp': time.time()})
+    sent_hash = elsewhere.add_file_request({'requester_id': '1', 'filename': 'a.txt'})['sent_hash']
+    received_hash = elsewhere.add_file_request({'requester_id': '2', 'filename': 'b.txt'})['received_hash']
+
+    node.reload_bucket(bucket_hash, sent_hash, received_hash)
+    assert [m['content'] for m in node.get_chat_history()] == ['hello']
+    requests = node.secure_bucket.get_requests()
+    assert [r['filename'] for r in requests['sent']] == ['a.txt']
+    assert [r['filename'] for r in requests['received']] == ['b.txt']
+
+def test_reload_bucket_skips_state_already_held(ipfs, bucket_manager):
+    node = ChatNode('1', 'alice')
+    bucket_hash = node.secure_bucket.add_chat_message({'id': 'm1', 'content': 'hello', 'timestamp': time.time()})
+    ipfs.blobs.clear()  # Nothing left to fetch, so a reload would fail
+    node.reload_bucket(bucket_hash, node.secure_bucket.sent_requests_hash, node.secure_bucket.received_requests_hash)
+    assert [m['content'] for m in node.get_chat_history()] == ['hello']
+
+def test_shutdown_writes_back_a_newer_local_save(ipfs, bucket_manager, networks):
+    node = ChatNode('1', 'alice')
+    node.p2p_network
+    bucket_hash = node.secure_bucket.add_chat_message({'id': 'm1', 'content': 'hello', 'timestamp': time.time()})
+    assert bucket_manager.get_bucket_hash('1') != bucket_hash
+
+    node.shutdown()
+    assert bucket_manager.get_bucket_hash('1') == bucket_hash
+    assert bucket_manager.get_bucket_history('1')[-1]['summary']['op'] == 'add_message'
+    assert networks[0].stopped
+    assert not node.p2p_started
+
+def test_shutdown_keeps_a_pointer_another_worker_saved(ipfs, bucket_manager):
+    node = ChatNode('1', 'alice')
+    elsewhere = SecureBucket('1', 'alice')
+    elsewhere.add_file(b'report', 'report.txt')
+    theirs = bucket_manager.get_bucket_hash('1')
+
+    node.secure_bucket.add_chat_message({'id': 'm1', 'content': 'hello', 'timestamp': time.time()})
+    node.shutdown()
+    assert bucket_manager.get_bucket_hash('1') == theirs
+
+def test_the_network_starts_on_first_use_and_stops_when_idle(ipfs, bucket_manager, networks):
+    node = ChatNode('1', 'alice')
+    assert not node.p2p_started and networks == []
+
+    network = node.p2p_network
+    assert node.p2p_started and node.p2p_network is network
+    assert not node.stop_idle_p2p(60)
+
+    network.last_activity -= 120
+    assert node.stop_idle_p2p(60)
+    assert network.stopped and not node.p2p_started
+    assert node.last_activity() == network.last_activity
+
+    assert node.p2p_network is not network
+    assert len(networks) == 2
+
+def test_downloads_outlive_idle_network_stops_but_not_the_node(ipfs, bucket_manager, networks):
+    node = ChatNode('1', 'alice')
+    assert node.downloads is None
+    downloads = node.p2p_network.temp_files
+    assert node.downloads is downloads and os.path.isdir(downloads.directory)
+
+    node.p2p_network.last_activity -= 120
+    assert node.stop_idle_p2p(60)
+    assert node.p2p_network.temp_files is downloads
+
+    node.shutdown()
+    assert node.downloads is None and not os.path.exists(downloads.directory)
@@ -0,0 +1,82 @@
+import pytest
+
+from python_scripts.public_chat.content_index import ContentIndex
+
+@pytest.fixture
+def make_index(tmp_path):
+    indexes = []
+
+    def make(name='node'):
+        directory = tmp_path / name
+        directory.mkdir()
+        index = ContentIndex(str(directory))
+        indexes.append(index)
+        return index
+    yield make
+    for index in indexes:
+        index.close()
+
+def write(index, name, size, last_access):
+    with open(f"{index.directory}/{name}", 'wb') as f:
+        f.write(b'x' * size)
+    entry = index.add(name, name.encode().hex())
+    entry.last_access = last_access
+    return entry
+
+def test_add_and_remove_track_bytes_and_hashes(make_index):
+    index = make_index()
+    write(index, 'a.bin', 100, 1)
+    assert index.total_bytes == 100
+    assert index.find('a.bin'.encode().hex()).name == 'a.bin'
+    index.remove('a.bin')
+    assert index.total_bytes == 0
+    assert index.find('a.bin'.encode().hex()) is None
+
+def test_rewriting_a_name_replaces_its_entry(make_index):
+    index = make_index()
+    write(index, 'a.bin', 100, 0)
+    write(index, 'a.bin', 5, 1)
+    assert len(index) == 1 and index.total_bytes == 5
+
+def test_evict_removes_least_recently_used_first(make_index):
+    index = make_index()
+    for access, name in enumerate(['old.bin', 'mid.bin', 'new.bin']):
+        write(index, name, 100, access)
+    assert index.evict(200) == ['old.bin']
+    assert sorted(index.files) == ['mid.bin', 'new.bin']
+    assert index.stats()['evicted_bytes'] == 100
+
+def test_pinned_and_kept_files_are_never_evicted(make_index):
+    index = make_index()
+    write(index, 'served.bin', 100, 0)
+    write(index, 'kept.bin', 100, 1)
+    write(index, 'other.bin', 100, 2)
+    index.acquire('served.bin')
+    assert index.evict(0, keep='kept.bin') == ['other.bin']
+    index.release('served.bin')
+    assert index.evict(0, keep='kept.bin') == ['served.bin']
+
+def test_reservations_count_against_the_quota(make_index):
+    index = make_index()
+    write(index, 'a.bin', 100, 0)
+    write(index, 'b.bin', 100, 1)
+    index.reserve(150)
+    assert index.used_bytes == 350
+    assert index.evict(300) == ['a.bin']
+    index.unreserve(150)
+    assert index.used_bytes == 100
+
+def test_global_eviction_spans_every_index(make_index):
+    first, second = make_index('first'), make_index('second')
+    write(first, 'a.bin', 100, 0)
+    write(second, 'b.bin', 100, 1)
+    write(first, 'c.bin', 100, 2)
+    assert ContentIndex.evict_global(ContentIndex.used_global() - 100) == 1
+    assert 'a.bin' not in first and 'b.bin' in second
+
+def test_close_deletes_the_directory(make_index, tmp_path):
+    index = make_index()
+    write(index, 'a.bin', 10, 0)
+    index.close()
+    assert not (tmp_path / 'node').exists()
+    assert index not in ContentIndex._open_indexes()
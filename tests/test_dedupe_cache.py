@@ -0,0 +1,45 @@
+import time
+
+from python_scripts.public_chat.dedupe_cache import RotatingDedupeCache
+
+def test_second_sighting_is_a_duplicate():
+    cache = RotatingDedupeCache()
+    assert cache.check_and_add('m1') is False
+    assert cache.check_and_add('m1') is True
+    assert 'm1' in cache
+    assert 'm2' not in cache
+
+def test_messages_without_an_id_are_never_duplicates():
+    cache = RotatingDedupeCache()
+    assert cache.check_and_add(None) is False
+    assert cache.check_and_add(None) is False
+
+def test_ids_are_forgotten_after_the_window():
+    cache = RotatingDedupeCache(window=0.2, generations=2)
+    cache.add('m1')
+    time.sleep(0.25)
+    assert cache.check_and_add('m1') is False
+
+def test_full_generation_rotates_early_and_keeps_earlier_ids():
+    cache = RotatingDedupeCache(window=60, generations=4, initial_capacity=16, max_capacity=64)
+    ids = [f"id-{i}" for i in range(40)]
+    for message_id in ids:
+        cache.add(message_id)
+    assert cache.early_rotations > 0
+    assert all(message_id in cache for message_id in ids)
+
+def test_no_false_positives_within_capacity():
+    cache = RotatingDedupeCache(initial_capacity=1000, error_rate=0.0001)
+    for i in range(500):
+        assert cache.check_and_add(f"seen-{i}") is False
+    assert sum(f"unseen-{i}" in cache for i in range(2000)) <= 2
+
+def test_stats_report_generations_and_fill():
+    cache = RotatingDedupeCache(initial_capacity=100)
+    for i in range(10):
+        cache.add(str(i))
+    stats = cache.stats()
+    assert stats['items'] == 10
+    assert stats['generations'] == len(stats['generation_fill']) == 1
+    assert 0 < stats['generation_fill'][0] <= 1
+    assert 0 <= stats['estimated_false_positive_rate'] < 0.001
@@ -0,0 +1,111 @@
+import random
+import socket
+
+import pytest
+
+from config import Config
+from python_scripts.dht.dht_node import DHTContact, DHTError, DHTNode
+from python_scripts.dht.group_dht import GroupDHT
+
+from conftest import wait_for
+
+@pytest.fixture(autouse=True)
+def wide_ring(monkeypatch):
+    monkeypatch.setattr(Config, 'DHT_RING_BITS', 32)  # Node positions never collide
+
+@pytest.fixture
+def make_node(tmp_path, monkeypatch):
+    """Factory for started loopback nodes, each stopped afterwards"""
+    monkeypatch.chdir(tmp_path)  # Nodes keep their storage files in the working directory
+    monkeypatch.setattr(Config, 'DHT_STABILIZE_INTERVAL', 0.05)
+    nodes = []
+
+    def make(user_id):
+        node = DHTNode('127.0.0.1', 0, user_id)
+        node.start()
+        nodes.append(node)
+        return node
+    yield make
+    for node in nodes:
+        node.stop()
+
+def owner_of(nodes, position):
+    """The first node at or after a position, found by brute force"""
+    ordered = sorted(nodes, key=lambda node: node.position)
+    return next((node for node in ordered if node.position >= position), ordered[0])
+
+def ring_settled(nodes):
+    """Whether following successors visits every node once and each successor points back"""
+    by_contact = {node.contact: node for node in nodes}
+    node, seen = nodes[0], []
+    for _ in nodes:
+        seen.append(node)
+        successor = by_contact.get(node.successor)
+        if successor is None or successor.predecessor != node.contact:
+            return False
+        node = successor
+    return node is nodes[0] and len(set(seen)) == len(nodes)
+
+def test_a_lone_node_stores_and_retrieves_locally(make_node):
+    node = make_node('solo')
+    assert node.store('greeting', 'hello')
+    assert node.retrieve('greeting') == 'hello'
+    assert node.retrieve('missing') is None
+
+def test_joined_nodes_settle_into_one_ring(make_node):
+    nodes = [make_node('0')]
+    for user_id in range(1, 5):
+        node = make_node(str(user_id))
+        assert node.join(nodes[0].contact)
+        nodes.append(node)
+    assert wait_for(lambda: ring_settled(nodes), timeout=10)
+
+    for index in range(6):
+        key = f"key{index}"
+        assert nodes[index % 5].store(key, index)
+        assert owner_of(nodes, nodes[0].key_position(key)).get_data(key) == index
+        assert nodes[(index + 2) % 5].retrieve(key) == index
+
+def test_iterative_lookups_find_the_owner_through_other_nodes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    group = GroupDHT('g')
+    for user_id in range(8):
+        group.add_member(user_id, '127.0.0.1', 0)
+    try:
+        nodes = list(group.nodes.values())
+        rng = random.Random(7)
+        for _ in range(30):
+            start = rng.choice(nodes)
+            position = rng.randrange(start.ring_size)
+            found, hops = start.find_successor(position)
+            assert found == owner_of(nodes, position).contact
+            assert hops <= Config.DHT_RING_BITS
+        stats = group.stats()
+        assert sum(node['lookups'] for node in stats.values()) >= 30
+        assert max(node['max_hops'] for node in stats.values()) >= 1  # Some lookups left their start node
+    finally:
+        for node in group.nodes.values():
+            node.stop()
+
+def test_an_unanswered_request_is_resent_then_given_up(make_node, monkeypatch):
+    monkeypatch.setattr(Config, 'DHT_REQUEST_TIMEOUT', 0.05)
+    node = make_node('a')
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    silent.bind(('127.0.0.1', 0))
+    try:
+        contact = DHTContact('127.0.0.1', silent.getsockname()[1], 0)
+        assert node._request(contact, {'type': 'ping'}) is None
+    finally:
+        silent.close()
+    assert node.requests_sent == Config.DHT_REQUEST_RETRIES + 1
+    assert node.retries == Config.DHT_REQUEST_RETRIES
+    assert node.timeouts == Config.DHT_REQUEST_RETRIES + 1
+
+def test_a_value_too_big_for_one_datagram_is_refused(make_node):
+    first, second = make_node('a'), make_node('b')
+    assert second.join(first.contact)
+    assert wait_for(lambda: ring_settled([first, second]))
+    key = next(f"key{index}" for index in range(1000)
+               if owner_of([first, second], first.key_position(f"key{index}")) is second)
+    with pytest.raises(DHTError):
+        first.store(key, 'x' * Config.DHT_MAX_DATAGRAM)
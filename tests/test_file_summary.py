@@ -0,0 +1,123 @@
+import threading
+import zlib
+
+import pytest
+
+from config import Config
+from python_scripts.public_chat.file_summary import AttenuatedBloomFilter, FileSummaries, name_grams
+
+from conftest import Catalog
+
+@pytest.fixture(autouse=True)
+def small_summaries(monkeypatch):
+    monkeypatch.setattr(Config, 'P2P_SUMMARY_BITS', 4096)
+
+class RecordingLink:
+    def __init__(self, node_id):
+        self.key = ('10.0.0.1', 9000, node_id)
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+class Node:
+    """The parts of a flood network FileSummaries reads"""
+
+    def __init__(self, node_id, files=()):
+        self.node_id = node_id
+        self.file_provider = Catalog({name: b'' for name in files})
+        self.peers = {}
+        self._lock = threading.Lock()
+        self.summaries = FileSummaries(self)
+
+    def link(self, *node_ids):
+        links = [RecordingLink(node_id) for node_id in node_ids]
+        self.peers.update((link.key, link) for link in links)
+        return links
+
+def deliver(sender, receiver, node_id):
+    """Hand the summaries sent over a link to the node at the other end"""
+    [link] = [link for link in sender.peers.values() if link.key[2] == node_id]
+    for message in link.sent:
+        receiver.summaries.on_summary(message, receiver.peers[('10.0.0.1', 9000, sender.node_id)])
+    link.sent.clear()
+
+def test_a_substring_query_shares_every_trigram_with_the_names_it_matches():
+    assert name_grams('port') <= name_grams('Quarterly-REPORT.txt')
+    assert not name_grams('port') <= name_grams('notes.txt')
+    assert name_grams('ab') == set()
+
+def test_the_nearest_matching_level_is_reported_within_the_hops_left():
+    summary = AttenuatedBloomFilter()
+    for gram in name_grams('report.txt'):
+        summary.levels[2].add(gram)
+    assert summary.matches(name_grams('report'), 2) == 2
+    assert summary.matches(name_grams('report'), 1) is None
+    assert summary.matches(name_grams('invoice'), 2) is None
+
+def test_searches_skip_neighbours_whose_summaries_cannot_match():
+    searcher = Node('a')
+    holder, other, fresh = searcher.link('b', 'c', 'd')
+    for node in (Node('b', ['report.txt']), Node('c', ['notes.txt'])):
+        node.link('a')
+        node.summaries.refresh()
+        deliver(node, searcher, 'a')
+
+    assert searcher.summaries.route('report', [holder, other, fresh], 1) == [holder, fresh]
+    assert searcher.summaries.links_pruned == 1
+
+def test_short_queries_go_to_every_neighbour():
+    searcher = Node('a')
+    links = searcher.link('b', 'c')
+    for link in links:
+        searcher.summaries.neighbours[link.key] = AttenuatedBloomFilter()
+    assert searcher.summaries.route('re', links, 1) == links
+
+def test_a_search_beyond_the_horizon_still_probes_a_few_neighbours(monkeypatch):
+    monkeypatch.setattr(Config, 'P2P_SUMMARY_FANOUT', 1)
+    searcher = Node('a')
+    links = searcher.link('b', 'c', 'd')
+    for link in links:
+        searcher.summaries.neighbours[link.key] = AttenuatedBloomFilter()
+
+    assert searcher.summaries.route('report', links, Config.P2P_SUMMARY_DEPTH - 1) == []
+    assert len(searcher.summaries.route('report', links, Config.P2P_SUMMARY_DEPTH)) == 1
+
+def test_deeper_levels_hold_what_neighbours_can_reach():
+    middle = Node('b', ['notes.txt'])
+    middle.link('a')
+    far = Node('a', ['report.txt'])
+    far.link('b')
+    far.summaries.refresh()
+    deliver(far, middle, 'b')
+
+    middle.summaries.refresh()
+    assert middle.summaries.own.matches(name_grams('notes'), 0) == 0
+    assert middle.summaries.own.matches(name_grams('report'), 2) == 1
+
+def test_only_changed_levels_are_resent():
+    node = Node('a', ['report.txt'])
+    [link] = node.link('b')
+    node.summaries.refresh()
+    assert link.sent[-1]['levels'] == list(range(Config.P2P_SUMMARY_DEPTH))
+
+    node.summaries.refresh()
+    assert len(link.sent) == 1
+    node.file_provider.add('invoice.txt', b'')
+    node.summaries.refresh()
+    assert link.sent[-1]['levels'] == [0]
+
+@pytest.mark.parametrize('tamper', [
+    lambda message: {**message, 'num_bits': 1 << 40},
+    lambda message: {**message, 'levels': [0, 0, 1]},
+    lambda message: {**message, 'data': zlib.compress(bytes(64 * 1024 * 1024))},
+    lambda message: {**message, 'data': b'not zlib'},
+])
+def test_malformed_summaries_are_ignored(tamper):
+    sender, receiver = Node('a', ['report.txt']), Node('b')
+    [link] = sender.link('b')
+    [back] = receiver.link('a')
+    sender.summaries.refresh()
+
+    receiver.summaries.on_summary(tamper(link.sent[-1]), back)
+    assert receiver.summaries.neighbours == {}
@@ -0,0 +1,141 @@
+import hashlib
+import os
+import threading
+
+from python_scripts.public_chat.file_transfer import IncomingTransfer, OutgoingTransfer, expire_transfers
+
+class RecordingLink:
+    key = ('127.0.0.1', 1, 'peer')
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+    def of_type(self, message_type):
+        return [message for message in self.sent if message['type'] == message_type]
+
+def make_file(tmp_path, content=bytes(range(40))):
+    path = tmp_path / 'shared.bin'
+    path.write_bytes(content)
+    return str(path), content
+
+def test_sender_stops_at_the_window_until_acked(tmp_path):
+    path, content = make_file(tmp_path)
+    link = RecordingLink()
+    upload = OutgoingTransfer(link, 't1', 'shared.bin', path, chunk_size=4, window=2)
+    upload.begin()
+    assert [chunk['offset'] for chunk in link.of_type('file_chunk')] == [0, 4]
+
+    upload.on_ack(4)
+    assert [chunk['offset'] for chunk in link.of_type('file_chunk')] == [0, 4, 8]
+    upload.close()
+
+def test_sender_digest_covers_only_the_requested_range(tmp_path):
+    path, content = make_file(tmp_path)
+    link = RecordingLink()
+    upload = OutgoingTransfer(link, 't1', 'shared.bin', path, offset=8, length=12, chunk_size=4, window=16)
+    upload.begin()
+    [end] = link.of_type('file_end')
+    assert end['length'] == 12
+    assert end['sha256'] == hashlib.sha256(content[8:20]).hexdigest()
+    assert b''.join(chunk['data'].read() for chunk in link.of_type('file_chunk')) == content[8:20]
+    upload.on_ack(20)
+    assert upload.done
+    upload.close()
+
+def test_manifest_digest_is_sent_without_hashing(tmp_path):
+    path, _ = make_file(tmp_path)
+    link = RecordingLink()
+    upload = OutgoingTransfer(link, 't1', 'shared.bin', path, chunk_size=64, sha256='ab' * 32)
+    upload.begin()
+    assert upload.hasher is None
+    assert link.of_type('file_end')[0]['sha256'] == 'ab' * 32
+    upload.close()
+
+def test_close_releases_the_file_once_and_stops_sending(tmp_path):
+    path, _ = make_file(tmp_path)
+    link = RecordingLink()
+    released = []
+    upload = OutgoingTransfer(link, 't1', 'shared.bin', path, chunk_size=4, window=1,
+                              on_close=lambda: released.append(True))
+    upload.begin()
+    [region] = [chunk['data'] for chunk in link.of_type('file_chunk')]
+    upload.close()
+    upload.close()
+    assert region.closed
+    assert released == [True]
+    upload.on_ack(4)
+    assert len(link.of_type('file_chunk')) == 1
+
+def receive(tmp_path, content, chunks, expected_sha256=None):
+    download = IncomingTransfer(RecordingLink(), 't1', 'shared.bin', str(tmp_path / 'part'), 0, len(content),
+                                expected_sha256=expected_sha256)
+    for offset, data in chunks:
+        if not download.on_chunk(offset, data):
+            download.close()
+            return download, False
+    return download, download.finish({'length': len(content), 'sha256': hashlib.sha256(content).hexdigest()})
+
+def test_receiver_accepts_an_intact_range_and_acks_each_chunk(tmp_path):
+    content = b'abcdefgh'
+    download, ok = receive(tmp_path, content, [(0, content[:4]), (4, content[4:])])
+    assert ok
+    assert [ack['offset'] for ack in download.link.of_type('file_ack')] == [4, 8]
+    assert (tmp_path / 'part').read_bytes() == content
+
+def test_receiver_writes_without_positional_io(tmp_path, monkeypatch):
+    # Windows has no os.pwrite or os.pread
+    monkeypatch.delattr(os, 'pwrite', raising=False)
+    monkeypatch.delattr(os, 'pread', raising=False)
+    (tmp_path / 'part').write_bytes(b'-' * 8)
+    content = b'abcd'
+    download = IncomingTransfer(RecordingLink(), 't1', 'shared.bin', str(tmp_path / 'part'), 4, len(content))
+    assert download.on_chunk(4, content)
+    assert download.finish({'length': 4, 'sha256': hashlib.sha256(content).hexdigest()})
+    assert (tmp_path / 'part').read_bytes() == b'----abcd'
+
+def test_receiver_rejects_a_corrupted_chunk(tmp_path):
+    content = b'abcdefgh'
+    download, ok = receive(tmp_path, content, [(0, b'abcd'), (4, b'XXXX')])
+    assert not ok
+    assert download.error == "Checksum mismatch"
+
+def test_receiver_rejects_a_gap(tmp_path):
+    download, ok = receive(tmp_path, b'abcdefgh', [(0, b'abcd'), (6, b'gh')])
+    assert not ok
+    assert 'Expected chunk at offset 4' in download.error
+
+def test_manifest_digest_overrides_the_senders(tmp_path):
+    content = b'abcdefgh'
+    _, ok = receive(tmp_path, content, [(0, content)], expected_sha256=hashlib.sha256(b'other').hexdigest())
+    assert not ok
+
+def test_chunks_racing_a_close_are_refused_not_written(tmp_path):
+    download = IncomingTransfer(RecordingLink(), 't1', 'shared.bin', str(tmp_path / 'part'), 0, 1 << 20)
+    results = []
+
+    def write():
+        offset = 0
+        while download.on_chunk(offset, b'x' * 64):
+            offset += 64
+        results.append(download.error)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    download.close()
+    writer.join(timeout=5)
+    assert results == ["Transfer was closed"]
+    assert download.closed
+
+def test_expire_transfers_returns_idle_ones(tmp_path):
+    path, _ = make_file(tmp_path)
+    idle = OutgoingTransfer(RecordingLink(), 'idle', 'shared.bin', path)
+    fresh = OutgoingTransfer(RecordingLink(), 'fresh', 'shared.bin', path)
+    idle.last_activity -= 100
+    transfers = {'idle': idle, 'fresh': fresh}
+    assert expire_transfers(transfers, timeout=10) == [idle]
+    assert list(transfers) == ['fresh']
+    idle.close()
+    fresh.close()
@@ -0,0 +1,32 @@
+import random
+
+import pytest
+
+from config import Config
+from python_scripts.public_chat.flood_simulator import FloodSimulator, build_topology
+
+@pytest.mark.parametrize('topology', ['random', 'small_world', 'scale_free'])
+def test_topologies_are_simple_graphs_near_the_requested_degree(topology):
+    edges = build_topology(topology, 60, 4, random.Random(1))
+    assert all(0 <= a < b < 60 for a, b in edges)
+    assert 60 <= len(edges) <= 2 * 60 * 4 // 2
+    assert {node for edge in edges for node in edge} == set(range(60))
+
+def test_a_flooded_overlay_finds_every_holder(monkeypatch):
+    monkeypatch.setattr(Config, 'P2P_SEARCH_DEADLINE', 0.5)
+    min_degree = Config.P2P_MIN_DEGREE
+    simulator = FloodSimulator(nodes=12, servers=3, titles=10, files_per_node=2, file_size=8 * 1024, seed=3)
+    simulator.start()
+    try:
+        assert simulator.wait_for_overlay(timeout=10)
+        searches = simulator.run_searches(queries=10, rate=0, strategy='flood')
+        assert searches['recall'] == 1.0
+        assert searches['answered'] > 0
+        assert 0 < searches['amplification'] <= searches['messages_per_query']
+
+        downloads = simulator.run_downloads(downloads=2, timeout=10)
+        assert downloads['completed'] == downloads['started'] > 0
+        assert simulator.describe()['degree']['p0'] > 0
+    finally:
+        simulator.stop()
+    assert Config.P2P_MIN_DEGREE == min_degree
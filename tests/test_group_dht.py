@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from config import Config
+from python_scripts.dht.dht_node import DHTContact
+from python_scripts.dht.group_dht import GroupDHT
+
+class RingPosition:
+    """Stand-in for a DHTNode that only has a place on the ring"""
+
+    def __init__(self, position):
+        self.position = position
+        self.contact = DHTContact('127.0.0.1', position + 1, position)
+
+def build_ring(positions):
+    group = GroupDHT('g')
+    for user_id, position in enumerate(positions):
+        node = RingPosition(position)
+        group.nodes[user_id] = node
+        group._update_node_list(node)
+    group._update_finger_tables()
+    return group
+
+def brute_successor(group, position):
+    later = [node for node in group.node_list if node.position >= position]
+    return later[0] if later else group.node_list[0]
+
+@pytest.mark.parametrize('bits', [4, 10, 32])
+@pytest.mark.parametrize('count', [1, 2, 3, 17, 100])
+def test_fingers_and_neighbours_match_a_brute_force_ring(monkeypatch, bits, count):
+    monkeypatch.setattr(Config, 'DHT_RING_BITS', bits)
+    ring_size = 2 ** bits
+    rng = random.Random(bits * 1000 + count)
+    group = build_ring(rng.randrange(ring_size) for _ in range(count))
+
+    for index, node in enumerate(group.node_list):
+        assert node.successor == group.node_list[(index + 1) % count].contact
+        assert node.predecessor == group.node_list[index - 1].contact
+        for bit in range(bits):
+            target = (node.position + 2 ** bit) % ring_size
+            assert node.finger_table[2 ** bit] == brute_successor(group, target).contact
+
+def test_successor_is_the_first_node_at_or_after_a_position(monkeypatch):
+    monkeypatch.setattr(Config, 'DHT_RING_BITS', 8)
+    group = build_ring([10, 100, 200])
+    assert group._find_successor(10).position == 10
+    assert group._find_successor(11).position == 100
+    assert group._find_successor(150).position == 200
+    assert group._find_successor(201).position == 10  # Wraps around
+
+def test_removal_joins_the_neighbours_of_the_gap(monkeypatch):
+    monkeypatch.setattr(Config, 'DHT_RING_BITS', 8)
+    group = build_ring([10, 100, 200])
+    group._remove_from_list(group.nodes[1])
+    del group.nodes[1]
+    group._update_finger_tables()
+    first, last = group.node_list
+    assert first.successor == last.contact and last.predecessor == first.contact
+    assert first.finger_table[1] == last.contact
+
+@pytest.fixture
+def group(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # Nodes keep their storage files in the working directory
+    group = GroupDHT('g')
+    yield group
+    for user_id in list(group.nodes):
+        group.remove_member(user_id)
+
+def test_members_can_be_re_added_on_the_same_port(group):
+    for user_id in range(3):
+        group.add_member(user_id, '127.0.0.1', 0)
+    port = group.nodes[1].port
+    group.remove_member(1)
+    replaced = group.add_member(1, '127.0.0.1', port)
+    assert replaced.port == port
+    again = group.add_member(1, '127.0.0.1', port)  # Replacing a live member frees its port first
+    assert again.port == port and len(group.node_list) == 3
+
+def test_messages_round_trip_through_member_nodes(group):
+    for user_id in range(3):
+        group.add_member(user_id, '127.0.0.1', 0)
+    group.store_message({'sender_id': 0, 'content': 'hello'})
+    group.store_message({'sender_id': 2, 'content': 'world'})
+    assert sorted(message['content'] for message in group.get_messages()) == ['hello', 'world']
@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+
+from python_scripts.public_chat.node_registry import ChatNodeRegistry
+
+pytestmark = pytest.mark.usefixtures('ipfs', 'bucket_manager', 'endpoint')
+
+def make_registry(max_nodes=10, idle_timeout=60):
+    return ChatNodeRegistry(max_nodes=max_nodes, idle_timeout=idle_timeout, reap_interval=3600)
+
+def test_least_recently_used_nodes_are_evicted_and_shut_down(networks):
+    registry = make_registry(max_nodes=2)
+    first = registry.get_or_create('1', 'alice')
+    registry.get_or_create('2', 'bob').p2p_network
+    registry.get('1')
+    registry.get_or_create('3', 'carol').p2p_network
+
+    assert sorted(registry.keys()) == ['1', '3']
+    assert registry.get('1') is first
+    assert registry.stats()['evictions'] == 1
+    assert [network.stopped for network in networks] == [True, False]
+
+def test_idle_nodes_are_evicted(networks):
+    registry = make_registry(idle_timeout=60)
+    registry.get_or_create('1', 'alice').p2p_network
+    registry.get_or_create('2', 'bob')
+    registry._last_access['1'] -= 120
+    networks[0].last_activity -= 120
+
+    assert registry.evict_idle() == 1
+    assert registry.keys() == ['2']
+
+def test_peer_traffic_keeps_a_node_alive(networks):
+    registry = make_registry(idle_timeout=60)
+    registry.get_or_create('1', 'alice').p2p_network
+    registry._last_access['1'] -= 120
+    assert registry.evict_idle() == 0
+
+def test_concurrent_creation_keeps_one_node(networks):
+    registry = make_registry()
+    barrier = threading.Barrier(6)
+    nodes = []
+
+    def create():
+        barrier.wait()
+        nodes.append(registry.get_or_create('1', 'alice'))
+
+    threads = [threading.Thread(target=create) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(node) for node in nodes}) == 1
+    assert len(registry) == 1
+
+def test_idle_networks_are_stopped_while_their_nodes_stay(networks):
+    registry = make_registry()
+    registry.get_or_create('1', 'alice').p2p_network
+    registry.get_or_create('2', 'bob').p2p_network
+    assert registry.stats()['live_p2p_networks'] == 2
+    networks[0].last_activity -= registry.p2p_idle_timeout + 1
+
+    assert registry.stop_idle_networks() == 1
+    assert networks[0].stopped and not networks[1].stopped
+    assert registry.stats()['live_p2p_networks'] == 1
+    assert len(registry) == 2
+
+def test_traffic_for_a_stopped_network_starts_it_again(endpoint, networks):
+    registry = make_registry()
+    node = registry.get_or_create('1', 'alice')
+    assert not node.p2p_started
+    assert endpoint._resolve('1') is node.p2p_network
+    assert endpoint._resolve('2') is None
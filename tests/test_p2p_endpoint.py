@@ -0,0 +1,160 @@
+import os
+import socket
+import threading
+
+from config import Config
+from python_scripts.public_chat import p2p_endpoint
+from python_scripts.public_chat.p2p_endpoint import P2PEndpoint, PeerConnection, PeerLink
+from python_scripts.public_chat.p2p_protocol import encode_message
+
+from conftest import wait_for
+
+class RecordingNetwork:
+    """Just enough of a flood network to be routed to"""
+
+    def __init__(self, endpoint, node_id):
+        self.endpoint = endpoint
+        self.node_id = node_id
+        self.received = []
+        self.dropped = []
+        endpoint.register(self)
+
+    def handle_message(self, message, link):
+        self.received.append((message, link))
+
+    def drop_peer(self, key):
+        self.dropped.append(tuple(key))
+
+    def drop_peers_at(self, address):
+        self.dropped.append(tuple(address))
+
+def test_local_frames_are_delivered_in_memory_by_node_id(endpoint):
+    alice, bob = RecordingNetwork(endpoint, 'a'), RecordingNetwork(endpoint, 'b')
+    PeerLink(alice, endpoint.address, 'b').send({'type': 'ping', 'id': 'p1'})
+
+    [(message, link)] = bob.received
+    assert message == {'type': 'ping', 'id': 'p1'}
+    assert link.node_id == 'a' and link.network is bob
+    assert alice.received == []
+    assert endpoint.stats()['frames_local'] == 1
+
+def test_frames_cross_endpoints_and_replies_find_their_way_back(endpoint, remote_endpoint):
+    other = remote_endpoint()
+    alice, bob = RecordingNetwork(endpoint, 'a'), RecordingNetwork(other, 'b')
+    PeerLink(alice, other.address, 'b').send({'type': 'ping', 'id': 'p1'})
+    assert wait_for(lambda: bob.received)
+
+    _, reply_link = bob.received[0]
+    assert reply_link.address == endpoint.address
+    reply_link.send({'type': 'pong', 'id': 'p2'})
+    assert wait_for(lambda: alice.received)
+    assert alice.received[0][0]['type'] == 'pong'
+    assert len(endpoint.connections) == 1 and other.stats()['frames_routed'] == 1
+
+def test_frames_for_a_stopped_node_go_through_the_resolver(endpoint):
+    alice = RecordingNetwork(endpoint, 'a')
+    revived = []
+
+    def resolve(node_id):
+        if node_id == 'b':
+            revived.append(RecordingNetwork(endpoint, 'b'))
+            return revived[-1]
+        return None
+
+    P2PEndpoint.set_node_resolver(resolve)
+    PeerLink(alice, endpoint.address, 'b').send({'type': 'ping', 'id': 'p1'})
+    PeerLink(alice, endpoint.address, 'c').send({'type': 'ping', 'id': 'p2'})
+    assert [message['id'] for message, _ in revived[0].received] == ['p1']
+
+def test_unregistering_drops_co_located_links(endpoint):
+    alice, bob = RecordingNetwork(endpoint, 'a'), RecordingNetwork(endpoint, 'b')
+    endpoint.unregister(bob)
+    assert endpoint.local_networks() == [alice]
+    assert alice.dropped == [(endpoint.host, endpoint.port, 'b')]
+
+def test_a_peer_speaking_garbage_is_cut_off_without_disturbing_others(endpoint, remote_endpoint):
+    bob = RecordingNetwork(endpoint, 'b')
+    rogue = socket.create_connection(endpoint.address, timeout=5)
+    rogue.sendall(b'\xff' * 64)
+    assert rogue.recv(1) == b''
+    rogue.close()
+
+    other = remote_endpoint()
+    alice = RecordingNetwork(other, 'a')
+    PeerLink(alice, endpoint.address, 'b').send({'type': 'ping', 'id': 'p1'})
+    assert wait_for(lambda: bob.received)
+
+def test_one_loop_thread_serves_every_connection(endpoint):
+    bob = RecordingNetwork(endpoint, 'b')
+    threads = threading.active_count()
+    clients = [socket.create_connection(endpoint.address, timeout=5) for _ in range(10)]
+    for i, client in enumerate(clients):
+        client.sendall(encode_message({'src': f'a{i}', 'dst': 'b', 'src_addr': ['127.0.0.1', 1]},
+                                      {'type': 'ping', 'id': str(i)}))
+    assert wait_for(lambda: len(bob.received) == len(clients))
+    # Only the handler pool may have grown; no thread per connection
+    assert threading.active_count() - threads <= Config.P2P_HANDLER_THREADS
+    for client in clients:
+        client.close()
+
+def test_frames_are_sent_whole_without_scatter_gather_io(endpoint, remote_endpoint, monkeypatch):
+    # Windows sockets have no sendmsg
+    monkeypatch.setattr(p2p_endpoint, 'HAS_SENDMSG', False)
+    other = remote_endpoint()
+    alice, bob = RecordingNetwork(endpoint, 'a'), RecordingNetwork(other, 'b')
+    data = os.urandom(300 * 1024)
+    for offset in range(0, len(data), 100 * 1024):
+        PeerLink(alice, other.address, 'b').send({'type': 'file_chunk', 'offset': offset,
+                                                  'data': data[offset:offset + 100 * 1024]})
+    assert wait_for(lambda: len(bob.received) == 3)
+    assert b''.join(message['data'] for message, _ in bob.received) == data
+
+def test_an_error_serving_one_connection_closes_only_that_one(endpoint, remote_endpoint, monkeypatch):
+    broken, healthy = remote_endpoint(), remote_endpoint()
+    alice = RecordingNetwork(endpoint, 'a')
+    bob, carol = RecordingNetwork(broken, 'b'), RecordingNetwork(healthy, 'c')
+    flush = PeerConnection.flush
+
+    def failing_flush(connection):
+        if connection.address[1] == broken.port:
+            raise RuntimeError("socket in a bad state")
+        return flush(connection)
+
+    monkeypatch.setattr(PeerConnection, 'flush', failing_flush)
+    PeerLink(alice, broken.address, 'b').send({'type': 'ping', 'id': 'p1'})
+    assert wait_for(lambda: tuple(broken.address) not in endpoint.connections)
+
+    PeerLink(alice, healthy.address, 'c').send({'type': 'ping', 'id': 'p2'})
+    assert wait_for(lambda: carol.received)
+    assert bob.received == []
+    assert endpoint.loop_thread.is_alive()
+
+def test_flooded_searches_are_dropped_while_a_connection_is_backed_up(monkeypatch):
+    monkeypatch.setattr(Config, 'P2P_OUTBOUND_LIMIT', 100)
+    ours, theirs = socket.socketpair()
+    connection = PeerConnection(ours, ('127.0.0.1', 1))
+    assert connection.queue([b'x' * 200])
+    assert not connection.queue([b'search'], droppable=True)
+    connection.queue([b'response'])
+    assert connection.frames_dropped == 1 and connection.buffered == 208
+
+    assert connection.flush()
+    assert theirs.recv(1024) == b'x' * 200 + b'response'
+    stats = connection.stats()
+    assert stats['frames_sent'] == 2 and stats['buffered'] == 0
+    assert stats['send_latency_max_ms'] >= stats['send_latency_ms'] >= 0
+    connection.queue([b'search'], droppable=True)
+    assert connection.buffered == 6
+    ours.close()
+    theirs.close()
+
+def test_links_through_a_failed_connect_are_dropped(endpoint):
+    alice = RecordingNetwork(endpoint, 'a')
+    unused = socket.socket()
+    unused.bind(('127.0.0.1', 0))
+    address = unused.getsockname()
+    unused.close()
+
+    PeerLink(alice, address, 'b').send({'type': 'ping', 'id': 'p1'})
+    assert wait_for(lambda: address in alice.dropped)
+    assert address not in endpoint.connections
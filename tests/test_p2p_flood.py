@@ -0,0 +1,107 @@
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from config import Config
+from python_scripts.public_chat import p2p_endpoint
+from python_scripts.public_chat.p2p_flood import P2PFloodNetwork
+
+from conftest import Catalog, wait_for
+
+def test_co_located_networks_link_to_each_other(endpoint):
+    networks = [P2PFloodNetwork(str(i), f'user{i}') for i in range(3)]
+    for network in networks:
+        assert {key[2] for key in network.peers} == {other.node_id for other in networks} - {network.node_id}
+
+    networks[0].shutdown()
+    assert all((endpoint.host, endpoint.port, '0') not in network.peers for network in networks[1:])
+    for network in networks[1:]:
+        network.shutdown()
+
+def test_searches_reach_nodes_behind_other_endpoints(endpoint, remote_endpoint):
+    other = remote_endpoint()
+    searcher = P2PFloodNetwork('a', 'alice', endpoint=endpoint)
+    holder = P2PFloodNetwork('b', 'bob', file_provider=Catalog({'report.txt': b'numbers'}), endpoint=other)
+    searcher.connect_to_peer(other.host, other.port, 'b')
+    # The holder accepts the handshake, so floods also travel towards the searcher
+    assert wait_for(lambda: (endpoint.host, endpoint.port, 'a') in holder.peers)
+    assert wait_for(lambda: (other.host, other.port, 'b') in searcher.peers)
+
+    query_id = searcher.flood_search('report', 'flood')
+    assert wait_for(lambda: query_id in holder.processed_messages)
+    searcher.shutdown()
+    holder.shutdown()
+
+def test_searches_are_answered_from_the_owners_files(endpoint, remote_endpoint):
+    other = remote_endpoint()
+    catalog = Catalog({'report.txt': b'quarterly numbers', 'notes.txt': b'other'})
+    searcher = P2PFloodNetwork('a', 'alice', endpoint=endpoint)
+    holder = P2PFloodNetwork('b', 'bob', file_provider=catalog, endpoint=other)
+    searcher.connect_to_peer(other.host, other.port, 'b')
+    assert wait_for(lambda: (other.host, other.port, 'b') in searcher.peers)
+
+    searcher.flood_search('report')
+    assert wait_for(lambda: searcher.file_sources.get('report.txt'))
+    [file_id] = [info['id'] for info in catalog.search_files('report')]
+    assert searcher.file_sources['report.txt'] == [(other.host, other.port, file_id, 'b')]
+    assert 'notes.txt' not in searcher.file_sources
+    searcher.shutdown()
+    holder.shutdown()
+
+def test_a_search_reaching_a_node_along_several_paths_is_answered_once(endpoint):
+    searcher = P2PFloodNetwork('a', 'alice')
+    P2PFloodNetwork('b', 'bob')
+    P2PFloodNetwork('c', 'carol', file_provider=Catalog({'report.txt': b'numbers'}))
+    assert len(searcher.peers) == 2
+
+    searcher.flood_search('report')
+    assert wait_for(lambda: searcher.file_sources.get('report.txt'))
+    assert len(searcher.file_sources['report.txt']) == 1
+
+@pytest.mark.parametrize('sendfile', [True, False])
+def test_a_requested_file_is_saved_and_announced(endpoint, remote_endpoint, bridge, monkeypatch, sendfile):
+    # Without sendfile, as on Windows, file bodies are read into memory when queued
+    monkeypatch.setattr(p2p_endpoint, 'HAS_SENDFILE', sendfile and p2p_endpoint.HAS_SENDFILE)
+    monkeypatch.setattr(Config, 'P2P_CHUNK_SIZE', 1024)
+    content = os.urandom(100 * 1024)
+    other = remote_endpoint()
+    catalog = Catalog({'report.txt': content})
+    searcher = P2PFloodNetwork('a', 'alice', endpoint=endpoint)
+    P2PFloodNetwork('b', 'bob', file_provider=catalog, endpoint=other)
+    [file_id] = catalog.files
+
+    searcher.request_file('report.txt', (other.host, other.port, file_id, 'b'))
+    assert wait_for(lambda: bridge.of_type('download_ready'))
+    assert (Path(searcher.temp_directory) / 'report.txt').read_bytes() == content
+
+def test_search_hits_stream_in_and_the_search_completes(endpoint, monkeypatch):
+    monkeypatch.setattr(Config, 'P2P_SEARCH_DEADLINE', 0.3)
+    searcher = P2PFloodNetwork('a', 'alice')
+    for node_id in 'bc':
+        P2PFloodNetwork(node_id, node_id, file_provider=Catalog({f'report-{node_id}.txt': b'numbers'}))
+    streamed, completed = [], []
+
+    query_id = searcher.flood_search('report', 'flood',
+                                     on_results=lambda query_id, hits: streamed.extend(hits),
+                                     on_complete=lambda query_id, count, reason: completed.append((query_id, count, reason)))
+    assert wait_for(lambda: completed)
+    assert sorted(hit['node_id'] for hit in streamed) == ['b', 'c']
+    assert completed == [(query_id, 2, 'deadline')]
+    # Sources outlive the search so the hits can be downloaded
+    assert set(searcher.file_sources) == {'report-b.txt', 'report-c.txt'}
+
+def test_stale_partial_downloads_are_pruned(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'P2P_PARTIAL_FOLDER', str(tmp_path))
+    for node_id in ('a', 'b'):
+        (tmp_path / node_id).mkdir()
+    stale, fresh = tmp_path / 'a' / 'stale.part', tmp_path / 'b' / 'fresh.part'
+    stale.write_bytes(b'x')
+    fresh.write_bytes(b'y')
+    old = time.time() - Config.P2P_PARTIAL_MAX_AGE - 60
+    os.utime(stale, (old, old))
+
+    assert P2PFloodNetwork.prune_partials() == 1
+    assert not (tmp_path / 'a').exists()
+    assert fresh.exists()
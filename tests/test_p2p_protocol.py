@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from python_scripts.public_chat.p2p_protocol import (
+    FRAME_PREFIX, PROTOCOL_VERSION, FileRegion, FrameDecoder, ProtocolError, decode_message, encode_frame,
+    encode_message
+)
+
+def test_message_round_trip_carries_data_as_raw_body():
+    frame = encode_message({'src': 'a', 'dst': 'b'}, {'type': 'file_chunk', 'offset': 4, 'data': b'\x00\xffpayload'})
+    [(frame_type, header, body)] = FrameDecoder().feed(frame)
+    routing, message = decode_message(frame_type, header, body)
+    assert routing == {'src': 'a', 'dst': 'b'}
+    assert message == {'type': 'file_chunk', 'offset': 4, 'data': b'\x00\xffpayload'}
+
+def test_frames_split_across_reads_are_reassembled_in_order():
+    stream = b''.join(encode_frame(1, {'n': n}, bytes([n]) * n) for n in range(5))
+    decoder = FrameDecoder()
+    frames = []
+    for i in range(len(stream)):
+        frames += decoder.feed(stream[i:i + 1])
+    assert [(header['n'], body) for _, header, body in frames] == [(n, bytes([n]) * n) for n in range(5)]
+    assert decoder.buffered == 0
+
+def test_several_frames_in_one_read():
+    frames = FrameDecoder().feed(encode_frame(1, {'n': 1}) + encode_frame(2, {'n': 2}, b'xy'))
+    assert frames == [(1, {'n': 1}, b''), (2, {'n': 2}, b'xy')]
+
+def test_partial_frame_waits_for_the_rest():
+    frame = encode_frame(1, {'n': 1}, b'body')
+    decoder = FrameDecoder()
+    assert decoder.feed(frame[:-1]) == []
+    assert decoder.buffered == len(frame) - 1
+    assert len(decoder.feed(frame[-1:])) == 1
+
+def test_oversized_frame_is_rejected_before_it_is_buffered():
+    decoder = FrameDecoder(max_frame_size=64)
+    with pytest.raises(ProtocolError):
+        decoder.feed(FRAME_PREFIX.pack(PROTOCOL_VERSION, 1, 10, 1000))
+
+def test_unknown_version_is_rejected():
+    with pytest.raises(ProtocolError):
+        FrameDecoder().feed(FRAME_PREFIX.pack(PROTOCOL_VERSION + 1, 1, 0, 0))
+
+def test_invalid_header_is_rejected():
+    header = b'{not json'
+    with pytest.raises(ProtocolError):
+        FrameDecoder().feed(FRAME_PREFIX.pack(PROTOCOL_VERSION, 1, len(header), 0) + header)
+
+def test_file_region_body_is_read_from_the_file(tmp_path):
+    path = tmp_path / 'shared.bin'
+    path.write_bytes(b'0123456789')
+    with open(path, 'rb') as f:
+        frame = encode_message({}, {'type': 'file_chunk', 'data': FileRegion(f, 2, 5)})
+    [(frame_type, header, body)] = FrameDecoder().feed(frame)
+    assert body == b'23456'
+    assert header['body'] == {'type': 'file_chunk'}
+
+def test_file_region_shorter_than_file_raises(tmp_path):
+    path = tmp_path / 'short.bin'
+    path.write_bytes(b'abc')
+    with open(path, 'rb') as f:
+        with pytest.raises(ProtocolError):
+            FileRegion(f, 1, 10).read()
+
+def test_regions_of_one_file_read_concurrently_get_their_own_bytes(tmp_path):
+    path = tmp_path / 'shared.bin'
+    content = bytes(range(256)) * 64
+    path.write_bytes(content)
+    lock = threading.Lock()
+    mismatches = []
+    with open(path, 'rb') as f:
+        def read(offset):
+            region = FileRegion(f, offset, 1000, lock)
+            for _ in range(200):
+                if region.read() != content[offset:offset + 1000]:
+                    mismatches.append(offset)
+
+        readers = [threading.Thread(target=read, args=(offset,)) for offset in range(0, 8000, 1000)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+    assert mismatches == []
@@ -0,0 +1,171 @@
+import threading
+import time
+
+import pytest
+
+from config import Config
+from python_scripts.public_chat.p2p_endpoint import PeerLink
+from python_scripts.public_chat.peer_manager import PeerManager
+
+class RecordingEndpoint:
+    """Endpoint stand-in that records frames instead of sending them"""
+
+    def __init__(self):
+        self.host, self.port = self.address = ('127.0.0.1', 9000)
+        self.networks = {}
+        self.sent = []
+
+    def is_local(self, address):
+        return tuple(address) == self.address
+
+    def local_networks(self):
+        return list(self.networks.values())
+
+    def send_frame(self, address, frame):
+        self.sent.append((address, frame))
+
+class Node:
+    """The parts of a flood network PeerManager drives"""
+
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.endpoint = RecordingEndpoint()
+        self.host, self.port = self.endpoint.address
+        self.peers = {}
+        self.peer_manager = PeerManager(self)
+
+    def _attach_peer(self, link):
+        self.peers[link.key] = link
+
+    def _detach_peer(self, key):
+        self.peers.pop(tuple(key), None)
+
+    def link(self, node_id, host='10.0.0.1'):
+        return PeerLink(self, (host, 9000), node_id)
+
+    def sent(self, message_type):
+        return [(frame['dst'], frame['body']) for _, frame in self.endpoint.sent if frame['body']['type'] == message_type]
+
+def hello(node_id, degree):
+    return {'type': 'hello', 'node_id': node_id, 'host': '10.0.0.1', 'port': 9000, 'degree': degree}
+
+def neighbour(node, node_id, degree=Config.P2P_MIN_DEGREE):
+    """Link a remote node that introduced itself with the given degree"""
+    node.peer_manager.on_hello(hello(node_id, degree), node.link(node_id))
+    return node.peer_manager.states[node.link(node_id).key]
+
+def test_a_handshake_activates_the_link_on_both_sides():
+    alice, bob = Node('a'), Node('b')
+    assert alice.peer_manager.offer(alice.link('b'))
+    [(_, greeting)] = alice.sent('hello')
+    assert alice.peers == {}  # Not a neighbour until bob answers
+
+    bob.peer_manager.on_hello(greeting, bob.link('a'))
+    [(_, ack)] = bob.sent('hello_ack')
+    assert ack['accepted'] and list(bob.peers) == [bob.link('a').key]
+
+    alice.peer_manager.on_hello_ack(ack, alice.link('b'))
+    assert list(alice.peers) == [alice.link('b').key]
+    assert alice.peer_manager.degree == bob.peer_manager.degree == 1
+
+def test_a_node_never_links_to_itself():
+    alice = Node('a')
+    assert not alice.peer_manager.offer(alice.link('a'))
+    assert alice.endpoint.sent == []
+
+def test_a_full_node_refuses_with_other_peers_to_try(monkeypatch):
+    monkeypatch.setattr(Config, 'P2P_MAX_DEGREE', 2)
+    bob = Node('b')
+    neighbour(bob, 'c')
+    neighbour(bob, 'd')
+
+    newcomer = bob.link('e')
+    bob.peer_manager.on_hello(hello('e', Config.P2P_MIN_DEGREE), newcomer)
+    [ack] = [body for dst, body in bob.sent('hello_ack') if dst == 'e']
+    assert not ack['accepted']
+    assert sorted(node_id for _, _, node_id in ack['peers']) == ['c', 'd']
+    assert newcomer.key not in bob.peers and newcomer.key in bob.peer_manager.candidates
+
+def test_a_full_node_sheds_a_well_connected_neighbour_for_an_under_connected_one(monkeypatch):
+    monkeypatch.setattr(Config, 'P2P_MAX_DEGREE', 2)
+    bob = Node('b')
+    neighbour(bob, 'c', degree=Config.P2P_MIN_DEGREE + 1)
+    neighbour(bob, 'd', degree=Config.P2P_MIN_DEGREE + 5)
+
+    bob.peer_manager.on_hello(hello('e', 0), bob.link('e'))
+    [(shed, bye)] = bob.sent('bye')
+    assert shed == 'd'
+    assert [node_id for _, _, node_id in bye['peers']] == ['c']
+    assert sorted(key[2] for key in bob.peers) == ['c', 'e']
+
+def test_pongs_measure_the_round_trip_time(monkeypatch):
+    monkeypatch.setattr(Config, 'P2P_MIN_DEGREE', 1)
+    bob = Node('b')
+    state = neighbour(bob, 'c')
+
+    bob.peer_manager.maintain()
+    [(_, ping)] = bob.sent('ping')
+    bob.peer_manager.on_pong({'type': 'pong', 'nonce': 'stale', 'sent_at': ping['sent_at']}, state.link)
+    assert state.rtt is None
+
+    bob.peer_manager.on_pong({'type': 'pong', 'nonce': ping['nonce'], 'sent_at': ping['sent_at'] - 0.05}, state.link)
+    assert state.rtt >= 0.05
+    assert bob.peer_manager.stats()['rtt_ms']['c'] >= 50
+
+def test_silent_neighbours_are_pruned(monkeypatch):
+    monkeypatch.setattr(Config, 'P2P_MIN_DEGREE', 0)
+    bob = Node('b')
+    neighbour(bob, 'c').last_seen = time.time() - Config.P2P_PEER_TIMEOUT - 1
+    neighbour(bob, 'd')
+
+    bob.peer_manager.maintain()
+    assert [key[2] for key in bob.peers] == ['d']
+    assert bob.peer_manager.pruned == 1
+
+def test_an_under_connected_node_greets_the_peers_its_neighbours_suggest():
+    bob = Node('b')
+    neighbour(bob, 'c')
+    bob.peer_manager.on_peers({'type': 'peers', 'peers': [['10.0.0.1', 9000, 'd'], ['10.0.0.1', 9000, 'e'],
+                                                           ['127.0.0.1', 9000, 'b']]})
+    assert sorted(key[2] for key in bob.peer_manager.candidates) == ['d', 'e']
+
+    bob.peer_manager.maintain()
+    assert [dst for dst, _ in bob.sent('peers_request')] == ['c']
+    assert sorted(dst for dst, _ in bob.sent('hello')) == ['d', 'e']
+    assert bob.peer_manager.replaced == 2
+
+def test_the_slowest_neighbours_are_dropped_beyond_the_maximum(monkeypatch):
+    monkeypatch.setattr(Config, 'P2P_MIN_DEGREE', 1)
+    bob = Node('b')
+    for node_id, rtt in (('c', 0.01), ('d', 0.3), ('e', 0.02)):
+        neighbour(bob, node_id).rtt = rtt
+
+    monkeypatch.setattr(Config, 'P2P_MAX_DEGREE', 2)
+    bob.peer_manager.maintain()
+    assert sorted(key[2] for key in bob.peers) == ['c', 'e']
+    assert bob.link('d').key in bob.peer_manager.candidates
+
+@pytest.mark.parametrize('min_degree, greeted', [(1, True), (0, False)])
+def test_unknown_senders_are_offered_a_link_only_while_under_connected(monkeypatch, min_degree, greeted):
+    monkeypatch.setattr(Config, 'P2P_MIN_DEGREE', min_degree)
+    bob = Node('b')
+    bob.peer_manager.on_message(bob.link('c'))
+    assert bool(bob.sent('hello')) == greeted
+
+def test_concurrent_offers_never_exceed_the_maximum_degree(monkeypatch):
+    monkeypatch.setattr(Config, 'P2P_MAX_DEGREE', 4)
+    bob = Node('b')
+    barrier = threading.Barrier(16)
+
+    def offer(index):
+        barrier.wait()
+        bob.peer_manager.offer(bob.link(f'n{index}'))
+        bob.peer_manager._pending()
+
+    threads = [threading.Thread(target=offer, args=(index,)) for index in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(bob.peer_manager.states) == 4
+    assert len(bob.peer_manager.candidates) == 12
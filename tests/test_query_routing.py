@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+from config import Config
+from python_scripts.public_chat.p2p_flood import P2PFloodNetwork
+from python_scripts.public_chat.query_routing import QueryRouter, query_tokens
+
+from conftest import Catalog, wait_for
+
+class Link:
+    def __init__(self, node_id):
+        self.node_id = node_id
+
+def test_query_tokens_are_lower_case_words():
+    assert query_tokens('Annual-Report 2024.PDF') == ['annual', 'report', '2024', 'pdf']
+
+def test_neighbours_that_answered_similar_queries_rank_first():
+    router = QueryRouter()
+    for _ in range(3):
+        router.record_hit('annual report', 'b')
+    links = [Link('a'), Link('b'), Link('c')]
+    assert router.rank_neighbors('report 2024', links)[0].node_id == 'b'
+    assert router.neighbor_score('holiday photos', 'b') == 0
+
+def test_cached_hits_are_kept_once_per_holder_and_expire(monkeypatch):
+    monkeypatch.setattr(Config, 'P2P_HIT_CACHE_TTL', 0.1)
+    router = QueryRouter()
+    hit = {'filename': 'report.txt', 'node_id': 'e', 'file_id': 'f1', 'host': 'h', 'port': 1, 'query_id': 'q'}
+    router.cache_hit('Report ', hit)
+    router.cache_hit('report', hit)
+    assert router.cached_hits('REPORT') == [{k: v for k, v in hit.items() if k != 'query_id'}]
+    time.sleep(0.15)
+    assert router.cached_hits('report') == []
+
+@pytest.fixture
+def chain(endpoint, monkeypatch):
+    """Five nodes in a line, a - b - c - d - e, with report.txt held by e"""
+    monkeypatch.setattr(Config, 'P2P_LOCAL_PEERS', 0)
+    monkeypatch.setattr(Config, 'P2P_RING_DELAY', 0.05)
+    nodes = [P2PFloodNetwork(node_id, node_id) for node_id in 'abcd']
+    nodes.append(P2PFloodNetwork('e', 'e', file_provider=Catalog({'report.txt': b'numbers'})))
+    for left, right in zip(nodes, nodes[1:]):
+        left.connect_to_peer(endpoint.host, endpoint.port, right.node_id)
+        right.connect_to_peer(endpoint.host, endpoint.port, left.node_id)
+    return nodes
+
+def found(searcher):
+    return wait_for(lambda: [source[3] for source in searcher.file_sources.get('report.txt', [])] == ['e'])
+
+@pytest.mark.parametrize('strategy', ['flood', 'expanding_ring', 'random_walk'])
+def test_every_strategy_reaches_a_holder_four_hops_away(chain, strategy):
+    searcher = chain[0]
+    searcher.flood_search('report', strategy)
+    assert found(searcher)
+    assert searcher.router.stats()[strategy]['hits'] == 1
+
+def test_an_expanding_ring_widens_until_it_finds_the_holder(chain):
+    searcher = chain[0]
+    searcher.flood_search('report', 'expanding_ring')
+    assert found(searcher)
+    assert searcher.router.stats()['expanding_ring']['rings'] >= 2
+
+def test_repeated_queries_use_the_hit_cache_but_floods_do_not(chain):
+    searcher = chain[0]
+    searcher.flood_search('report', 'expanding_ring')
+    assert found(searcher)
+    time.sleep(0.5)  # Let the ring finish widening
+
+    messages = searcher.router.stats()['expanding_ring']['messages']
+    searcher.flood_search('report', 'expanding_ring')
+    assert found(searcher)
+    stats = searcher.router.stats()['expanding_ring']
+    assert stats['cache_answers'] == 1 and stats['messages'] == messages
+
+    searcher.flood_search('report', 'flood')
+    assert found(searcher)
+    assert searcher.router.stats()['flood'].get('cache_answers', 0) == 0
+    assert searcher.router.stats()['flood']['messages'] > 0
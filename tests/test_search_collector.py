@@ -0,0 +1,68 @@
+from python_scripts.public_chat.search_collector import SearchCollector
+
+class Scheduler:
+    """Holds call_later callbacks until the test fires them"""
+
+    def __init__(self):
+        self.timers = []
+
+    def __call__(self, delay, callback):
+        timer = Timer(delay, callback)
+        self.timers.append(timer)
+        return timer
+
+class Timer:
+    def __init__(self, delay, callback):
+        self.delay = delay
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+def collect(**kwargs):
+    streamed, completed = [], []
+    scheduler = Scheduler()
+    collector = SearchCollector('q1', 'report', 'flood', scheduler,
+                                on_results=lambda query_id, hits: streamed.extend(hits),
+                                on_complete=lambda query_id, count, reason: completed.append((count, reason)),
+                                **kwargs)
+    return collector, scheduler, streamed, completed
+
+def hit(node_id, file_id='f1'):
+    return {'node_id': node_id, 'file_id': file_id, 'filename': 'report.txt'}
+
+def test_hits_are_streamed_as_they_arrive_without_duplicates():
+    collector, _, streamed, completed = collect()
+    assert collector.add(hit('b'))
+    assert streamed == [hit('b')]
+    assert not collector.add(hit('b'))
+    assert collector.add(hit('b', 'f2'))
+    assert collector.hits == 2 and completed == []
+
+def test_the_deadline_completes_the_search_once():
+    collector, scheduler, _, completed = collect(deadline=2)
+    collector.add(hit('b'))
+    [timer] = scheduler.timers
+    assert timer.delay == 2
+    timer.callback()
+    collector.finish('shutdown')
+    assert completed == [(1, 'deadline')]
+    assert not collector.add(hit('c'))
+
+def test_reaching_the_quorum_completes_early_and_cancels_the_deadline():
+    collector, scheduler, streamed, completed = collect(quorum=2)
+    collector.add(hit('b'))
+    collector.add(hit('c'))
+    assert completed == [(2, 'quorum')]
+    assert scheduler.timers[0].cancelled
+    assert len(streamed) == 2
+
+def test_a_failing_listener_does_not_stop_collection():
+    def broken(query_id, hits):
+        raise RuntimeError("socket gone")
+
+    collector = SearchCollector('q1', 'report', 'flood', Scheduler(), on_results=broken)
+    assert collector.add(hit('b'))
+    assert collector.add(hit('c'))
+    assert collector.hits == 2
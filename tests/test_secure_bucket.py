@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+from python_scripts.public_chat.secure_bucket import SecureBucket
+
+def message(text):
+    return {'id': text, 'content': text, 'username': 'alice', 'timestamp': time.time()}
+
+def test_readers_see_the_saved_state_while_a_save_is_in_flight(ipfs, bucket_manager):
+    bucket = SecureBucket('1', 'alice')
+    bucket.add_chat_message(message('first'))
+
+    ipfs.gate = threading.Event()
+    writer = threading.Thread(target=bucket.add_chat_message, args=(message('second'),))
+    writer.start()
+    time.sleep(0.1)
+
+    seen = []
+    reader = threading.Thread(target=lambda: seen.append([m['content'] for m in bucket.get_chat_history()]))
+    reader.start()
+    reader.join(timeout=2)
+    assert not reader.is_alive(), "reader blocked behind a save"
+    assert seen == [['first']]
+
+    ipfs.gate.set()
+    writer.join(timeout=5)
+    assert [m['content'] for m in bucket.get_chat_history()] == ['first', 'second']
+
+def test_concurrent_writers_lose_no_messages(ipfs, bucket_manager):
+    bucket = SecureBucket('1', 'alice')
+
+    def write(worker):
+        for i in range(5):
+            bucket.add_chat_message(message(f'{worker}-{i}'))
+
+    writers = [threading.Thread(target=write, args=(worker,)) for worker in range(8)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    assert len(bucket.get_chat_history()) == 40
+    assert ipfs.adds == 40
+
+def test_failed_save_leaves_the_bucket_unchanged(ipfs, bucket_manager):
+    bucket = SecureBucket('1', 'alice')
+    bucket.add_file(b'report', 'report.txt')
+
+    ipfs.fail = True
+    with pytest.raises(ConnectionError):
+        bucket.add_file(b'notes', 'notes.txt')
+    assert [f['name'] for f in bucket.get_files()] == ['report.txt']
+    assert bucket_manager.get_bucket_hash('1') is not None
+
+def test_saved_requests_are_listed_by_direction(ipfs, bucket_manager):
+    bucket = SecureBucket('1', 'alice')
+    bucket.add_file_request({'requester_id': '1', 'filename': 'a.txt'})
+    bucket.add_file_request({'requester_id': '2', 'filename': 'b.txt'})
+    requests = bucket.get_requests()
+    assert [r['filename'] for r in requests['sent']] == ['a.txt']
+    assert [r['filename'] for r in requests['received']] == ['b.txt']
+    assert bucket_manager.get_sent_requests_hash('1') and bucket_manager.get_received_requests_hash('1')
+
+def test_each_saved_hash_is_recorded_with_what_changed(ipfs, bucket_manager):
+    bucket = SecureBucket('1', 'alice')
+    file_info = bucket.add_file(b'report', 'report.txt')
+    bucket_hash = bucket_manager.get_bucket_hash('1')
+    assert bucket.mutation_summary(bucket_hash) == {'op': 'add_file', 'file': file_info}
+    latest = bucket_manager.get_bucket_history('1')[-1]
+    assert latest['hash'] == bucket_hash
+    assert latest['summary'] == {'op': 'add_file', 'file': file_info}
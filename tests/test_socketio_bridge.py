@@ -0,0 +1,47 @@
+import sys
+import threading
+import time
+import types
+
+from python_scripts.public_chat.socketio_bridge import SocketIOBridge
+
+from conftest import wait_for
+
+class FakeSocketIO:
+    """Runs background tasks on threads and records emits, like Flask-SocketIO in threading mode"""
+
+    def __init__(self):
+        self.emitted = []
+        self.emitting_threads = set()
+
+    def start_background_task(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        return thread
+
+    def emit(self, event, data, **kwargs):
+        self.emitted.append((event, data, kwargs))
+        self.emitting_threads.add(threading.current_thread().name)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+def test_events_from_many_threads_are_emitted_from_one_task(monkeypatch):
+    socketio = FakeSocketIO()
+    app = types.ModuleType('app')
+    app.socketio = socketio
+    monkeypatch.setitem(sys.modules, 'app', app)
+    bridge = SocketIOBridge()
+
+    senders = [threading.Thread(target=bridge.emit, args=('download_ready', {'n': n}), kwargs={'room': 'r'})
+               for n in range(20)]
+    for sender in senders:
+        sender.start()
+    for sender in senders:
+        sender.join()
+
+    assert wait_for(lambda: bridge.emitted == 20)
+    assert sorted(data['n'] for _, data, _ in socketio.emitted) == list(range(20))
+    assert all(kwargs == {'room': 'r'} for _, _, kwargs in socketio.emitted)
+    assert len(socketio.emitting_threads) == 1
+    assert bridge.pending == 0
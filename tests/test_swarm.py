@@ -0,0 +1,154 @@
+import os
+import time
+
+import pytest
+
+from config import Config
+from python_scripts.public_chat.p2p_flood import P2PFloodNetwork
+from python_scripts.public_chat.swarm import build_manifest
+
+from conftest import Catalog, wait_for
+
+CONTENT = os.urandom(64 * 1024)
+
+@pytest.fixture(autouse=True)
+def small_pieces(monkeypatch):
+    monkeypatch.setattr(Config, 'P2P_PIECE_SIZE', 4096)
+    monkeypatch.setattr(Config, 'P2P_CHUNK_SIZE', 1024)
+    monkeypatch.setattr(Config, 'P2P_SWARM_STALL_TIMEOUT', 0.5)
+
+@pytest.fixture
+def swarm(endpoint, remote_endpoint, bridge):
+    """A downloader and two sources behind other servers, each holding report.bin"""
+    downloader = P2PFloodNetwork('a', 'alice', endpoint=endpoint)
+    sources = [P2PFloodNetwork(node_id, node_id, file_provider=Catalog({'report.bin': CONTENT}),
+                               endpoint=remote_endpoint()) for node_id in ('b', 'c')]
+    downloader.file_sources['report.bin'] = [
+        (source.host, source.port, next(iter(source.file_provider.files)), source.node_id) for source in sources
+    ]
+    return downloader, sources
+
+def downloaded(downloader, bridge, count=1):
+    assert wait_for(lambda: len(bridge.of_type('download_ready')) >= count, timeout=10), bridge.events
+    return downloader._download_path('report.bin').read_bytes()
+
+def test_pieces_come_from_every_source(swarm, bridge):
+    downloader, _ = swarm
+    download = downloader.download_file('report.bin')
+    assert downloaded(downloader, bridge) == CONTENT
+    assert all(source['bytes'] > 0 for source in download.stats()['sources'])
+    assert downloader.swarms == {}
+
+def test_finished_downloads_are_indexed_by_content_root(swarm, bridge):
+    downloader, _ = swarm
+    assert not downloader.has_file('report.bin')
+    downloader.download_file('report.bin')
+    downloaded(downloader, bridge)
+    assert downloader.has_file('report.bin')
+    assert downloader.get_file_id('report.bin') == build_manifest(CONTENT)['root']
+    assert downloader.temp_files.find(build_manifest(CONTENT)['root']).size == len(CONTENT)
+
+def test_a_download_larger_than_the_quota_fails(swarm, bridge, monkeypatch):
+    downloader, _ = swarm
+    monkeypatch.setattr(Config, 'P2P_NODE_DISK_QUOTA', len(CONTENT) - 1)
+    downloader.download_file('report.bin')
+    assert wait_for(lambda: bridge.of_type('download_error'), timeout=10)
+    assert 'do not fit in the download quota' in bridge.of_type('download_error')[0]['error']
+    assert len(downloader.temp_files) == 0 and downloader.temp_files.reserved_bytes == 0
+
+def test_older_downloads_are_evicted_to_stay_within_the_quota(swarm, bridge, monkeypatch):
+    downloader, _ = swarm
+    old_path = downloader._download_path('old.bin')
+    old_path.write_bytes(b'x' * 100)
+    downloader.temp_files.add('old.bin', 'f' * 64)
+    monkeypatch.setattr(Config, 'P2P_NODE_DISK_QUOTA', len(CONTENT) + 50)
+
+    downloader.download_file('report.bin')
+    assert downloaded(downloader, bridge) == CONTENT
+    assert not downloader.has_file('old.bin') and not old_path.exists()
+    assert downloader.temp_files.total_bytes == len(CONTENT)
+
+def test_pieces_from_a_stalled_source_are_reassigned(swarm, bridge):
+    downloader, (_, stalled) = swarm
+    ignored = []
+    stalled.handle_file_request = lambda message, link: ignored.append(message['offset'])
+    download = downloader.download_file('report.bin')
+    assert downloaded(downloader, bridge) == CONTENT
+    # The pieces asked of the stalled source were fetched from the other one instead
+    assert ignored
+    [stalled_stats] = [source for source in download.stats()['sources'] if source['peer'][2] == 'c']
+    assert stalled_stats['bytes'] == 0
+
+def test_sources_with_different_content_are_never_mixed(swarm, bridge):
+    downloader, (_, other) = swarm
+    other_content = os.urandom(len(CONTENT))
+    other.file_provider = Catalog({'report.bin': other_content})
+    download = downloader.download_file('report.bin')
+    # Whichever manifest arrives first decides the content; the other source sends nothing
+    content = downloaded(downloader, bridge)
+    assert content in (CONTENT, other_content)
+    assert sum(source['bytes'] > 0 for source in download.stats()['sources']) == 1
+
+def test_a_second_download_of_the_same_file_joins_the_first(swarm, bridge):
+    downloader, sources = swarm
+    for source in sources:
+        serving = source._get_serving_content
+
+        def slow_serving(file_id, serving=serving, **kwargs):
+            time.sleep(0.3)  # Both downloads start before either learns what the content is
+            return serving(file_id, **kwargs)
+
+        source._get_serving_content = slow_serving
+
+    first = downloader.download_file('report.bin')
+    second = downloader.download_file('report.bin')
+    assert downloaded(downloader, bridge) == CONTENT
+    time.sleep(0.5)
+    assert len(bridge.of_type('download_ready')) == 1
+    assert bridge.of_type('download_error') == []
+    assert first.finished and second.finished
+    assert downloader.swarms == {}
+
+def test_pieces_that_do_not_match_the_manifest_are_refetched_elsewhere(swarm, bridge, tmp_path):
+    downloader, (_, liar) = swarm
+    serving = liar._get_serving_content
+    other = tmp_path / 'other.bin'
+    other.write_bytes(os.urandom(len(CONTENT)))
+
+    def lying_serving(file_id, **kwargs):
+        _, manifest = serving(file_id, **kwargs)
+        return str(other), manifest  # Advertises the real content, sends other bytes
+
+    liar._get_serving_content = lying_serving
+    download = downloader.download_file('report.bin')
+    assert downloaded(downloader, bridge) == CONTENT
+    [liar_stats] = [source for source in download.stats()['sources'] if source['peer'][2] == 'c']
+    assert liar_stats['bytes'] == 0 and liar_stats['failures'] > 0
+
+def test_a_failed_download_resumes_from_the_pieces_on_disk(swarm, bridge):
+    downloader, sources = swarm
+    half = len(CONTENT) // 2
+    requested = []
+    for source in sources:
+        serve = source.handle_file_request
+
+        def first_half_only(message, link, serve=serve):
+            requested.append(message['offset'])
+            if message['offset'] >= half:
+                link.send({'type': 'file_end', 'transfer_id': message['transfer_id'], 'error': 'Piece unavailable'})
+            else:
+                serve(message, link)
+
+        source.handle_file_request = first_half_only
+
+    downloader.download_file('report.bin')
+    assert wait_for(lambda: bridge.of_type('download_error'), timeout=10)
+    assert 'kept to resume' in bridge.of_type('download_error')[0]['error']
+
+    requested.clear()
+    for source in sources:
+        del source.handle_file_request
+    second = downloader.download_file('report.bin')
+    assert downloaded(downloader, bridge) == CONTENT
+    assert second.resumed == half // Config.P2P_PIECE_SIZE
+    assert all(offset >= half for offset in requested)
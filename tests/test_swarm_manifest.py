@@ -0,0 +1,47 @@
+import hashlib
+import os
+
+from python_scripts.public_chat.swarm import build_manifest, merkle_root, valid_manifest
+
+def test_manifest_hashes_every_piece():
+    content = os.urandom(10 * 1024 + 5)
+    manifest = build_manifest(content, piece_size=1024)
+    assert manifest['size'] == len(content)
+    assert len(manifest['hashes']) == 11
+    assert manifest['hashes'][-1] == hashlib.sha256(content[10 * 1024:]).hexdigest()
+    assert valid_manifest(manifest)
+
+def test_root_identifies_content():
+    content = os.urandom(4096)
+    assert build_manifest(content, 1024)['root'] == build_manifest(bytes(content), 1024)['root']
+    assert build_manifest(content, 1024)['root'] != build_manifest(content[:-1] + b'\0', 1024)['root']
+    assert build_manifest(content, 1024)['root'] != build_manifest(content, 2048)['root']
+
+def test_merkle_root_pairs_hashes_and_carries_odd_ones_up():
+    a, b, c = (hashlib.sha256(x).hexdigest() for x in (b'a', b'b', b'c'))
+    ab = hashlib.sha256(bytes.fromhex(a) + bytes.fromhex(b)).digest()
+    assert merkle_root([a]) == a
+    assert merkle_root([a, b]) == ab.hex()
+    assert merkle_root([a, b, c]) == hashlib.sha256(ab + bytes.fromhex(c)).hexdigest()
+
+def test_empty_file_has_a_valid_manifest():
+    manifest = build_manifest(b'', 1024)
+    assert manifest['hashes'] == []
+    assert valid_manifest(manifest)
+
+def test_tampered_piece_hash_is_rejected():
+    manifest = build_manifest(os.urandom(3000), 1024)
+    manifest['hashes'][1] = hashlib.sha256(b'forged').hexdigest()
+    assert not valid_manifest(manifest)
+
+def test_wrong_size_or_piece_count_is_rejected():
+    manifest = build_manifest(os.urandom(3000), 1024)
+    assert not valid_manifest({**manifest, 'size': 5000})
+    assert not valid_manifest({**manifest, 'hashes': manifest['hashes'][:-1]})
+    assert not valid_manifest({**manifest, 'piece_size': 0})
+
+def test_malformed_manifests_are_rejected():
+    assert not valid_manifest({})
+    assert not valid_manifest({'size': 'x', 'piece_size': 1024, 'hashes': [], 'root': ''})
+    assert not valid_manifest({'size': 10, 'piece_size': 1024, 'hashes': ['zz'], 'root': ''})
+    assert not valid_manifest({'size': 10, 'piece_size': 1024, 'hashes': None, 'root': ''})